@@ -99,9 +99,15 @@ ML_MODELS_DIR = APP_DIR / "ml_models"
 # Get model filenames from environment variables with defaults
 TF_MODEL_FILENAME = os.getenv('TF_MODEL_FILENAME', 'CropLeaf-C1.h5')
 PT_MODEL_FILENAME = os.getenv('PT_MODEL_FILENAME', 'plant_disease_model_1_latest.pt')
+ONNX_MODEL_FILENAME = os.getenv('ONNX_MODEL_FILENAME', 'CropLeaf-C1.onnx')
+TFLITE_MODEL_FILENAME = os.getenv('TFLITE_MODEL_FILENAME', 'CropLeaf-C1-int8.tflite')
+TORCHSCRIPT_MODEL_FILENAME = os.getenv('TORCHSCRIPT_MODEL_FILENAME', 'plant_disease_model_1_latest.torchscript.pt')
 
 TF_MODEL_FILE = ML_MODELS_DIR / TF_MODEL_FILENAME
 PT_MODEL_FILE = ML_MODELS_DIR / PT_MODEL_FILENAME
+ONNX_MODEL_FILE = ML_MODELS_DIR / ONNX_MODEL_FILENAME
+TFLITE_MODEL_FILE = ML_MODELS_DIR / TFLITE_MODEL_FILENAME
+TORCHSCRIPT_MODEL_FILE = ML_MODELS_DIR / TORCHSCRIPT_MODEL_FILENAME
 
 # Model download is now handled by the download_models.py script during deployment
 # and by the ModelWrapper class when needed
@@ -196,6 +202,31 @@ if not os.getenv('DB_HOST'):
         }
     }
 
+# Cache
+# https://docs.djangoproject.com/en/5.1/topics/cache/
+# 'predictions' is shared by all workers: Redis when REDIS_URL is set,
+# otherwise a file cache on local disk
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'predictions': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.getenv('PREDICTION_CACHE_DIR', str(BASE_DIR / '.cache' / 'predictions')),
+        'TIMEOUT': int(os.getenv('PREDICTION_CACHE_TTL', '86400')),
+        'OPTIONS': {'MAX_ENTRIES': 5000},
+    },
+}
+
+if os.getenv('REDIS_URL'):
+    CACHES['predictions'] = {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.getenv('REDIS_URL'),
+        'TIMEOUT': int(os.getenv('PREDICTION_CACHE_TTL', '86400')),
+        'KEY_PREFIX': 'cropleaf',
+    }
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
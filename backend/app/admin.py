@@ -1,7 +1,7 @@
 from django.contrib import admin
 from .models import (
     Disease, Treatment, PreventionStrategy, FarmerProfile,
-    PredictionHistory, DashboardStats, MandiLocation,
+    PredictionHistory, PredictionJob, ShadowComparison, DashboardStats, MandiLocation,
     MarketplaceProduct, ProductInquiry, Transaction,
     WeatherData, WeatherForecast, Notification, NotificationPreference
 )
@@ -12,6 +12,8 @@ admin.site.register(Treatment)
 admin.site.register(PreventionStrategy)
 admin.site.register(FarmerProfile)
 admin.site.register(PredictionHistory)
+admin.site.register(PredictionJob)
+admin.site.register(ShadowComparison)
 admin.site.register(DashboardStats)
 admin.site.register(MandiLocation)
 admin.site.register(MarketplaceProduct)
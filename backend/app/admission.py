@@ -0,0 +1,256 @@
+import os
+import math
+import time
+import threading
+import contextvars
+from collections import deque
+from contextlib import contextmanager
+from functools import wraps
+
+
+class AdmissionRejected(Exception):
+    """Raised when a prediction is shed instead of being queued"""
+
+    def __init__(self, reason, retry_after):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """
+    Bounds how many predictions run at once in this process and sheds load early.
+
+    At most max_concurrent predictions run at a time; the rest wait for a
+    slot. Before a request starts waiting, its wait is estimated from the
+    number of requests ahead of it and the mean latency of the last
+    latency_window predictions. If that estimate exceeds wait_budget seconds,
+    or max_queue requests are already waiting, it is rejected immediately so
+    the client can retry elsewhere or later, instead of sitting in the queue
+    until gunicorn times it out after the inference has already been paid for.
+    A request that is admitted but still has not got a slot when the budget
+    runs out is shed as well.
+
+    A slot covers only the model call (see admission_slot), not reading the
+    upload or building the response, so slow clients do not hold one and
+    the latency window measures inference alone.
+
+    Requests can only queue here if a worker has more threads than
+    max_concurrent: the controller runs inside the request thread, so with
+    max_concurrent equal to GUNICORN_THREADS the backlog builds up in
+    gunicorn's own connection queue, out of sight. from_env therefore
+    defaults max_concurrent to half the threads. Time spent upstream before
+    a thread picked the request up is counted when the proxy sends an
+    X-Request-Start header (see request_queue_seconds).
+
+    Each gunicorn worker has its own controller; the limits apply per worker.
+    """
+
+    def __init__(self, max_concurrent=2, max_queue=16, wait_budget=10.0, latency_window=50,
+                 initial_latency=1.0):
+        self.max_concurrent = max(1, int(max_concurrent))
+        self.max_queue = max(0, int(max_queue))
+        self.wait_budget = float(wait_budget)
+        self.initial_latency = float(initial_latency)
+
+        self._slots = threading.BoundedSemaphore(self.max_concurrent)
+        self._lock = threading.Lock()
+        self._latencies = deque(maxlen=max(1, int(latency_window)))
+
+        self.in_flight = 0
+        self.queued = 0
+        self.admitted = 0
+        self.completed = 0
+        self.shed = {'queue_full': 0, 'wait_budget': 0, 'queue_timeout': 0}
+
+    @classmethod
+    def from_env(cls):
+        threads = int(os.getenv('GUNICORN_THREADS', '4'))
+        max_concurrent = int(os.getenv('ADMISSION_MAX_CONCURRENT', str(max(1, threads // 2))))
+        if threads > 1 and max_concurrent >= threads:
+            print(f"ADMISSION_MAX_CONCURRENT={max_concurrent} is not below GUNICORN_THREADS={threads}; "
+                  f"no request can queue in the admission controller, so it will never shed")
+        return cls(
+            max_concurrent=max_concurrent,
+            max_queue=int(os.getenv('ADMISSION_MAX_QUEUE', '16')),
+            wait_budget=float(os.getenv('ADMISSION_WAIT_BUDGET', '10')),
+            latency_window=int(os.getenv('ADMISSION_LATENCY_WINDOW', '50')),
+            initial_latency=float(os.getenv('ADMISSION_INITIAL_LATENCY', '1.0')),
+        )
+
+    def mean_latency(self):
+        """Mean latency in seconds of recent predictions (initial_latency until there are some)"""
+        latencies = list(self._latencies)
+        return sum(latencies) / len(latencies) if latencies else self.initial_latency
+
+    def estimated_wait(self, ahead=None):
+        """Seconds a request arriving now would wait for a slot"""
+        if ahead is None:
+            ahead = self.in_flight + self.queued
+        # Requests ahead of this one drain max_concurrent at a time
+        waves = max(0, ahead - self.max_concurrent + 1)
+        return math.ceil(waves / self.max_concurrent) * self.mean_latency()
+
+    def acquire(self, waited=0.0):
+        """
+        Take a slot, waiting if needed; raises AdmissionRejected when the request should be shed.
+
+        waited is how long the request already queued before reaching this
+        process; it is spent from the wait budget.
+        """
+        with self._lock:
+            if self.in_flight >= self.max_concurrent and self.queued >= self.max_queue:
+                self.shed['queue_full'] += 1
+                raise AdmissionRejected('queue_full', self._retry_after(self.estimated_wait()))
+
+            wait = self.estimated_wait() + waited
+            if wait > self.wait_budget:
+                self.shed['wait_budget'] += 1
+                raise AdmissionRejected('wait_budget', self._retry_after(self.estimated_wait()))
+            self.queued += 1
+
+        acquired = self._slots.acquire(timeout=max(0.0, self.wait_budget - waited))
+
+        with self._lock:
+            self.queued -= 1
+            if not acquired:
+                self.shed['queue_timeout'] += 1
+                raise AdmissionRejected('queue_timeout', self._retry_after(self.estimated_wait()))
+            self.in_flight += 1
+            self.admitted += 1
+        return time.perf_counter()
+
+    def release(self, started):
+        with self._lock:
+            self.in_flight -= 1
+            self.completed += 1
+            self._latencies.append(time.perf_counter() - started)
+        self._slots.release()
+
+    def stats(self):
+        """Return controller counters; latencies in milliseconds"""
+        latencies = sorted(self._latencies)
+        return {
+            'pid': os.getpid(),
+            'max_concurrent': self.max_concurrent,
+            'max_queue': self.max_queue,
+            'wait_budget_s': self.wait_budget,
+            'in_flight': self.in_flight,
+            'queued': self.queued,
+            'admitted': self.admitted,
+            'completed': self.completed,
+            'shed': dict(self.shed),
+            'shed_total': sum(self.shed.values()),
+            'latency_mean_ms': round(self.mean_latency() * 1000.0, 1),
+            'latency_p95_ms': round(latencies[int(len(latencies) * 0.95)] * 1000.0, 1) if latencies else None,
+            'estimated_wait_s': round(self.estimated_wait(), 2),
+        }
+
+    def _retry_after(self, wait):
+        return max(1, int(math.ceil(wait)))
+
+
+admission_controller = AdmissionController.from_env()
+
+
+def request_queue_seconds(request):
+    """
+    Seconds since the proxy received the request, from its X-Request-Start header; 0 without one.
+
+    Accepts 't=<value>' or a bare value in seconds (nginx), milliseconds
+    (Heroku, Render) or microseconds. Implausible values (clock skew) count as 0.
+    """
+    header = getattr(request, 'META', {}).get('HTTP_X_REQUEST_START', '')
+    try:
+        started = float(header.strip().removeprefix('t='))
+    except ValueError:
+        return 0.0
+    if started > 1e14:
+        started /= 1e6
+    elif started > 1e11:
+        started /= 1e3
+    age = time.time() - started
+    return age if 0.0 < age < 3600.0 else 0.0
+
+
+class _RequestAdmission:
+    """Admission state of one request handled by an admission_controlled view"""
+
+    def __init__(self, controller, waited):
+        self.controller = controller
+        self.waited = waited
+        self.rejection = None
+
+
+_request_admission = contextvars.ContextVar('request_admission', default=None)
+
+
+@contextmanager
+def admission_slot():
+    """
+    Hold an admission slot around a model call; raises AdmissionRejected when the request is shed.
+
+    Outside an admission_controlled view (prediction workers, the inference
+    server, warmup) this does nothing. Once a request has been shed, every
+    later model call in it is refused straight away, and the view's response
+    is replaced by a 503 even if the view swallowed the exception.
+    """
+    state = _request_admission.get()
+    if state is None:
+        yield
+        return
+    if state.rejection is not None:
+        raise state.rejection
+
+    # Upstream queueing is charged once, to the request's first model call
+    waited, state.waited = state.waited, 0.0
+    try:
+        started = state.controller.acquire(waited=waited)
+    except AdmissionRejected as e:
+        state.rejection = e
+        raise
+    try:
+        yield
+    finally:
+        state.controller.release(started)
+
+
+def admission_controlled(controller=None):
+    """
+    Subject the model calls a view makes to admission_controller.
+
+    The view runs as normal; its model calls take a slot through
+    admission_slot. Reading the upload, queueing an async job and cache hits
+    take none. If any model call is shed, the response is a 503 with a
+    Retry-After header. X-Request-Start is read on entry, so the upload
+    transfer that follows is not counted as queueing.
+    """
+    def decorator(view_func):
+        @wraps(view_func)
+        def wrapper(*args, **kwargs):
+            if os.getenv('ADMISSION_CONTROL_ENABLED', 'true').lower() != 'true':
+                return view_func(*args, **kwargs)
+
+            state = _RequestAdmission(controller or admission_controller,
+                                      request_queue_seconds(args[0]) if args else 0.0)
+            token = _request_admission.set(state)
+            try:
+                response = view_func(*args, **kwargs)
+            finally:
+                _request_admission.reset(token)
+
+            if state.rejection is None:
+                return response
+
+            from django.http import JsonResponse
+            e = state.rejection
+            print(f"Shedding prediction request ({e.reason}), retry after {e.retry_after}s")
+            response = JsonResponse({
+                'error': 'Server is busy, please retry shortly',
+                'reason': e.reason,
+                'retry_after': e.retry_after,
+            }, status=503)
+            response['Retry-After'] = str(e.retry_after)
+            return response
+        return wrapper
+    return decorator
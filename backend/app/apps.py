@@ -5,8 +5,8 @@ class AppConfig(AppConfig):
     name = 'app'
 
     def ready(self):
-        # Import model to ensure it's loaded when Django starts
-        # This helps with model initialization and signal connections
+        # Import the model registry; the models themselves load lazily on first
+        # use (or up front via gunicorn.conf.py when serving)
         try:
             from app import model
         except ImportError:
@@ -0,0 +1,154 @@
+import os
+import queue
+import threading
+import time
+
+import numpy as np
+
+
+class PendingPrediction:
+    """A single caller's images waiting to be run as part of a batch"""
+
+    def __init__(self, image_array):
+        self.image_array = image_array
+        self.rows = image_array.shape[0]
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class MicroBatcher:
+    """
+    Collects concurrent predict calls from request threads into batches.
+
+    A batch fires when it holds max_batch_size images or when max_wait_ms has
+    passed since its first image arrived, whichever comes first. Every caller
+    blocks until its batch has run and gets back only its own rows.
+    """
+
+    def __init__(self, predict_fn, max_batch_size=16, max_wait_ms=10):
+        self.predict_fn = predict_fn
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+
+        # Counters for monitoring how well requests are being coalesced
+        self.batches_run = 0
+        self.images_run = 0
+
+    def predict(self, image_array):
+        """Queue image_array for the next batch and wait for its predictions"""
+        image_array = np.asarray(image_array)
+
+        # Inputs that already fill a batch gain nothing from waiting
+        if image_array.shape[0] >= self.max_batch_size:
+            return self.predict_fn(image_array)
+
+        self._ensure_worker()
+        pending = PendingPrediction(image_array)
+        self._queue.put(pending)
+        while not pending.event.wait(timeout=1.0):
+            # close() may have stopped the scheduler just after this was queued
+            self._ensure_worker()
+
+        if pending.error is not None:
+            raise pending.error
+        return pending.result
+
+    def close(self):
+        """Stop the scheduler thread once the batches already queued have run"""
+        self._queue.put(None)
+
+    def stats(self):
+        """Return batching counters"""
+        return {
+            'batches_run': self.batches_run,
+            'images_run': self.images_run,
+            'average_batch_size': (self.images_run / self.batches_run) if self.batches_run else 0.0,
+            'max_batch_size': self.max_batch_size,
+            'max_wait_ms': self.max_wait * 1000.0,
+        }
+
+    def _ensure_worker(self):
+        pid = os.getpid()
+        if self._thread is not None and self._thread.is_alive() and self._pid == pid:
+            return
+
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive() and self._pid == pid:
+                return
+
+            # Threads do not survive a fork, so a forked worker starts its own
+            # scheduler with a fresh queue instead of reusing the parent's
+            if self._pid != pid:
+                self._queue = queue.Queue()
+                self._pid = pid
+
+            self._thread = threading.Thread(target=self._run, name='prediction-batcher', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        carry = None
+        closing = False
+        while not closing:
+            first = carry if carry is not None else self._queue.get()
+            carry = None
+            if first is None:
+                return
+
+            batch = [first]
+            rows = first.rows
+            deadline = time.monotonic() + self.max_wait
+
+            while rows < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    pending = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if pending is None:
+                    # Closed: run what was collected, then stop
+                    closing = True
+                    break
+
+                # Keep batches at or below max_batch_size; overflow starts the next one
+                if rows + pending.rows > self.max_batch_size:
+                    carry = pending
+                    break
+
+                batch.append(pending)
+                rows += pending.rows
+
+            self._execute(batch)
+
+    def _execute(self, batch):
+        # Images of different shapes cannot be stacked, so run each shape separately
+        groups = {}
+        for pending in batch:
+            groups.setdefault(pending.image_array.shape[1:], []).append(pending)
+
+        for group in groups.values():
+            try:
+                stacked = np.concatenate([p.image_array for p in group], axis=0)
+                predictions = np.asarray(self.predict_fn(stacked))
+
+                offset = 0
+                for pending in group:
+                    pending.result = predictions[offset:offset + pending.rows]
+                    offset += pending.rows
+
+                self.batches_run += 1
+                self.images_run += stacked.shape[0]
+            except Exception as e:
+                print(f"Batched prediction error: {str(e)}")
+                for pending in group:
+                    pending.error = e
+            finally:
+                for pending in group:
+                    pending.event.set()
@@ -0,0 +1,382 @@
+import os
+import json
+import time
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+
+# Words in a disease_class label that name its crop. Cercospora leaf spot is
+# the corn (grey leaf spot) disease in this dataset.
+CROP_KEYWORDS = (
+    ('Corn', ('corn', 'maize', 'cercospora')),
+    ('Potato', ('potato',)),
+    ('Tomato', ('tomato',)),
+)
+
+
+def crop_groups(classes):
+    """OrderedDict of crop -> [(index, label)] for the labels of a multi-crop classifier"""
+    groups = OrderedDict()
+    for index, label in enumerate(classes):
+        crop = crop_for_label(label)
+        if crop is not None:
+            groups.setdefault(crop, []).append((index, label))
+    return groups
+
+
+def crop_for_label(label):
+    """Crop a disease label belongs to by its name, or None"""
+    lowered = (label or '').lower()
+    for crop, keywords in CROP_KEYWORDS:
+        if any(keyword in lowered for keyword in keywords):
+            return crop
+    return None
+
+
+class CropHead:
+    """
+    A small PyTorch classifier over a fixed list of labels: one crop's
+    diseases, or the crops themselves for the first stage.
+
+    Duck-types the parts of ModelWrapper that predict_cached uses, so head
+    predictions share the prediction cache under their own namespace.
+    """
+
+    model_type = 'pytorch'
+
+    def __init__(self, name, path, classes):
+        self.name = name
+        self.path = path
+        self.classes = list(classes)
+        self.model = None
+        self.spec = None
+
+    def load(self):
+        from app.model import import_torch
+
+        torch = import_torch()
+        from app.torch_models import build_model_from_checkpoint, load_torchscript
+
+        start = time.perf_counter()
+        if self.path.endswith('.torchscript.pt'):
+            model, spec = load_torchscript(self.path)
+        else:
+            checkpoint = torch.load(self.path, map_location=torch.device('cpu'))
+            if isinstance(checkpoint, torch.nn.Module):
+                model = checkpoint.eval()
+                spec = {'architecture': type(checkpoint).__name__, 'input_size': None, 'mean': None, 'std': None}
+            else:
+                model, spec = build_model_from_checkpoint(checkpoint)
+
+        # A pickled module or TorchScript file does not say how many classes it has; a dummy
+        # forward pass does, and a mismatch would map outputs to the wrong labels
+        self.model = model.to(memory_format=torch.channels_last)
+        self.spec = spec
+        spec['num_classes'] = int(self.predict(np.zeros((1, 256, 256, 3), dtype=np.uint8)).shape[1])
+        if spec['num_classes'] != len(self.classes):
+            self.model = self.spec = None
+            raise ValueError(f"{os.path.basename(self.path)} predicts {spec['num_classes']} classes, "
+                             f"but {self.name} has {len(self.classes)} labels")
+        print(f"Crop head {self.name} ({spec['architecture']}) loaded in {time.perf_counter() - start:.2f}s")
+        return self
+
+    def version(self):
+        return f"crop-head:{self.name}:{os.path.basename(self.path)}:{int(os.path.getmtime(self.path))}"
+
+    def predict(self, image_array):
+        import torch
+        from app.torch_models import prepare_input
+
+        image_tensor = prepare_input(np.ascontiguousarray(image_array), self.spec)
+        with torch.inference_mode():
+            probabilities = torch.nn.functional.softmax(self.model(image_tensor), dim=1)
+        return probabilities.numpy()
+
+    def predict_batched(self, image_array):
+        return self.predict(image_array)
+
+
+class CropRouter:
+    """
+    Two-stage classification: pick the crop first, then run only that crop's
+    disease head.
+
+    The crop comes from the user (crop_type on the request) when it names a
+    known crop, otherwise from the crop classifier. Heads are loaded on first
+    use, at most max_loaded disease heads at a time (least recently used goes
+    first), and unloaded after idle_seconds without traffic, so a worker only
+    holds the crops it is actually asked about.
+
+    Crops without a head file, or images whose crop is uncertain, go through
+    the monolithic model; when the crop is known its output is restricted to
+    that crop's classes.
+
+    Heads live in CROP_HEADS_DIR (default app/ml_models/crop_heads). By
+    default there is one head per crop in disease_class, named <crop>.pt, and
+    a crop_classifier.pt over the same crops. A heads.json in that directory
+    overrides this and can add crops the monolithic model does not know:
+
+        {"crop_classifier": {"model": "crops.pt", "crops": ["Corn", "Rice"]},
+         "heads": {"Rice": {"model": "rice.pt", "classes": ["Rice Blast", "Rice healthy"]}}}
+    """
+
+    def __init__(self, enabled=False, heads_dir=None, max_loaded=3, idle_seconds=600.0, min_crop_confidence=0.6):
+        self.enabled = enabled
+        self.heads_dir = heads_dir or os.getenv(
+            'CROP_HEADS_DIR', os.path.join(os.path.dirname(__file__), 'ml_models', 'crop_heads')
+        )
+        self.max_loaded = max(1, int(max_loaded))
+        self.idle_seconds = float(idle_seconds)
+        self.min_crop_confidence = float(min_crop_confidence)
+
+        self._config = None
+        self._heads = OrderedDict()
+        self._last_used = {}
+        self._failed = set()
+        self._lock = threading.Lock()
+        self._reaper = None
+        self.loads = 0
+        self.evictions = 0
+        self.routes = {'head': 0, 'monolithic': 0}
+
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._after_fork)
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            enabled=os.getenv('CROP_ROUTING_ENABLED', 'false').lower() == 'true',
+            max_loaded=int(os.getenv('CROP_HEADS_MAX_LOADED', '3')),
+            idle_seconds=float(os.getenv('CROP_HEAD_IDLE_SECONDS', '600')),
+            min_crop_confidence=float(os.getenv('CROP_ROUTING_MIN_CONFIDENCE', '0.6')),
+        )
+
+    def config(self):
+        """{'crop_classifier': {'model', 'crops'}, 'heads': {crop: {'model', 'classes'}}}, read once"""
+        if self._config is not None:
+            return self._config
+
+        from app.utils import disease_class
+
+        groups = crop_groups(disease_class)
+        config = {
+            'crop_classifier': {'model': 'crop_classifier.pt', 'crops': list(groups)},
+            'heads': {
+                crop: {'model': f'{crop.lower()}.pt', 'classes': [label for _, label in labels]}
+                for crop, labels in groups.items()
+            },
+        }
+        path = os.path.join(self.heads_dir, 'heads.json')
+        if os.path.exists(path):
+            with open(path) as f:
+                override = json.load(f)
+            config['crop_classifier'].update(override.get('crop_classifier', {}))
+            config['heads'].update(override.get('heads', {}))
+        self._config = config
+        return config
+
+    def crops(self):
+        return list(self.config()['heads'])
+
+    def normalize_crop(self, crop_type):
+        """Configured crop named by a user-supplied crop type ('maize', 'tomatoes', ...), or None"""
+        crop_type = (crop_type or '').strip().lower()
+        if not crop_type:
+            return None
+        known = {crop.lower(): crop for crop in self.crops()}
+        for candidate in (crop_type, crop_type.rstrip('s'), crop_type[:-2] if crop_type.endswith('es') else None):
+            if candidate in known:
+                return known[candidate]
+        label_crop = crop_for_label(crop_type)
+        return label_crop if label_crop in self.crops() else None
+
+    def crop_of(self, label):
+        """Crop of a result label, including labels that only a custom head knows"""
+        for crop, head in self.config()['heads'].items():
+            if label in head['classes']:
+                return crop
+        return crop_for_label(label)
+
+    def predict(self, image_array, crop_types=None):
+        """
+        Classify a uint8 (batch, height, width, channels) array.
+
+        crop_types optionally gives a user-supplied crop per image. Returns one
+        dict per image: result, confidence, crop, crop_confidence,
+        crop_source (user, classifier or None), route (head or monolithic)
+        and model_version (of the head or model that classified it).
+        """
+        from app.utils import predict_cached
+
+        crop_types = list(crop_types or [])
+        crop_types += [None] * (len(image_array) - len(crop_types))
+        outputs = [{'crop': self.normalize_crop(crop_type), 'crop_confidence': None, 'crop_source': None}
+                   for crop_type in crop_types]
+        for output in outputs:
+            if output['crop'] is not None:
+                output['crop_confidence'], output['crop_source'] = 1.0, 'user'
+
+        # Stage one: the crop classifier, only for images the user did not label
+        unlabelled = [row for row, output in enumerate(outputs) if output['crop'] is None]
+        classifier = self.head('crop_classifier') if unlabelled else None
+        if classifier is not None:
+            probabilities = predict_cached(classifier, image_array[unlabelled])
+            for row, crop_probabilities in zip(unlabelled, probabilities):
+                index = int(np.argmax(crop_probabilities))
+                if crop_probabilities[index] >= self.min_crop_confidence:
+                    outputs[row].update(crop=classifier.classes[index], crop_confidence=float(crop_probabilities[index]),
+                                        crop_source='classifier')
+
+        # Stage two: one batched call per crop head
+        monolithic = []
+        for crop in {output['crop'] for output in outputs if output['crop'] is not None}:
+            rows = [row for row, output in enumerate(outputs) if output['crop'] == crop]
+            head = self.head(crop)
+            if head is None:
+                monolithic += rows
+                continue
+            for row, probabilities in zip(rows, predict_cached(head, image_array[rows])):
+                outputs[row].update(self._interpret(head.classes, probabilities), route='head',
+                                    model_version=head.version())
+        monolithic += [row for row, output in enumerate(outputs) if output['crop'] is None]
+
+        if monolithic:
+            self._predict_monolithic(image_array, sorted(monolithic), outputs)
+
+        with self._lock:
+            for output in outputs:
+                self.routes[output['route']] += 1
+        return outputs
+
+    def _predict_monolithic(self, image_array, rows, outputs):
+        from app.model import model_registry
+        from app.utils import predict_cached, disease_class, not_a_leaf
+
+        model_wrapper = model_registry.get()
+        if model_wrapper.model_type is None:
+            raise RuntimeError("Model not available. Please check model loading.")
+
+        groups = crop_groups(disease_class)
+        for row, probabilities in zip(rows, predict_cached(model_wrapper, image_array[rows])):
+            probabilities = np.asarray(probabilities, dtype=np.float64).reshape(-1)[:len(disease_class)]
+            crop = outputs[row]['crop']
+            if crop in groups:
+                # Only this crop's diseases are possible; renormalise over them
+                mask = np.zeros_like(probabilities)
+                mask[[index for index, _ in groups[crop]]] = 1.0
+                probabilities = probabilities * mask
+                probabilities = probabilities / max(probabilities.sum(), 1e-12)
+            elif crop is not None:
+                # A crop only a custom head knows, and that head is missing
+                outputs[row].update(result=not_a_leaf, confidence=0.0, route='monolithic', model_version=None)
+                continue
+            outputs[row].update(self._interpret(disease_class, probabilities), route='monolithic',
+                                model_version=model_wrapper.version())
+            if crop is None and outputs[row]['result'] != not_a_leaf:
+                outputs[row]['crop'] = crop_for_label(outputs[row]['result'])
+
+    @staticmethod
+    def _interpret(classes, probabilities):
+        from app.utils import not_a_leaf
+
+        index = int(np.argmax(probabilities))
+        confidence = float(probabilities[index])
+        return {'result': classes[index] if confidence >= 0.5 else not_a_leaf, 'confidence': confidence}
+
+    def head(self, name):
+        """The loaded head for a crop (or 'crop_classifier'), loading it on first use; None if unavailable"""
+        now = time.monotonic()
+        with self._lock:
+            head = self._heads.get(name)
+            if head is not None:
+                self._heads.move_to_end(name)
+                self._last_used[name] = now
+                return head
+            if name in self._failed:
+                return None
+
+        config = self.config()
+        entry = config['crop_classifier'] if name == 'crop_classifier' else config['heads'].get(name)
+        if entry is None:
+            return None
+        path = entry['model'] if os.path.isabs(entry['model']) else os.path.join(self.heads_dir, entry['model'])
+        if not os.path.exists(path):
+            return None
+
+        classes = entry['crops'] if name == 'crop_classifier' else entry['classes']
+        try:
+            head = CropHead(name, path, classes).load()
+        except Exception as e:
+            print(f"Error loading crop head {name}: {str(e)}")
+            with self._lock:
+                self._failed.add(name)
+            return None
+
+        with self._lock:
+            # Another thread may have loaded it meanwhile; keep the first one
+            if name in self._heads:
+                return self._heads[name]
+            self._heads[name] = head
+            self._last_used[name] = time.monotonic()
+            self.loads += 1
+            # The crop classifier serves every request, so it never makes room for a head
+            disease_heads = [loaded for loaded in self._heads if loaded != 'crop_classifier']
+            while len(disease_heads) > self.max_loaded:
+                evicted = disease_heads.pop(0)
+                del self._heads[evicted]
+                self._last_used.pop(evicted, None)
+                self.evictions += 1
+                print(f"Crop head {evicted} evicted to make room for {name}")
+            self._start_reaper()
+        return head
+
+    def evict_idle(self, now=None):
+        """Unload heads unused for idle_seconds; returns their names"""
+        now = now or time.monotonic()
+        with self._lock:
+            idle = [name for name, last_used in self._last_used.items() if now - last_used >= self.idle_seconds]
+            for name in idle:
+                self._heads.pop(name, None)
+                self._last_used.pop(name, None)
+                self.evictions += 1
+        for name in idle:
+            print(f"Crop head {name} unloaded after {self.idle_seconds:.0f}s idle")
+        return idle
+
+    def _start_reaper(self):
+        # Called with self._lock held
+        if self._reaper is not None and self._reaper.is_alive():
+            return
+
+        def reap():
+            while True:
+                time.sleep(max(5.0, self.idle_seconds / 4.0))
+                self.evict_idle()
+
+        self._reaper = threading.Thread(target=reap, name='crop-head-reaper', daemon=True)
+        self._reaper.start()
+
+    def stats(self):
+        now = time.monotonic()
+        with self._lock:
+            return {
+                'enabled': self.enabled,
+                'crops': self.crops() if self._config is not None else None,
+                'loaded': {name: round(now - self._last_used[name], 1) for name in self._heads},
+                'failed': sorted(self._failed),
+                'loads': self.loads,
+                'evictions': self.evictions,
+                'routes': dict(self.routes),
+            }
+
+    def _after_fork(self):
+        # The reaper thread does not survive a fork; a new one starts on the next load
+        self._lock = threading.Lock()
+        self._reaper = None
+        if self._heads:
+            self._start_reaper()
+
+
+crop_router = CropRouter.from_env()
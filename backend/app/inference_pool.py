@@ -0,0 +1,384 @@
+import os
+import queue
+import atexit
+import itertools
+import threading
+import multiprocessing
+from multiprocessing import shared_memory
+from multiprocessing.connection import wait
+
+import numpy as np
+
+
+class InferencePoolBusy(RuntimeError):
+    """Every slot of the pool is taken; the caller should back off instead of queueing"""
+
+
+class InferencePoolError(RuntimeError):
+    """The pool could not run a prediction"""
+
+
+class _PendingTask:
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+        self.process_index = None
+
+
+def _attach_shared_memory(name):
+    # The parent owns the blocks; keep the child's resource tracker from unlinking them
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        block = shared_memory.SharedMemory(name=name)
+        from multiprocessing import resource_tracker
+        resource_tracker.unregister(block._name, 'shared_memory')
+        return block
+
+
+def _set_thread_env(threads):
+    # Must happen before a framework is imported: pools size themselves on import
+    from app.inference_threads import apply_thread_env
+
+    os.environ['INFERENCE_INTRA_OP_THREADS'] = str(threads)
+    os.environ['INFERENCE_INTER_OP_THREADS'] = '1'
+    apply_thread_env(force=True)
+
+
+def _pool_worker(index, slot_names, connection, backend, threads, artifact=None):
+    """Entry point of a model process: load the model (or registry version) once, then serve tasks"""
+    _set_thread_env(threads)
+    # This process is the pool; it must load the model itself and not batch again
+    os.environ['INFERENCE_POOL_ENABLED'] = 'false'
+    os.environ['PREDICT_BATCHING_ENABLED'] = 'false'
+
+    slots = [_attach_shared_memory(name) for name in slot_names]
+
+    from app.model import ModelWrapper
+    wrapper = ModelWrapper(backend=backend, artifact=artifact)
+
+    if wrapper.model_type is not None:
+        try:
+            wrapper.warmup()
+        except Exception as e:
+            print(f"Inference pool process {index} warmup failed: {str(e)}")
+    connection.send(('ready', index, wrapper.model_type, None))
+
+    while True:
+        try:
+            task = connection.recv()
+        except EOFError:
+            break
+        if task is None:
+            break
+
+        task_id, slot, shape, dtype = task
+        try:
+            image_array = np.ndarray(shape, dtype=dtype, buffer=slots[slot].buf)
+            predictions = np.asarray(wrapper.predict(image_array), dtype=np.float32)
+            connection.send(('done', task_id, predictions, None))
+        except Exception as e:
+            connection.send(('done', task_id, None, f"{type(e).__name__}: {str(e)}"))
+
+    for block in slots:
+        block.close()
+
+
+class InferencePool:
+    """
+    Runs model inference in dedicated processes instead of the web worker.
+
+    The web worker copies each preprocessed uint8 batch into one of
+    queue_depth shared-memory slots and sends only the slot number and shape
+    to the least busy model process over its own pipe; just the small
+    probability arrays come back. Per-process pipes (rather than one shared
+    queue) mean a crashed process cannot leave a lock held for the others.
+
+    A prediction that finds every slot taken waits up to queue_timeout
+    seconds and then raises InferencePoolBusy, so the backlog in front of the
+    model processes never grows past queue_depth batches.
+
+    Each model process is started with the spawn method, loads its own
+    ModelWrapper and runs its framework with `threads` intra-op threads.
+    With artifact (a model registry entry) the processes load that version
+    instead of the MODEL_BACKEND files; a new version gets a new pool. A
+    process that dies is respawned, and gets no work until it reports ready.
+
+    The pool belongs to one web worker, so a server holds WEB_CONCURRENCY x
+    processes copies of the model.
+    """
+
+    def __init__(self, processes=1, queue_depth=8, threads=1, slot_mb=4.0, backend=None, artifact=None,
+                 start_timeout=600, result_timeout=60, queue_timeout=5):
+        self.num_processes = max(1, int(processes))
+        self.queue_depth = max(1, int(queue_depth))
+        self.threads = max(1, int(threads))
+        self.slot_bytes = int(float(slot_mb) * 1024 * 1024)
+        self.backend = backend
+        self.artifact = artifact
+        self.start_timeout = float(start_timeout)
+        self.result_timeout = float(result_timeout)
+        self.queue_timeout = float(queue_timeout)
+
+        self.model_type = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._send_lock = threading.Lock()
+        self._ready_changed = threading.Condition(self._send_lock)
+        self._processes = []
+        self._connections = []
+        self._in_flight = []
+        self._ready = []
+        self._slots = []
+        self._free_slots = queue.Queue()
+        self._pending = {}
+        self._orphaned = {}
+        self._task_ids = itertools.count()
+
+        self.tasks_run = 0
+        self.tasks_rejected = 0
+        self.restarts = 0
+
+    @classmethod
+    def from_env(cls, backend=None, artifact=None):
+        return cls(
+            processes=int(os.getenv('INFERENCE_POOL_PROCESSES', '1')),
+            queue_depth=int(os.getenv('INFERENCE_POOL_QUEUE_DEPTH', '8')),
+            threads=int(os.getenv('INFERENCE_POOL_THREADS', '1')),
+            slot_mb=float(os.getenv('INFERENCE_POOL_SLOT_MB', '4')),
+            backend=backend,
+            artifact=artifact,
+            result_timeout=float(os.getenv('INFERENCE_POOL_TIMEOUT', '60')),
+            queue_timeout=float(os.getenv('INFERENCE_POOL_QUEUE_TIMEOUT', '5')),
+        )
+
+    def start(self):
+        """Start the model processes and wait until they have loaded; returns the model type they serve"""
+        with self._lock:
+            if self._pid == os.getpid():
+                return self.model_type
+
+            # Pools do not survive a fork: a forked web worker starts its own
+            self._pid = os.getpid()
+            self._context = multiprocessing.get_context('spawn')
+            self._free_slots = queue.Queue()
+            self._pending = {}
+            self._orphaned = {}
+            self._slots = []
+            for slot in range(self.queue_depth):
+                self._slots.append(shared_memory.SharedMemory(create=True, size=self.slot_bytes))
+                self._free_slots.put(slot)
+
+            self._processes = [None] * self.num_processes
+            self._connections = [None] * self.num_processes
+            self._in_flight = [0] * self.num_processes
+            self._ready = [False] * self.num_processes
+            for index in range(self.num_processes):
+                self._spawn(index)
+
+            model_types = []
+            for index, connection in enumerate(self._connections):
+                try:
+                    if connection.poll(self.start_timeout):
+                        model_types.append(connection.recv()[2])
+                        self._ready[index] = model_types[-1] is not None
+                        continue
+                except (EOFError, OSError):
+                    pass
+                print("Inference pool process did not finish loading")
+                model_types.append(None)
+
+            self.model_type = model_types[0] if model_types and all(model_types) else None
+            if self.model_type is None:
+                print("Inference pool could not load a model")
+                self._stop()
+                return None
+
+            threading.Thread(target=self._dispatch_results, name='inference-pool-results', daemon=True).start()
+            atexit.register(self.shutdown)
+            print(f"Inference pool started: {self.num_processes} x {self.model_type}, "
+                  f"{self.threads} thread(s) each, {self.queue_depth} slots")
+            return self.model_type
+
+    def predict(self, image_array):
+        """Run image_array through a model process and return its predictions"""
+        if self._pid != os.getpid():
+            self.start()
+        if self.model_type is None:
+            raise InferencePoolError("Inference pool is not running")
+
+        image_array = np.ascontiguousarray(image_array)
+        row_bytes = max(1, image_array[0].nbytes if len(image_array) else 1)
+        rows_per_slot = self.slot_bytes // row_bytes
+        if rows_per_slot < 1:
+            raise InferencePoolError(
+                f"One image ({row_bytes} bytes) does not fit a {self.slot_bytes}-byte slot; raise INFERENCE_POOL_SLOT_MB"
+            )
+
+        results = [
+            self._run_chunk(image_array[start:start + rows_per_slot])
+            for start in range(0, len(image_array), rows_per_slot)
+        ]
+        return np.concatenate(results, axis=0) if len(results) > 1 else results[0]
+
+    def stats(self):
+        """Return pool counters"""
+        return {
+            'processes': self.num_processes,
+            'processes_alive': sum(1 for process in self._processes if process is not None and process.is_alive()),
+            'threads_per_process': self.threads,
+            'queue_depth': self.queue_depth,
+            'slots_in_use': self.queue_depth - self._free_slots.qsize() if self._slots else 0,
+            'in_flight': len(self._pending),
+            'tasks_run': self.tasks_run,
+            'tasks_rejected': self.tasks_rejected,
+            'restarts': self.restarts,
+        }
+
+    def shutdown(self):
+        with self._lock:
+            self._stop()
+
+    def _run_chunk(self, chunk):
+        try:
+            slot = self._free_slots.get(timeout=self.queue_timeout)
+        except queue.Empty:
+            self.tasks_rejected += 1
+            raise InferencePoolBusy(f"All {self.queue_depth} inference slots are busy")
+
+        task_id = next(self._task_ids)
+        pending = _PendingTask()
+        self._pending[task_id] = pending
+        try:
+            view = np.ndarray(chunk.shape, dtype=chunk.dtype, buffer=self._slots[slot].buf)
+            view[...] = chunk
+
+            with self._send_lock:
+                # A respawned process has nothing in flight while it is still loading the model;
+                # sending it work then would only run into result_timeout
+                if not self._ready_changed.wait_for(lambda: any(self._ready), timeout=self.queue_timeout):
+                    self.tasks_rejected += 1
+                    raise InferencePoolBusy("No inference process has finished loading the model")
+                ready = [i for i in range(self.num_processes) if self._ready[i]]
+                index = min(ready, key=lambda i: self._in_flight[i])
+                pending.process_index = index
+                self._in_flight[index] += 1
+                self._connections[index].send((task_id, slot, chunk.shape, chunk.dtype.str))
+
+            if not pending.event.wait(self.result_timeout):
+                raise InferencePoolError(f"No result from the inference pool within {self.result_timeout:.0f}s")
+            if pending.error is not None:
+                raise InferencePoolError(pending.error)
+
+            self.tasks_run += 1
+            return pending.result
+        finally:
+            # Under the send lock, so a process replacement sees either the pending task or its orphaned slot
+            with self._send_lock:
+                self._pending.pop(task_id, None)
+                if pending.process_index is not None:
+                    self._in_flight[pending.process_index] -= 1
+                # A timed-out task may still be reading its slot; it is freed when its result
+                # arrives, or when its process dies
+                if pending.event.is_set() or pending.process_index is None:
+                    self._free_slots.put(slot)
+                else:
+                    self._orphaned[task_id] = (slot, pending.process_index)
+
+    def _dispatch_results(self):
+        pid = os.getpid()
+        while self._pid == pid and self._processes:
+            try:
+                ready = wait(list(self._connections), timeout=1.0)
+            except (OSError, ValueError):
+                # A pipe was closed by shutdown() or a restart while waiting
+                continue
+
+            for connection in ready:
+                try:
+                    kind, task_id, predictions, error = connection.recv()
+                except (EOFError, OSError):
+                    # The process died; the liveness check below replaces it
+                    continue
+
+                if kind == 'ready':
+                    # task_id is the process index here, and predictions its model type
+                    with self._send_lock:
+                        self._ready[task_id] = predictions is not None
+                        self._ready_changed.notify_all()
+                    print(f"Inference pool process {task_id} ready ({predictions})")
+                    continue
+
+                pending = self._pending.get(task_id)
+                if kind == 'done' and pending is not None:
+                    pending.result = predictions
+                    pending.error = error
+                    pending.event.set()
+                elif kind == 'done':
+                    with self._send_lock:
+                        orphan = self._orphaned.pop(task_id, None)
+                    if orphan is not None:
+                        self._free_slots.put(orphan[0])
+
+            self._replace_dead_processes()
+
+    def _replace_dead_processes(self):
+        for index, process in enumerate(self._processes):
+            if process is None or process.is_alive():
+                continue
+            print(f"Inference pool process {index} exited with code {process.exitcode}; restarting it")
+            with self._send_lock:
+                for pending in list(self._pending.values()):
+                    if pending.process_index == index and not pending.event.is_set():
+                        pending.error = "Inference process died while running this prediction"
+                        pending.event.set()
+                # Slots of tasks that timed out on this process would otherwise never come back
+                for task_id, (slot, process_index) in list(self._orphaned.items()):
+                    if process_index == index:
+                        del self._orphaned[task_id]
+                        self._free_slots.put(slot)
+                self._connections[index].close()
+                self._ready[index] = False
+                self._spawn(index)
+            self.restarts += 1
+
+    def _spawn(self, index):
+        parent_connection, child_connection = self._context.Pipe()
+        process = self._context.Process(
+            target=_pool_worker,
+            args=(index, [slot.name for slot in self._slots], child_connection, self.backend, self.threads,
+                  self.artifact),
+            name=f'inference-pool-{index}',
+            daemon=True,
+        )
+        process.start()
+        child_connection.close()
+        self._processes[index] = process
+        self._connections[index] = parent_connection
+
+    def _stop(self):
+        for connection in self._connections:
+            try:
+                connection.send(None)
+                connection.close()
+            except (OSError, AttributeError):
+                pass
+        for process in self._processes:
+            if process is None:
+                continue
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+        self._processes = []
+        self._connections = []
+
+        for slot in self._slots:
+            try:
+                slot.close()
+                slot.unlink()
+            except FileNotFoundError:
+                pass
+        self._slots = []
+        self.model_type = None
+        self._pid = None
@@ -0,0 +1,286 @@
+import io
+import os
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+
+# Methods are registered as generic handlers, so no generated protobuf stubs
+# are needed: requests and responses are single arrays in .npy format
+SERVICE_NAME = 'cropleaf.inference.Inference'
+PREDICT_METHOD = f'/{SERVICE_NAME}/Predict'
+PREDICT_STREAM_METHOD = f'/{SERVICE_NAME}/PredictStream'
+
+# A 64-image uint8 batch is 12 MB; the gRPC default limit is 4 MB
+MAX_MESSAGE_BYTES = 64 * 1024 * 1024
+CHANNEL_OPTIONS = [
+    ('grpc.max_send_message_length', MAX_MESSAGE_BYTES),
+    ('grpc.max_receive_message_length', MAX_MESSAGE_BYTES),
+]
+
+
+def serialize_array(array):
+    buffer = io.BytesIO()
+    np.save(buffer, np.asarray(array), allow_pickle=False)
+    return buffer.getvalue()
+
+
+def deserialize_array(data):
+    return np.load(io.BytesIO(data), allow_pickle=False)
+
+
+class InferenceServicer:
+    """
+    Serves ModelWrapper predictions over gRPC.
+
+    Predict takes one uint8 (batch, height, width, channels) array and returns
+    the class probabilities. PredictStream answers a stream of such arrays in
+    order over one call, for clients sending many batches. Unary calls go
+    through the wrapper's micro-batcher, so concurrent RPCs share one model
+    call.
+
+    Without a fixed model_wrapper the model is fetched from model_registry
+    for every request, so the server picks up a version activated in the
+    model registry (app.model_versions) like the web workers do.
+    """
+
+    def __init__(self, model_wrapper=None, backend=None):
+        self._model_wrapper = model_wrapper
+        self.backend = backend
+
+    @property
+    def model_wrapper(self):
+        if self._model_wrapper is not None:
+            return self._model_wrapper
+        from app.model import model_registry
+        return model_registry.get(self.backend)
+
+    def predict(self, image_array, context):
+        return self._run(image_array, context, batched=True)
+
+    def predict_stream(self, request_iterator, context):
+        for image_array in request_iterator:
+            yield self._run(image_array, context, batched=False)
+
+    def _run(self, image_array, context, batched):
+        import grpc
+
+        model_wrapper = self.model_wrapper
+        predict_fn = model_wrapper.predict_batched if batched else model_wrapper.predict
+        if model_wrapper.model_type is None:
+            context.abort(grpc.StatusCode.UNAVAILABLE, 'No model loaded on this inference server')
+        if image_array.ndim != 4 or image_array.dtype != np.uint8:
+            context.abort(grpc.StatusCode.INVALID_ARGUMENT,
+                          f'Expected a uint8 (batch, height, width, channels) array, got {image_array.dtype} {image_array.shape}')
+        try:
+            return np.asarray(predict_fn(image_array), dtype=np.float32)
+        except Exception as e:
+            print(f"Inference server prediction error: {str(e)}")
+            context.abort(grpc.StatusCode.INTERNAL, f'Prediction failed: {str(e)}')
+
+    def handler(self):
+        import grpc
+
+        return grpc.method_handlers_generic_handler(SERVICE_NAME, {
+            'Predict': grpc.unary_unary_rpc_method_handler(
+                self.predict, request_deserializer=deserialize_array, response_serializer=serialize_array,
+            ),
+            'PredictStream': grpc.stream_stream_rpc_method_handler(
+                self.predict_stream, request_deserializer=deserialize_array, response_serializer=serialize_array,
+            ),
+        })
+
+
+def build_server(address, model_wrapper=None, max_workers=None, backend=None):
+    """Create a gRPC server for InferenceServicer bound to address; returns (server, bound port)"""
+    import grpc
+
+    max_workers = max_workers or int(os.getenv('INFERENCE_GRPC_WORKERS', '8'))
+    server = grpc.server(ThreadPoolExecutor(max_workers=max_workers), options=CHANNEL_OPTIONS)
+    server.add_generic_rpc_handlers((InferenceServicer(model_wrapper, backend=backend).handler(),))
+    port = server.add_insecure_port(address)
+    if not port:
+        raise RuntimeError(f"Could not bind the inference server to {address}")
+    return server, port
+
+
+def start_loopback_server(model_wrapper=None):
+    """Start an inference server on a free localhost port; returns (server, 'host:port')"""
+    server, port = build_server('127.0.0.1:0', model_wrapper=model_wrapper, max_workers=4)
+    server.start()
+    return server, f'127.0.0.1:{port}'
+
+
+class InferenceClient:
+    """
+    Round-robin client for one or more inference servers.
+
+    Each call goes to the next healthy address in turn. When a server is
+    unreachable (UNAVAILABLE) the call is retried on the next one, so a node
+    can be restarted without failing requests. A server that fails is left
+    out of the rotation for INFERENCE_GRPC_BACKOFF seconds, doubling on each
+    further failure up to INFERENCE_GRPC_MAX_BACKOFF, so a node that drops
+    traffic on the floor costs one request its timeout rather than every
+    Nth request. DEADLINE_EXCEEDED is not retried: the request has already
+    spent its time budget and the server may still be running it. When every
+    server is backing off, the one due back first is tried anyway. Channels
+    are created per process, which keeps the client safe to use in forked
+    gunicorn workers.
+    """
+
+    RETRYABLE = ('UNAVAILABLE',)
+
+    def __init__(self, addresses, timeout=30.0, backoff=5.0, max_backoff=60.0):
+        self.addresses = [address.strip() for address in addresses if address.strip()]
+        if not self.addresses:
+            raise ValueError("InferenceClient needs at least one server address")
+        self.timeout = float(timeout)
+        self.backoff = float(backoff)
+        self.max_backoff = float(max_backoff)
+
+        self._lock = threading.Lock()
+        self._next = 0
+        self._pid = None
+        self._stubs = []
+        # Per address: consecutive failures and the monotonic time it rejoins the rotation
+        self._failures = [0] * len(self.addresses)
+        self._retry_at = [0.0] * len(self.addresses)
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            os.getenv('INFERENCE_GRPC_ADDRESSES', '127.0.0.1:50051').split(','),
+            timeout=float(os.getenv('INFERENCE_GRPC_TIMEOUT', '30')),
+            backoff=float(os.getenv('INFERENCE_GRPC_BACKOFF', '5')),
+            max_backoff=float(os.getenv('INFERENCE_GRPC_MAX_BACKOFF', '60')),
+        )
+
+    def predict(self, image_array):
+        """Classify a uint8 batch on the next server; returns the probabilities"""
+        image_array = np.ascontiguousarray(image_array, dtype=np.uint8)
+        return self._call(lambda stubs: stubs[0](image_array, timeout=self.timeout))
+
+    def predict_stream(self, image_arrays):
+        """
+        Classify an iterable of batches over one streaming call; yields probabilities in order.
+
+        A server that turns out to be unreachable before the first result
+        arrives is failed over like predict(), replaying the batches already
+        sent to it. Once results have been yielded they cannot be taken back,
+        so a later failure is raised.
+        """
+        import grpc
+
+        source = iter(image_arrays)
+        sent = []
+        tried = set()
+        while True:
+            index = self._pick(exclude=tried)
+            tried.add(index)
+            replay = list(sent)
+            state = {'yielded': False}
+
+            def requests():
+                yield from replay
+                for image_array in source:
+                    image_array = np.ascontiguousarray(image_array, dtype=np.uint8)
+                    if not state['yielded']:
+                        sent.append(image_array)
+                    yield image_array
+
+            try:
+                for result in self._stubs_for(index)[1](requests(), timeout=self.timeout):
+                    if not state['yielded']:
+                        state['yielded'] = True
+                        sent.clear()
+                    yield result
+                self._mark_healthy(index)
+                return
+            except grpc.RpcError as e:
+                self._mark_failed(index, e)
+                if state['yielded'] or e.code().name not in self.RETRYABLE or len(tried) >= len(self.addresses):
+                    raise
+                print(f"Inference server {self.addresses[index]} failed ({e.code().name}), trying the next one")
+
+    def close(self):
+        with self._lock:
+            for channel, _, _ in self._stubs:
+                channel.close()
+            self._stubs = []
+            self._pid = None
+
+    def health(self):
+        """Per address: consecutive failures and seconds until it rejoins the rotation"""
+        now = time.monotonic()
+        return {
+            address: {'failures': self._failures[index], 'backoff_s': round(max(0.0, self._retry_at[index] - now), 1)}
+            for index, address in enumerate(self.addresses)
+        }
+
+    def _call(self, invoke):
+        import grpc
+
+        tried = set()
+        while True:
+            index = self._pick(exclude=tried)
+            tried.add(index)
+            try:
+                result = invoke(self._stubs_for(index))
+            except grpc.RpcError as e:
+                self._mark_failed(index, e)
+                if e.code().name not in self.RETRYABLE or len(tried) >= len(self.addresses):
+                    raise
+                print(f"Inference server {self.addresses[index]} failed ({e.code().name}), trying the next one")
+                continue
+            self._mark_healthy(index)
+            return result
+
+    def _pick(self, exclude=()):
+        """Next address in the rotation that is not backing off (nor in exclude)"""
+        with self._lock:
+            now = time.monotonic()
+            count = len(self.addresses)
+            candidates = [(self._next + offset) % count for offset in range(count)]
+            candidates = [index for index in candidates if index not in exclude] or candidates
+            healthy = [index for index in candidates if self._retry_at[index] <= now]
+            index = healthy[0] if healthy else min(candidates, key=lambda i: self._retry_at[i])
+            self._next = index + 1
+            return index
+
+    def _mark_failed(self, index, error):
+        # Errors the server returned on purpose say nothing about its health
+        if error.code().name not in ('UNAVAILABLE', 'DEADLINE_EXCEEDED'):
+            return
+        with self._lock:
+            self._failures[index] += 1
+            delay = min(self.max_backoff, self.backoff * 2 ** (self._failures[index] - 1))
+            self._retry_at[index] = time.monotonic() + delay
+
+    def _mark_healthy(self, index):
+        if self._failures[index]:
+            with self._lock:
+                self._failures[index] = 0
+                self._retry_at[index] = 0.0
+
+    def _stubs_for(self, index):
+        import grpc
+
+        with self._lock:
+            # gRPC channels do not survive a fork; open fresh ones in each process
+            if self._pid != os.getpid():
+                self._stubs = []
+                for address in self.addresses:
+                    channel = grpc.insecure_channel(address, options=CHANNEL_OPTIONS)
+                    predict = channel.unary_unary(
+                        PREDICT_METHOD, request_serializer=serialize_array, response_deserializer=deserialize_array,
+                    )
+                    predict_stream = channel.stream_stream(
+                        PREDICT_STREAM_METHOD, request_serializer=serialize_array, response_deserializer=deserialize_array,
+                    )
+                    self._stubs.append((channel, predict, predict_stream))
+                self._pid = os.getpid()
+            _, predict, predict_stream = self._stubs[index]
+            return predict, predict_stream
+
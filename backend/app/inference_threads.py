@@ -0,0 +1,89 @@
+import os
+
+# Framework thread pools are sized when the framework initialises, so these
+# are applied once, right before/after the first import, and never again
+_env_applied = False
+_torch_configured = False
+
+THREAD_ENV_VARIABLES = ('OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS')
+
+
+def thread_settings():
+    """
+    Thread counts for inference in this process.
+
+    - INFERENCE_INTRA_OP_THREADS: threads one operator (a convolution) may use.
+      Defaults to the CPU count divided by WEB_CONCURRENCY, so that the
+      gunicorn workers together use each core once instead of each worker
+      starting one thread per core.
+    - INFERENCE_INTER_OP_THREADS: independent operators run in parallel (1).
+    - INFERENCE_ONEDNN: true/false forces oneDNN (MKL-DNN) kernels on or off
+      in TensorFlow and torch; unset keeps the framework default.
+    """
+    cpus = os.cpu_count() or 1
+    workers = max(1, int(os.getenv('WEB_CONCURRENCY', '2')))
+    intra_op = int(os.getenv('INFERENCE_INTRA_OP_THREADS', '0')) or max(1, cpus // workers)
+    inter_op = max(1, int(os.getenv('INFERENCE_INTER_OP_THREADS', '1')))
+
+    onednn = os.getenv('INFERENCE_ONEDNN', '').lower()
+    return {
+        'intra_op': intra_op,
+        'inter_op': inter_op,
+        'onednn': {'true': True, 'false': False}.get(onednn),
+    }
+
+
+def apply_thread_env(force=False):
+    """
+    Export the OpenMP/MKL/OpenBLAS and TensorFlow thread variables.
+
+    Must run before TensorFlow or torch is imported. Variables already set in
+    the environment are left alone unless force is True (the inference pool
+    uses that to pin each model process).
+    """
+    global _env_applied
+    if _env_applied and not force:
+        return
+    settings = thread_settings()
+
+    values = {variable: str(settings['intra_op']) for variable in THREAD_ENV_VARIABLES}
+    values['TF_NUM_INTRAOP_THREADS'] = str(settings['intra_op'])
+    values['TF_NUM_INTEROP_THREADS'] = str(settings['inter_op'])
+    if settings['onednn'] is not None:
+        values['TF_ENABLE_ONEDNN_OPTS'] = '1' if settings['onednn'] else '0'
+
+    for variable, value in values.items():
+        if force:
+            os.environ[variable] = value
+        else:
+            os.environ.setdefault(variable, value)
+    _env_applied = True
+
+
+def configure_tensorflow(tf):
+    """Size TensorFlow's thread pools; call once, before the first op runs"""
+    settings = thread_settings()
+    try:
+        tf.config.threading.set_intra_op_parallelism_threads(settings['intra_op'])
+        tf.config.threading.set_inter_op_parallelism_threads(settings['inter_op'])
+    except RuntimeError as e:
+        # The runtime was already initialised by an earlier import
+        print(f"Could not set TensorFlow thread counts: {str(e)}")
+
+
+def configure_torch(torch):
+    """Size torch's thread pools and apply the oneDNN toggle, once per process"""
+    global _torch_configured
+    if _torch_configured:
+        return
+    settings = thread_settings()
+
+    torch.set_num_threads(settings['intra_op'])
+    try:
+        torch.set_num_interop_threads(settings['inter_op'])
+    except RuntimeError as e:
+        # Only possible before the first inter-op parallel work
+        print(f"Could not set torch inter-op threads: {str(e)}")
+    if settings['onednn'] is not None:
+        torch.backends.mkldnn.enabled = settings['onednn']
+    _torch_configured = True
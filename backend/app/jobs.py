@@ -0,0 +1,242 @@
+import os
+import time
+import socket
+import threading
+from datetime import timedelta
+
+from django.core.files.base import ContentFile
+from django.db.models import F
+from django.utils import timezone
+
+from app.models import PredictionJob
+
+
+FINISHED_STATUSES = ('done', 'failed')
+
+
+def job_ttl():
+    return timedelta(hours=float(os.getenv('PREDICT_JOB_TTL_HOURS', '24')))
+
+
+def wants_async(request, image_files):
+    """
+    Whether a prediction request should be queued as a job.
+
+    Clients opt in with a 'Prefer: respond-async' header or ?async=true.
+    Uploads totalling PREDICT_ASYNC_MIN_MB or more are queued regardless
+    (0, the default, turns that off).
+    """
+    if os.getenv('PREDICT_JOBS_ENABLED', 'false').lower() != 'true':
+        return False
+    if 'respond-async' in request.headers.get('Prefer', '').lower():
+        return True
+    if request.GET.get('async', '').lower() in ('1', 'true', 'yes'):
+        return True
+
+    min_bytes = float(os.getenv('PREDICT_ASYNC_MIN_MB', '0')) * 1024 * 1024
+    return min_bytes > 0 and sum(image_file.size for image_file in image_files) >= min_bytes
+
+
+def job_payload_rejection(image_files):
+    """
+    An error message when the uploads are too large to queue, or None.
+
+    The payload is held in memory and stored in one database column, so it
+    is capped at PREDICT_JOB_MAX_PAYLOAD_MB (Postgres bytea stops at 1 GB).
+    """
+    max_mb = float(os.getenv('PREDICT_JOB_MAX_PAYLOAD_MB', '100'))
+    total_mb = sum(image_file.size for image_file in image_files) / (1024 * 1024)
+    if total_mb > max_mb:
+        return (f"Uploads total {total_mb:.0f} MB; at most {max_mb:g} MB can be queued as a job. "
+                f"Send fewer images per request.")
+    return None
+
+
+def submit_job(image_files, kind='single', user=None, content_digests=None, crop_type=None):
+    """Store the uploads in a queued PredictionJob and return it; check job_payload_rejection first"""
+    # Appended chunk by chunk, so the uploads are copied into memory once
+    payload = bytearray()
+    file_sizes = []
+    for image_file in image_files:
+        image_file.seek(0)
+        start = len(payload)
+        for chunk in image_file.chunks():
+            payload += chunk
+        file_sizes.append(len(payload) - start)
+
+    job = PredictionJob.objects.create(
+        kind=kind,
+        user=user if user is not None and user.is_authenticated else None,
+        payload=payload,
+        file_names=[getattr(image_file, 'name', '') or '' for image_file in image_files],
+        file_sizes=file_sizes,
+        content_digests=list(content_digests or []),
+        crop_type=crop_type or '',
+        expires_at=timezone.now() + job_ttl(),
+    )
+
+    # Without a separate worker service, run the job on a thread of this process
+    if os.getenv('PREDICT_JOBS_IN_PROCESS', 'false').lower() == 'true':
+        threading.Thread(target=_run_in_process, name='prediction-job', daemon=True).start()
+
+    return job
+
+
+def job_files(job):
+    """Split the job payload back into one file object per upload"""
+    payload = bytes(job.payload)
+    files = []
+    offset = 0
+    for name, size in zip(job.file_names, job.file_sizes):
+        files.append(ContentFile(payload[offset:offset + size], name=name))
+        offset += size
+    return files
+
+
+def claim_job(worker=None):
+    """Mark the oldest queued job as running and return it, or None when the queue is empty"""
+    worker = worker or default_worker_name()
+    candidates = list(
+        PredictionJob.objects.filter(status='queued').order_by('created_at').values_list('pk', flat=True)[:10]
+    )
+    for pk in candidates:
+        # The conditional update is the lock: only one worker sees a row count of 1
+        claimed = PredictionJob.objects.filter(pk=pk, status='queued').update(
+            status='running', started_at=timezone.now(), worker=worker[:100], attempts=F('attempts') + 1
+        )
+        if claimed:
+            return PredictionJob.objects.get(pk=pk)
+    return None
+
+
+def run_job(job):
+    """Run a claimed job and store its result; the uploads are dropped afterwards"""
+    from app.utils import predict_images, predict_upload_response, record_prediction
+
+    start = time.perf_counter()
+    try:
+        files = job_files(job)
+        if job.kind == 'batch':
+            results, summary = predict_images(files, crop_type=job.crop_type or None)
+            job.result = {'results': results, 'summary': summary}
+        else:
+            digest = job.content_digests[0] if job.content_digests else None
+            job.result, cacheable, served = predict_upload_response(files[0], content_digest=digest,
+                                                                   crop_type=job.crop_type or None,
+                                                                   user_key=job.user_id)
+            if cacheable:
+                record_prediction(job.user, job.result['result'], served['confidence'], served['model_version'])
+        job.status = 'done'
+    except Exception as e:
+        print(f"Prediction job {job.pk} failed: {str(e)}")
+        job.status = 'failed'
+        job.error = str(e)
+
+    job.payload = b''
+    job.finished_at = timezone.now()
+    job.save(update_fields=['status', 'result', 'error', 'payload', 'finished_at'])
+    print(f"Prediction job {job.pk} {job.status} in {time.perf_counter() - start:.2f}s")
+    return job
+
+
+def requeue_stale_jobs():
+    """
+    Put back jobs whose worker died mid-run.
+
+    A job running longer than PREDICT_JOB_TIMEOUT seconds is queued again,
+    or failed once it has been tried PREDICT_JOB_MAX_ATTEMPTS times.
+    Returns (requeued, failed).
+    """
+    cutoff = timezone.now() - timedelta(seconds=float(os.getenv('PREDICT_JOB_TIMEOUT', '600')))
+    max_attempts = int(os.getenv('PREDICT_JOB_MAX_ATTEMPTS', '3'))
+    stale = PredictionJob.objects.filter(status='running', started_at__lt=cutoff)
+
+    failed = stale.filter(attempts__gte=max_attempts).update(
+        status='failed', error='Worker did not finish the job', payload=b'', finished_at=timezone.now()
+    )
+    requeued = stale.filter(attempts__lt=max_attempts).update(status='queued', started_at=None)
+    return requeued, failed
+
+
+def expire_jobs():
+    """Delete jobs past their expires_at; returns how many were removed"""
+    deleted, _ = PredictionJob.objects.filter(expires_at__lt=timezone.now()).delete()
+    return deleted
+
+
+# Long-polls hold a gunicorn thread each; beyond this many per process, polls answer at once
+_waiters = threading.BoundedSemaphore(max(1, int(os.getenv('PREDICT_JOB_MAX_WAITERS', '1'))))
+
+
+def wait_for_job(job_id, timeout):
+    """
+    Long-poll: return the job once it has finished or timeout seconds have passed.
+
+    Only the status is polled; the job is loaded once at the end, without
+    its upload payload. When PREDICT_JOB_MAX_WAITERS long-polls are already
+    waiting in this process, the job is returned straight away instead.
+    Returns None when the job does not exist (or has expired).
+    """
+    jobs = PredictionJob.objects.filter(pk=job_id, expires_at__gte=timezone.now()).defer('payload')
+    if timeout <= 0 or not _waiters.acquire(blocking=False):
+        return jobs.first()
+
+    try:
+        deadline = time.monotonic() + timeout
+        interval = 0.1
+        while True:
+            status = jobs.values_list('status', flat=True).first()
+            if status is None or status in FINISHED_STATUSES or time.monotonic() >= deadline:
+                break
+            time.sleep(min(interval, max(0.0, deadline - time.monotonic())))
+            interval = min(interval * 2, 1.0)
+    finally:
+        _waiters.release()
+    return jobs.first()
+
+
+def job_response(job, status_url=None):
+    """Response body describing a job; includes the result once it is done"""
+    data = {
+        'job_id': str(job.pk),
+        'status': job.status,
+        'kind': job.kind,
+        'created_at': job.created_at.isoformat(),
+        'expires_at': job.expires_at.isoformat(),
+    }
+    if status_url:
+        data['status_url'] = status_url
+    if job.finished_at:
+        data['finished_at'] = job.finished_at.isoformat()
+    if job.status == 'done':
+        data['result'] = job.result
+    elif job.status == 'failed':
+        data['error'] = job.error
+    return data
+
+
+def default_worker_name():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+_last_maintenance = 0.0
+
+
+def _run_in_process():
+    global _last_maintenance
+    from django.db import close_old_connections
+
+    try:
+        # Takes the oldest queued job, which is usually but not always the one just submitted
+        job = claim_job()
+        if job is not None:
+            run_job(job)
+
+        # Without a worker service, this is the only place stale and expired jobs are cleaned up
+        interval = float(os.getenv('PREDICT_JOB_MAINTENANCE_INTERVAL', '60'))
+        if time.monotonic() - _last_maintenance >= interval:
+            _last_maintenance = time.monotonic()
+            requeue_stale_jobs()
+            expire_jobs()
+    finally:
+        close_old_connections()
@@ -0,0 +1,237 @@
+import os
+import time
+import threading
+from collections import Counter
+
+import numpy as np
+from PIL import Image
+
+
+class LeafDetector:
+    """
+    Finds individual leaves in a field photo with an ultralytics YOLO model.
+
+    The detector is loaded on first use, on CPU, from LEAF_DETECTOR_MODEL
+    (a path, or a filename inside app/ml_models). If ultralytics or the
+    weights are missing, available() is False and callers fall back to
+    classifying the whole frame.
+    """
+
+    def __init__(self, model_path=None, confidence=0.25, image_size=640, max_leaves=16, min_box_fraction=0.002):
+        model_path = model_path or os.getenv('LEAF_DETECTOR_MODEL', 'leaf_detector.pt')
+        if not os.path.isabs(model_path):
+            model_path = os.path.join(os.path.dirname(__file__), 'ml_models', model_path)
+        self.model_path = model_path
+        self.confidence = float(confidence)
+        self.image_size = int(image_size)
+        self.max_leaves = max(1, int(max_leaves))
+        self.min_box_fraction = float(min_box_fraction)
+
+        self._model = None
+        self._load_failed = False
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            confidence=float(os.getenv('LEAF_DETECTOR_CONFIDENCE', '0.25')),
+            image_size=int(os.getenv('LEAF_DETECTOR_IMAGE_SIZE', '640')),
+            max_leaves=int(os.getenv('LEAF_DETECTOR_MAX_LEAVES', '16')),
+        )
+
+    def available(self):
+        return self._get_model() is not None
+
+    def detect(self, image):
+        """Return leaf boxes in a PIL image as [(x1, y1, x2, y2, confidence)], most confident first"""
+        model = self._get_model()
+        if model is None:
+            return []
+
+        from app.admission import admission_slot
+
+        # The ultralytics predictor keeps per-call state; one call at a time
+        with admission_slot(), self._lock:
+            results = model.predict(
+                source=image,
+                imgsz=self.image_size, conf=self.confidence, max_det=self.max_leaves,
+                device='cpu', verbose=False,
+            )
+
+        boxes = results[0].boxes
+        if boxes is None or len(boxes) == 0:
+            return []
+        coordinates = boxes.xyxy.cpu().numpy()
+        confidences = boxes.conf.cpu().numpy()
+
+        min_area = self.min_box_fraction * image.size[0] * image.size[1]
+        detections = [
+            (float(x1), float(y1), float(x2), float(y2), float(confidence))
+            for (x1, y1, x2, y2), confidence in zip(coordinates, confidences)
+            if (x2 - x1) * (y2 - y1) >= min_area
+        ]
+        detections.sort(key=lambda detection: detection[4], reverse=True)
+        return detections[:self.max_leaves]
+
+    def _get_model(self):
+        if self._model is not None or self._load_failed:
+            return self._model
+
+        with self._lock:
+            if self._model is not None or self._load_failed:
+                return self._model
+            if not os.path.exists(self.model_path):
+                print(f"Leaf detector weights not found at {self.model_path}; classifying whole frames")
+                self._load_failed = True
+                return None
+            try:
+                # Size torch's thread pools before ultralytics imports it
+                from app.model import import_torch
+                import_torch()
+                from ultralytics import YOLO
+
+                start = time.perf_counter()
+                self._model = YOLO(self.model_path)
+                self._model.to('cpu')
+                print(f"Leaf detector loaded from {self.model_path} in {time.perf_counter() - start:.1f}s")
+            except Exception as e:
+                print(f"Error loading leaf detector: {str(e)}")
+                self._load_failed = True
+            return self._model
+
+
+leaf_detector = LeafDetector.from_env()
+
+
+def crop_leaf(image, box, padding=0.1, size=(256, 256)):
+    """Crop a detected box, with some context around it, and resize it to the classifier input"""
+    x1, y1, x2, y2 = box[:4]
+    pad_x = (x2 - x1) * padding
+    pad_y = (y2 - y1) * padding
+    region = (
+        max(0, int(x1 - pad_x)), max(0, int(y1 - pad_y)),
+        min(image.size[0], int(x2 + pad_x)), min(image.size[1], int(y2 + pad_y)),
+    )
+    return np.array(image.crop(region).resize(size, Image.LANCZOS))
+
+
+def open_field_photo(image_file, max_side=None):
+    """
+    Decode a photo for detection and cropping.
+
+    Crops need more resolution than the 256x256 whole-frame input, but not the
+    full 48 MP: JPEGs are draft-decoded and everything is capped at max_side
+    (LEAF_DETECTION_MAX_SIDE) pixels on the long edge.
+    """
+    max_side = max_side or int(os.getenv('LEAF_DETECTION_MAX_SIDE', '1600'))
+    if hasattr(image_file, 'seek'):
+        image_file.seek(0)
+    image = Image.open(image_file)
+    if image.format == 'JPEG':
+        # draft() only reduces while both sides stay at or above the request
+        scale = max_side / max(image.size)
+        image.draft('RGB', (int(image.size[0] * scale), int(image.size[1] * scale)))
+    image = image.convert('RGB')
+    image.thumbnail((max_side, max_side), Image.LANCZOS)
+    return image
+
+
+def summarize_leaves(leaves):
+    """Aggregate per-leaf results into a per-image disease summary"""
+    from app.utils import not_a_leaf
+
+    classified = [leaf for leaf in leaves if leaf['result'] and leaf['result'] != not_a_leaf]
+    counts = Counter(leaf['result'] for leaf in classified)
+    diseased = [leaf for leaf in classified if 'healthy' not in leaf['result'].lower()]
+
+    dominant = None
+    if counts:
+        # Most frequent diagnosis; ties go to the more confident one
+        dominant = max(counts, key=lambda result: (
+            counts[result], max(leaf['confidence'] for leaf in classified if leaf['result'] == result)
+        ))
+
+    return {
+        'leaves_detected': len(leaves),
+        'leaves_classified': len(classified),
+        'diseased_leaves': len(diseased),
+        'healthy_leaves': len(classified) - len(diseased),
+        'disease_counts': dict(counts.most_common()),
+        'dominant_result': dominant,
+        'mean_confidence': round(float(np.mean([leaf['confidence'] for leaf in classified])), 4) if classified else 0.0,
+    }
+
+
+def detect_and_classify(image_file, detector=None):
+    """
+    Detect the leaves in a photo, classify every crop in one batched call and summarise.
+
+    Falls back to classifying the whole frame (mode 'whole_frame') when the
+    detector is unavailable or finds no leaves. Returns a dict with 'mode',
+    'leaves' (box, result and confidence per leaf), 'summary' and per-stage
+    'timings_ms'. A run slower than LEAF_DETECTION_BUDGET_MS is logged.
+    """
+    from app.model import model_registry
+    from app.utils import predict_cached, interpret_prediction, not_a_leaf
+    from app.leaf_gate import leaf_gate
+
+    detector = detector or leaf_detector
+    timings = {}
+    start = time.perf_counter()
+
+    image = open_field_photo(image_file)
+    timings['decode'] = (time.perf_counter() - start) * 1000.0
+
+    stage = time.perf_counter()
+    boxes = detector.detect(image) if detector.available() else []
+    timings['detect'] = (time.perf_counter() - stage) * 1000.0
+
+    model_wrapper = model_registry.get()
+    if model_wrapper.model_type is None:
+        raise RuntimeError("Model not available. Please check model loading.")
+
+    stage = time.perf_counter()
+    if boxes:
+        mode = 'leaves'
+        batch = np.stack([crop_leaf(image, box) for box in boxes], axis=0)
+    else:
+        mode = 'whole_frame'
+        boxes = [(0.0, 0.0, float(image.size[0]), float(image.size[1]), 1.0)]
+        batch = np.expand_dims(np.array(image.resize((256, 256), Image.LANCZOS, reducing_gap=2.0)), axis=0)
+    timings['crop'] = (time.perf_counter() - stage) * 1000.0
+
+    # All crops go through the model together; a whole frame that is not a
+    # leaf at all is answered by the leaf gate without running it
+    stage = time.perf_counter()
+    if mode == 'whole_frame' and not leaf_gate.check(batch[0], getattr(image_file, 'name', ''))[0]:
+        predictions = None
+    else:
+        predictions = predict_cached(model_wrapper, batch)
+    timings['classify'] = (time.perf_counter() - stage) * 1000.0
+
+    leaves = []
+    for row, box in enumerate(boxes):
+        if predictions is None:
+            result, confidence = not_a_leaf, 0.0
+        else:
+            result, confidence = interpret_prediction(predictions[row])
+        leaves.append({
+            'box': [round(value, 1) for value in box[:4]],
+            'detection_confidence': round(box[4], 4),
+            'result': result,
+            'confidence': confidence,
+        })
+
+    timings['total'] = (time.perf_counter() - start) * 1000.0
+    budget = float(os.getenv('LEAF_DETECTION_BUDGET_MS', '1500'))
+    if timings['total'] > budget:
+        print(f"Leaf detection took {timings['total']:.0f} ms for {len(leaves)} leaves "
+              f"(budget {budget:.0f} ms): {', '.join(f'{k} {v:.0f}' for k, v in timings.items())}")
+
+    return {
+        'mode': mode,
+        'image_size': list(image.size),
+        'leaves': leaves,
+        'summary': summarize_leaves(leaves),
+        'timings_ms': {stage: round(value, 1) for stage, value in timings.items()},
+    }
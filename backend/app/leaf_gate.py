@@ -0,0 +1,132 @@
+import os
+import time
+import threading
+
+import numpy as np
+
+
+class LeafGate:
+    """
+    Cheap first-stage check that an image shows plant material at all.
+
+    Runs on the already-resized uint8 RGB array, subsampled by `stride`, and
+    measures the fraction of pixels whose colour is plausibly leaf: hue
+    between min_hue and max_hue degrees (yellow through green, so chlorotic
+    leaves still pass, and spotted or browning ones on their remaining green),
+    with enough saturation and brightness to rule out grey, white and black
+    backgrounds. Selfies, soil and wood (hues below min_hue), screenshots and
+    documents score close to zero.
+
+    The colour defaults come from benchmarks/bench_leaf_gate.py. min_ratio is
+    deliberately about a third of the lowest leaf score there (0.066, a leaf
+    filling a quarter of the frame): it only turns away images with almost no
+    leaf colour, and should be raised only after calibrating on real uploads.
+
+    Images with a leaf ratio under min_ratio are rejected before the
+    classifier runs. Each rejection is credited with the mean latency of
+    recent classifier calls as inference time saved.
+    """
+
+    def __init__(self, enabled=True, min_ratio=0.02, min_hue=45.0, max_hue=160.0,
+                 min_saturation=0.15, min_value=0.1, stride=4):
+        self.enabled = enabled
+        self.min_ratio = float(min_ratio)
+        self.min_hue = float(min_hue)
+        self.max_hue = float(max_hue)
+        self.min_saturation = float(min_saturation)
+        self.min_value = float(min_value)
+        self.stride = max(1, int(stride))
+
+        self._lock = threading.Lock()
+        self.checked = 0
+        self.rejected = 0
+        self.gate_seconds = 0.0
+        self.saved_seconds = 0.0
+        self._classifier_seconds = 0.0
+        self._classifier_images = 0
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            enabled=os.getenv('LEAF_GATE_ENABLED', 'true').lower() == 'true',
+            min_ratio=float(os.getenv('LEAF_GATE_MIN_RATIO', '0.02')),
+            min_hue=float(os.getenv('LEAF_GATE_MIN_HUE', '45')),
+            max_hue=float(os.getenv('LEAF_GATE_MAX_HUE', '160')),
+            min_saturation=float(os.getenv('LEAF_GATE_MIN_SATURATION', '0.15')),
+            min_value=float(os.getenv('LEAF_GATE_MIN_VALUE', '0.1')),
+            stride=int(os.getenv('LEAF_GATE_STRIDE', '4')),
+        )
+
+    def leaf_ratio(self, image_array):
+        """Fraction of (subsampled) pixels with a leaf-like colour"""
+        rgb = np.asarray(image_array)[::self.stride, ::self.stride, :3].astype(np.float32) / 255.0
+        r, g, b = rgb[..., 0], rgb[..., 1], rgb[..., 2]
+
+        maximum = rgb.max(axis=-1)
+        minimum = rgb.min(axis=-1)
+        chroma = maximum - minimum
+        saturation = np.where(maximum > 0, chroma / np.maximum(maximum, 1e-6), 0.0)
+
+        # Standard RGB -> hue in degrees, computed only where it is defined
+        safe_chroma = np.maximum(chroma, 1e-6)
+        hue = np.where(
+            maximum == r, ((g - b) / safe_chroma) % 6.0,
+            np.where(maximum == g, (b - r) / safe_chroma + 2.0, (r - g) / safe_chroma + 4.0)
+        ) * 60.0
+
+        leafy = (
+            (chroma > 0)
+            & (hue >= self.min_hue) & (hue <= self.max_hue)
+            & (saturation >= self.min_saturation)
+            & (maximum >= self.min_value)
+        )
+        return float(leafy.mean())
+
+    def check(self, image_array, name=''):
+        """Return (is_leaf, leaf_ratio) for one uint8 (height, width, 3) image"""
+        if not self.enabled:
+            return True, None
+
+        start = time.perf_counter()
+        ratio = self.leaf_ratio(image_array)
+        elapsed = time.perf_counter() - start
+        is_leaf = ratio >= self.min_ratio
+
+        with self._lock:
+            self.checked += 1
+            self.gate_seconds += elapsed
+            if not is_leaf:
+                self.rejected += 1
+                self.saved_seconds += self.classifier_latency()
+
+        if not is_leaf:
+            print(f"Leaf gate rejected {name or 'image'}: leaf ratio {ratio:.3f} < {self.min_ratio} "
+                  f"in {elapsed * 1000.0:.2f} ms ({self.rejected} rejected, "
+                  f"~{self.saved_seconds:.2f}s of inference saved)")
+        return is_leaf, ratio
+
+    def record_classifier(self, seconds, images=1):
+        """Feed the classifier's measured latency into the time-saved estimate"""
+        with self._lock:
+            self._classifier_seconds += seconds
+            self._classifier_images += images
+
+    def classifier_latency(self):
+        """Mean classifier seconds per image observed so far"""
+        if not self._classifier_images:
+            return 0.0
+        return self._classifier_seconds / self._classifier_images
+
+    def stats(self):
+        return {
+            'enabled': self.enabled,
+            'min_ratio': self.min_ratio,
+            'checked': self.checked,
+            'rejected': self.rejected,
+            'gate_mean_ms': round(self.gate_seconds / self.checked * 1000.0, 3) if self.checked else None,
+            'classifier_mean_ms': round(self.classifier_latency() * 1000.0, 1),
+            'inference_saved_s': round(self.saved_seconds, 2),
+        }
+
+
+leaf_gate = LeafGate.from_env()
@@ -0,0 +1,43 @@
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = 'Switch the model version served by every worker, roll back, or list the registry'
+
+    def add_arguments(self, parser):
+        parser.add_argument('version', nargs='?', help='Version to activate')
+        parser.add_argument('--rollback', action='store_true', help='Re-activate the previously active version')
+        parser.add_argument('--list', action='store_true', help='List the published versions')
+
+    def handle(self, *args, **options):
+        from app.model_versions import ModelManifest
+
+        manifest = ModelManifest()
+        data = manifest.read()
+
+        if options['list'] or not (options['version'] or options['rollback']):
+            if not data['versions']:
+                self.stdout.write(f"No model versions published in {manifest.root}")
+                return
+            for entry in manifest.versions():
+                marker = '*' if entry['version'] == data.get('active') else ' '
+                self.stdout.write(
+                    f"{marker} {entry['version']:<24}{entry['backend']:<12}{entry['sha256'][:12]}  "
+                    f"{entry['created_at'][:19]}  {entry.get('notes', '')}"
+                )
+            return
+
+        version = options['version']
+        if options['rollback']:
+            version = data.get('previous')
+            if not version:
+                raise CommandError("There is no previous version to roll back to")
+
+        try:
+            entry = manifest.activate(version)
+        except ValueError as e:
+            raise CommandError(str(e))
+        self.stdout.write(self.style.SUCCESS(
+            f"Activated {entry['version']} ({entry['backend']}); workers switch to it within "
+            f"MODEL_REGISTRY_POLL_SECONDS without restarting"
+        ))
@@ -0,0 +1,73 @@
+import os
+
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from app.model_conversion import keras_to_onnx, find_sample_images, check_top1_parity
+
+
+class Command(BaseCommand):
+    help = 'Convert the Keras model to ONNX and check top-1 parity with Keras on sample images'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', default=str(settings.ONNX_MODEL_FILE),
+                            help='Where to write the ONNX model')
+        parser.add_argument('--images-dir', default=str(settings.MEDIA_ROOT),
+                            help='Folder of sample leaf images used for the parity check')
+        parser.add_argument('--opset', type=int, default=13, help='ONNX opset version')
+        parser.add_argument('--skip-parity', action='store_true', help='Only convert, do not compare with Keras')
+
+    def handle(self, *args, **options):
+        import tensorflow as tf
+
+        if not os.path.exists(settings.TF_MODEL_FILE):
+            raise CommandError(f"TensorFlow model not found at {settings.TF_MODEL_FILE}")
+
+        self.stdout.write(f"Loading Keras model from {settings.TF_MODEL_FILE}...")
+        keras_model = tf.keras.models.load_model(settings.TF_MODEL_FILE, compile=False)
+
+        self.stdout.write(f"Converting to ONNX (opset {options['opset']})...")
+        keras_to_onnx(keras_model, options['output'], opset=options['opset'])
+        size_mb = os.path.getsize(options['output']) / (1024 * 1024)
+        self.stdout.write(self.style.SUCCESS(f"Wrote {options['output']} ({size_mb:.1f} MB)"))
+
+        if options['skip_parity']:
+            return
+
+        import onnxruntime as ort
+
+        session = ort.InferenceSession(options['output'], providers=['CPUExecutionProvider'])
+        input_name = session.get_inputs()[0].name
+
+        image_paths = find_sample_images(options['images_dir'])
+        if not image_paths:
+            raise CommandError(f"No readable sample images found in {options['images_dir']}")
+
+        # Keras shapes are (batch, height, width, channels); PIL sizes are (width, height)
+        input_shape = keras_model.inputs[0].shape
+        input_size = (int(input_shape[2]), int(input_shape[1]))
+        report = check_top1_parity(
+            lambda batch: keras_model.predict(batch.astype(np.float32), verbose=0),
+            lambda batch: session.run(None, {input_name: batch.astype(np.float32)})[0],
+            image_paths,
+            size=input_size,
+        )
+
+        self.stdout.write(
+            f"Top-1 parity: {report['matches']}/{report['total']} images match, "
+            f"max probability difference {report['max_abs_diff']:.6f}"
+        )
+        for mismatch in report['mismatches']:
+            self.stdout.write(self.style.WARNING(
+                f"  {mismatch['image']}: keras={mismatch['reference_class']} onnx={mismatch['candidate_class']}"
+            ))
+
+        self.stdout.write(
+            f"Batch parity: batched vs one-at-a-time max probability difference {report['batch_max_abs_diff']:.6f}"
+        )
+        if report['mismatches']:
+            raise CommandError("ONNX model does not match Keras top-1 predictions")
+        if report['batch_mismatches']:
+            raise CommandError(f"ONNX model predicts differently in a batch: {', '.join(report['batch_mismatches'])}")
+        self.stdout.write(self.style.SUCCESS("ONNX model matches Keras on all sample images"))
@@ -0,0 +1,39 @@
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the PyTorch checkpoint architecture and export it as frozen TorchScript'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--checkpoint', default=str(settings.PT_MODEL_FILE), help='PyTorch checkpoint to export')
+        parser.add_argument('--output', default=str(settings.TORCHSCRIPT_MODEL_FILE),
+                            help='Where to write the TorchScript model')
+
+    def handle(self, *args, **options):
+        import torch
+        from app.torch_models import build_model_from_checkpoint, export_torchscript
+
+        if not os.path.exists(options['checkpoint']):
+            raise CommandError(f"PyTorch checkpoint not found at {options['checkpoint']}")
+
+        checkpoint = torch.load(options['checkpoint'], map_location='cpu')
+        if isinstance(checkpoint, torch.nn.Module):
+            model = checkpoint.eval()
+            with torch.no_grad():
+                num_classes = int(model(torch.zeros(1, 3, 256, 256)).shape[1])
+            spec = {'architecture': type(checkpoint).__name__, 'input_size': None,
+                    'mean': None, 'std': None, 'num_classes': num_classes}
+        else:
+            try:
+                model, spec = build_model_from_checkpoint(checkpoint)
+            except Exception as e:
+                raise CommandError(f"Could not rebuild the model architecture: {str(e)}")
+
+        self.stdout.write(f"Exporting {spec['architecture']} (classes: {spec['num_classes']}, input: {spec['input_size']})")
+
+        export_torchscript(model, spec, options['output'])
+        size_mb = os.path.getsize(options['output']) / (1024 * 1024)
+        self.stdout.write(self.style.SUCCESS(f"Wrote {options['output']} ({size_mb:.1f} MB)"))
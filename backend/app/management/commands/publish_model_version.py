@@ -0,0 +1,44 @@
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = 'Add a model file to the versioned model registry (MODEL_REGISTRY_DIR), optionally activating it'
+
+    def add_arguments(self, parser):
+        parser.add_argument('model_file', help='Model file to publish (.h5, .keras, .pt, .torchscript.pt, .onnx or .tflite)')
+        parser.add_argument('version', help='Version name, e.g. 2026-10-18 or c1-v3')
+        parser.add_argument('--backend', choices=['tensorflow', 'pytorch', 'torchscript', 'onnx', 'tflite'],
+                            help='Backend that serves the file (default: from its suffix)')
+        parser.add_argument('--input-shape', default='256,256,3', help='height,width,channels the model takes')
+        parser.add_argument('--notes', default='', help='Free-text description kept in the manifest')
+        parser.add_argument('--activate', action='store_true',
+                            help='Make it the active version; workers switch to it on their next poll')
+
+    def handle(self, *args, **options):
+        from app.model_versions import ModelManifest
+
+        if not os.path.exists(options['model_file']):
+            raise CommandError(f"Model file not found: {options['model_file']}")
+        try:
+            input_shape = [int(value) for value in options['input_shape'].split(',')]
+        except ValueError:
+            raise CommandError(f"Invalid --input-shape '{options['input_shape']}'")
+
+        manifest = ModelManifest()
+        try:
+            entry = manifest.publish(
+                options['model_file'], options['version'], backend=options['backend'],
+                input_shape=input_shape, notes=options['notes'],
+            )
+        except ValueError as e:
+            raise CommandError(str(e))
+        self.stdout.write(self.style.SUCCESS(
+            f"Published {entry['version']} ({entry['backend']}, {entry['size_bytes'] / (1024 * 1024):.1f} MB, "
+            f"sha256 {entry['sha256'][:12]}) to {manifest.root}"
+        ))
+
+        if options['activate']:
+            manifest.activate(entry['version'])
+            self.stdout.write(self.style.SUCCESS(f"Activated {entry['version']}"))
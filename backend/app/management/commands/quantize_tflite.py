@@ -0,0 +1,160 @@
+import os
+import json
+import random
+
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from app.model_conversion import (
+    keras_to_tflite_int8, run_tflite_interpreter, find_sample_images, find_labelled_images,
+    load_sample_batch, measure_latency, measure_model_rss, check_top1_parity,
+)
+
+
+class Command(BaseCommand):
+    help = 'Quantize the Keras model to a full-integer INT8 TFLite model and report accuracy, latency, size and RSS'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--calibration-dir', required=True,
+                            help='Folder of leaf images used to calibrate activation ranges (searched recursively)')
+        parser.add_argument('--num-calibration', type=int, default=200,
+                            help='Maximum number of calibration images')
+        parser.add_argument('--eval-dir', default=None,
+                            help='Folder with one sub-folder per class for the accuracy report '
+                                 '(defaults to the calibration folder)')
+        parser.add_argument('--output', default=str(settings.TFLITE_MODEL_FILE),
+                            help='Where to write the TFLite model')
+        parser.add_argument('--report', default=None, help='Also write the report as JSON to this path')
+        parser.add_argument('--latency-runs', type=int, default=20, help='Timed runs per model')
+        parser.add_argument('--skip-report', action='store_true', help='Only quantize, do not compare models')
+
+    def handle(self, *args, **options):
+        import tensorflow as tf
+
+        if not os.path.exists(settings.TF_MODEL_FILE):
+            raise CommandError(f"TensorFlow model not found at {settings.TF_MODEL_FILE}")
+
+        calibration_paths = find_sample_images(options['calibration_dir'], recursive=True)
+        if not calibration_paths:
+            raise CommandError(f"No readable calibration images found in {options['calibration_dir']}")
+        random.Random(0).shuffle(calibration_paths)
+
+        self.stdout.write(f"Loading Keras model from {settings.TF_MODEL_FILE}...")
+        keras_model = tf.keras.models.load_model(settings.TF_MODEL_FILE, compile=False)
+
+        num_calibration = min(options['num_calibration'], len(calibration_paths))
+        self.stdout.write(f"Quantizing to INT8 with {num_calibration} calibration images...")
+        keras_to_tflite_int8(keras_model, calibration_paths, options['output'], num_calibration=num_calibration)
+        self.stdout.write(self.style.SUCCESS(f"Wrote {options['output']}"))
+
+        if options['skip_report']:
+            return
+
+        interpreter = tf.lite.Interpreter(model_path=options['output'])
+        interpreter.allocate_tensors()
+
+        def float_predict(batch):
+            return keras_model.predict(batch.astype(np.float32), verbose=0)
+
+        def int8_predict(batch):
+            return run_tflite_interpreter(interpreter, batch)
+
+        # Keras shapes are (batch, height, width, channels); PIL sizes are (width, height)
+        input_shape = keras_model.inputs[0].shape
+        input_size = (int(input_shape[2]), int(input_shape[1]))
+
+        # The micro-batcher and inference pool send batches of any size
+        parity = check_top1_parity(float_predict, int8_predict, calibration_paths[:8], size=input_size)
+        self.stdout.write(
+            f"Batch parity on {parity['total']} images: batched vs one-at-a-time max probability "
+            f"difference {parity['batch_max_abs_diff']:.4f}"
+        )
+        if parity['batch_mismatches']:
+            raise CommandError(f"INT8 model predicts differently in a batch: {', '.join(parity['batch_mismatches'])}")
+
+        report = {
+            'float_model': str(settings.TF_MODEL_FILE),
+            'int8_model': options['output'],
+            'calibration_images': num_calibration,
+            'batch_max_abs_diff': parity['batch_max_abs_diff'],
+        }
+
+        report['accuracy'] = self.compare_accuracy(
+            float_predict, int8_predict, options['eval_dir'] or options['calibration_dir'], input_size
+        )
+
+        sample = load_sample_batch(calibration_paths[:1], input_size)
+        self.stdout.write("Measuring single-image latency...")
+        report['latency_ms'] = {
+            'float': measure_latency(float_predict, sample, runs=options['latency_runs']),
+            'int8': measure_latency(int8_predict, sample, runs=options['latency_runs']),
+        }
+
+        report['size_mb'] = {
+            'float': os.path.getsize(settings.TF_MODEL_FILE) / (1024 * 1024),
+            'int8': os.path.getsize(options['output']) / (1024 * 1024),
+        }
+
+        self.stdout.write("Measuring resident memory in fresh processes...")
+        report['rss_mb'] = {
+            'float': measure_model_rss('keras', str(settings.TF_MODEL_FILE)),
+            'int8': measure_model_rss('tflite', options['output']),
+        }
+
+        self.print_report(report)
+        if options['report']:
+            with open(options['report'], 'w') as f:
+                json.dump(report, f, indent=2)
+            self.stdout.write(f"Report written to {options['report']}")
+
+    def compare_accuracy(self, float_predict, int8_predict, eval_dir, input_size):
+        from app.utils import disease_class
+
+        labelled = find_labelled_images(eval_dir, disease_class)
+        if labelled:
+            paths = [path for path, _ in labelled]
+            labels = np.array([label for _, label in labelled])
+        else:
+            # Unlabelled folder: only agreement between the two models can be reported
+            paths = find_sample_images(eval_dir, recursive=True)
+            labels = None
+
+        if not paths:
+            raise CommandError(f"No readable evaluation images found in {eval_dir}")
+
+        self.stdout.write(f"Comparing predictions on {len(paths)} images...")
+        float_top1, int8_top1 = [], []
+        for start in range(0, len(paths), 32):
+            batch = load_sample_batch(paths[start:start + 32], input_size)
+            float_top1.extend(np.argmax(float_predict(batch), axis=1))
+            int8_top1.extend(np.argmax(int8_predict(batch), axis=1))
+        float_top1 = np.array(float_top1)
+        int8_top1 = np.array(int8_top1)
+
+        accuracy = {
+            'images': len(paths),
+            'top1_agreement': float(np.mean(float_top1 == int8_top1)),
+            'float_accuracy': None,
+            'int8_accuracy': None,
+        }
+        if labels is not None:
+            accuracy['float_accuracy'] = float(np.mean(float_top1 == labels))
+            accuracy['int8_accuracy'] = float(np.mean(int8_top1 == labels))
+        return accuracy
+
+    def print_report(self, report):
+        accuracy = report['accuracy']
+        latency = report['latency_ms']
+
+        def fmt(value):
+            return 'n/a' if value is None else f"{value:.2%}"
+
+        self.stdout.write("")
+        self.stdout.write(f"{'':22}{'float':>12}{'int8':>12}")
+        self.stdout.write(f"{'accuracy':22}{fmt(accuracy['float_accuracy']):>12}{fmt(accuracy['int8_accuracy']):>12}")
+        self.stdout.write(f"{'latency p50 (ms)':22}{latency['float']['p50_ms']:>12.1f}{latency['int8']['p50_ms']:>12.1f}")
+        self.stdout.write(f"{'latency p95 (ms)':22}{latency['float']['p95_ms']:>12.1f}{latency['int8']['p95_ms']:>12.1f}")
+        self.stdout.write(f"{'model size (MB)':22}{report['size_mb']['float']:>12.1f}{report['size_mb']['int8']:>12.1f}")
+        self.stdout.write(f"{'RSS (MB)':22}{report['rss_mb']['float']:>12.1f}{report['rss_mb']['int8']:>12.1f}")
+        self.stdout.write(f"Top-1 agreement on {accuracy['images']} images: {accuracy['top1_agreement']:.2%}")
@@ -0,0 +1,55 @@
+import os
+import signal
+import threading
+
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = 'Serve model predictions over gRPC for web workers running with MODEL_BACKEND=grpc'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--address', default=os.getenv('INFERENCE_GRPC_BIND', '0.0.0.0:50051'),
+                            help='host:port to listen on')
+        parser.add_argument('--workers', type=int, default=int(os.getenv('INFERENCE_GRPC_WORKERS', '8')),
+                            help='Concurrent RPCs handled by this server')
+        parser.add_argument('--backend', default=os.getenv('INFERENCE_SERVER_BACKEND', ''),
+                            help='Model backend to serve (default: MODEL_BACKEND, but never grpc)')
+        parser.add_argument('--grace', type=float, default=10.0,
+                            help='Seconds in-flight RPCs get to finish on shutdown')
+
+    def handle(self, *args, **options):
+        from app.model import model_registry
+        from app.inference_service import build_server
+
+        # The served backend becomes the registry's default, so it follows the active model version
+        backend = model_registry.serve_locally(options['backend'] or None)
+
+        self.stdout.write(f'Loading {backend} model...')
+        model_registry.prewarm(backend)
+        model_wrapper = model_registry.get(backend)
+        if model_wrapper.model_type is None:
+            raise CommandError('No model could be loaded; refusing to start an inference server without one')
+
+        try:
+            # Fetched from the registry per request, so activated model versions are picked up
+            server, port = build_server(options['address'], backend=backend, max_workers=options['workers'])
+        except RuntimeError as e:
+            raise CommandError(str(e))
+        server.start()
+        self.stdout.write(self.style.SUCCESS(
+            f"Inference server serving {model_wrapper.model_type} ({model_wrapper.version()}) "
+            f"on {options['address'].rsplit(':', 1)[0]}:{port} with {options['workers']} workers"
+        ))
+
+        stopped = threading.Event()
+
+        def stop(signum, frame):
+            self.stdout.write('Shutting down inference server...')
+            server.stop(options['grace']).wait()
+            stopped.set()
+
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(signum, stop)
+        while not stopped.wait(1.0):
+            pass
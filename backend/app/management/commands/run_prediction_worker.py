@@ -0,0 +1,68 @@
+import time
+import signal
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+
+class Command(BaseCommand):
+    help = 'Run queued prediction jobs from /api/predict/ and expire old ones'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--poll-interval', type=float, default=1.0,
+                            help='Seconds to sleep when the queue is empty')
+        parser.add_argument('--maintenance-interval', type=float, default=60.0,
+                            help='Seconds between expiry / stale-job sweeps')
+        parser.add_argument('--max-jobs', type=int, default=0,
+                            help='Exit after this many jobs (0 runs until stopped)')
+        parser.add_argument('--once', action='store_true',
+                            help='Drain the queue, then exit')
+        parser.add_argument('--no-prewarm', action='store_true',
+                            help='Load the model on the first job instead of at startup')
+
+    def handle(self, *args, **options):
+        from app.jobs import claim_job, run_job, expire_jobs, requeue_stale_jobs, default_worker_name
+        from app.model import model_registry
+        from app.model_evaluation import candidate_evaluator
+
+        worker = default_worker_name()
+        self.stopping = False
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(signum, self.stop)
+
+        if not options['no_prewarm']:
+            self.stdout.write('Loading model...')
+            model_registry.prewarm()
+            candidate_evaluator.prewarm()
+            self.stdout.write(f"Model state: {model_registry.status()['state']}")
+
+        self.stdout.write(f"Prediction worker {worker} started")
+        jobs_run = 0
+        last_maintenance = 0.0
+
+        while not self.stopping:
+            if time.monotonic() - last_maintenance >= options['maintenance_interval']:
+                requeued, failed = requeue_stale_jobs()
+                expired = expire_jobs()
+                if requeued or failed or expired:
+                    self.stdout.write(f"Requeued {requeued}, failed {failed} stale and expired {expired} job(s)")
+                last_maintenance = time.monotonic()
+
+            job = claim_job(worker)
+            if job is None:
+                close_old_connections()
+                if options['once']:
+                    break
+                time.sleep(options['poll_interval'])
+                continue
+
+            run_job(job)
+            jobs_run += 1
+            if options['max_jobs'] and jobs_run >= options['max_jobs']:
+                break
+
+        self.stdout.write(self.style.SUCCESS(f"Prediction worker {worker} stopped after {jobs_run} job(s)"))
+
+    def stop(self, signum, frame):
+        # Finish the job in hand, then exit
+        self.stopping = True
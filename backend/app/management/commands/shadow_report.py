@@ -0,0 +1,57 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+
+class Command(BaseCommand):
+    help = 'Summarise shadow comparisons of candidate model versions against the serving model'
+
+    def add_arguments(self, parser):
+        parser.add_argument('candidate', nargs='?', help='Only this candidate version (default: all)')
+        parser.add_argument('--hours', type=float, default=24.0, help='Look back this many hours')
+        parser.add_argument('--disagreements', type=int, default=10,
+                            help='List the most frequent primary -> candidate label changes')
+
+    def handle(self, *args, **options):
+        from collections import Counter
+        from app.models import ShadowComparison
+        from app.model_evaluation import percentile
+
+        comparisons = ShadowComparison.objects.filter(
+            created_at__gte=timezone.now() - timedelta(hours=options['hours'])
+        )
+        if options['candidate']:
+            comparisons = comparisons.filter(candidate_version=options['candidate'])
+
+        rows = list(comparisons.values(
+            'candidate_version', 'primary_version', 'primary_result', 'candidate_result', 'agreed',
+            'confidence_delta', 'primary_latency_ms', 'candidate_latency_ms',
+        ))
+        if not rows:
+            self.stdout.write(f"No shadow comparisons in the last {options['hours']:g} hours")
+            return
+
+        self.stdout.write(f"{'candidate':<20}{'primary':<20}{'n':>7}{'agree':>8}{'Δconf':>8}"
+                          f"{'primary p50/p95 ms':>20}{'candidate p50/p95 ms':>22}")
+        groups = {}
+        for row in rows:
+            groups.setdefault((row['candidate_version'], row['primary_version']), []).append(row)
+        for (candidate, primary), group in sorted(groups.items()):
+            primary_ms = [row['primary_latency_ms'] for row in group]
+            candidate_ms = [row['candidate_latency_ms'] for row in group]
+            self.stdout.write(
+                f"{candidate:<20}{primary:<20}{len(group):>7}"
+                f"{sum(row['agreed'] for row in group) / len(group):>8.1%}"
+                f"{sum(row['confidence_delta'] for row in group) / len(group):>+8.3f}"
+                f"{f'{percentile(primary_ms, 0.5)}/{percentile(primary_ms, 0.95)}':>20}"
+                f"{f'{percentile(candidate_ms, 0.5)}/{percentile(candidate_ms, 0.95)}':>22}"
+            )
+
+        changes = Counter(
+            (row['primary_result'], row['candidate_result']) for row in rows if not row['agreed']
+        ).most_common(options['disagreements'])
+        if changes:
+            self.stdout.write("\nMost frequent disagreements (primary -> candidate):")
+            for (primary_result, candidate_result), count in changes:
+                self.stdout.write(f"{count:>7}  {primary_result} -> {candidate_result}")
@@ -0,0 +1,70 @@
+import os
+
+
+def rss_mb(pid=None):
+    """Resident set size of a process in MB (defaults to the current process)"""
+    pid = pid or os.getpid()
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024.0
+    except OSError:
+        pass
+
+    # Non-Linux fallback: peak RSS of the current process only
+    import resource
+    import sys
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024.0 * 1024.0) if sys.platform == 'darwin' else peak / 1024.0
+
+
+def peak_rss_mb():
+    """Peak resident set size of the current process in MB since it was started (or exec'd)"""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024.0
+    except OSError:
+        pass
+
+    # ru_maxrss survives exec on Linux, so it is only the fallback here
+    import resource
+    import sys
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024.0 * 1024.0) if sys.platform == 'darwin' else peak / 1024.0
+
+
+def memory_breakdown(pid):
+    """
+    RSS, PSS and unique (private) memory of a process in MB, from /proc/<pid>/smaps_rollup.
+
+    Unique memory (USS) is what a process would free if it exited; pages
+    shared copy-on-write with the gunicorn master only count towards RSS/PSS.
+    """
+    fields = {}
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) >= 3 and parts[0].endswith(':') and parts[2] == 'kB':
+                fields[parts[0][:-1]] = int(parts[1]) / 1024.0
+
+    return {
+        'rss_mb': fields.get('Rss', 0.0),
+        'pss_mb': fields.get('Pss', 0.0),
+        'uss_mb': fields.get('Private_Clean', 0.0) + fields.get('Private_Dirty', 0.0),
+        'shared_mb': fields.get('Shared_Clean', 0.0) + fields.get('Shared_Dirty', 0.0),
+    }
+
+
+def child_pids(pid):
+    """PIDs of the direct children of a process (e.g. gunicorn workers of a master)"""
+    children = []
+    for task in os.listdir(f"/proc/{pid}/task"):
+        try:
+            with open(f"/proc/{pid}/task/{task}/children") as f:
+                children.extend(int(child) for child in f.read().split())
+        except OSError:
+            continue
+    return sorted(set(children))
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.3 on 2026-10-18 09:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0006_predictionjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='predictionhistory',
+            name='model_version',
+            field=models.CharField(blank=True, help_text='Model version that made the prediction', max_length=100),
+        ),
+    ]
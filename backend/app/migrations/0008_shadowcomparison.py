@@ -0,0 +1,35 @@
+# Generated by Django 5.1.3 on 2026-10-18 09:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0007_predictionhistory_model_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ShadowComparison',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('primary_version', models.CharField(max_length=100)),
+                ('candidate_version', models.CharField(db_index=True, max_length=100)),
+                ('primary_result', models.CharField(max_length=100)),
+                ('candidate_result', models.CharField(max_length=100)),
+                ('agreed', models.BooleanField()),
+                ('primary_confidence', models.FloatField()),
+                ('candidate_confidence', models.FloatField()),
+                ('confidence_delta', models.FloatField(help_text='Candidate minus primary top-class confidence')),
+                ('primary_latency_ms', models.FloatField()),
+                ('candidate_latency_ms', models.FloatField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'verbose_name': 'Shadow Comparison',
+                'verbose_name_plural': 'Shadow Comparisons',
+                'ordering': ['-created_at'],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.3 on 2026-10-18 09:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0008_shadowcomparison'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='predictionjob',
+            name='crop_type',
+            field=models.CharField(blank=True, help_text='Crop named by the client, if any', max_length=100),
+        ),
+    ]
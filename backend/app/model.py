@@ -1,25 +1,148 @@
 import os
 os.environ['TF_CPP_MIN_LOG_LEVEL'] = '2'
 
-import tensorflow as tf
-from tensorflow import keras
-import torch
-import torch.nn as nn
-from torchvision import models, transforms
 import numpy as np
 from PIL import Image
 import requests
 import logging
+import threading
+import time
 from urllib.parse import urlparse
+from app.batching import MicroBatcher
+from app.model_conversion import keras_to_onnx, run_tflite_interpreter
+from app.inference_threads import thread_settings, apply_thread_env, configure_tensorflow, configure_torch
+
+# Number of disease classes the app knows how to label (see app.utils.disease_class)
+NUM_CLASSES = 17
+
+# TensorFlow, torch and torchvision take seconds to import, so they are only
+# imported by the loaders of the backend that needs them. Processes that never
+# run inference (migrate, collectstatic, non-ML requests) never pay for them.
+_tf_configured = False
+
+
+def import_tensorflow():
+    """Import TensorFlow on first use, keep it off any GPU (inference is served on CPU) and size its thread pools"""
+    global _tf_configured
+    apply_thread_env()
+    import tensorflow as tf
+
+    if not _tf_configured:
+        try:
+            tf.config.set_visible_devices([], 'GPU')
+        except (RuntimeError, ValueError) as e:
+            # Devices can no longer be changed once TensorFlow has initialised them
+            print(f"Could not hide GPUs from TensorFlow: {str(e)}")
+        configure_tensorflow(tf)
+        _tf_configured = True
+    return tf
+
+
+def import_torch():
+    """Import torch on first use with its thread pools sized by thread_settings()"""
+    apply_thread_env()
+    import torch
+
+    configure_torch(torch)
+    return torch
+
+
+def serving_batch_sizes():
+    """Batch sizes the compiled TensorFlow function is traced and warmed up for (TF_SERVING_BATCH_SIZES)"""
+    sizes = sorted({max(1, int(size)) for size in os.getenv('TF_SERVING_BATCH_SIZES', '1,2,4,8,16').split(',') if size.strip()})
+    return sizes or [1]
+
+
+def bucket_for(batch_size, buckets):
+    """Smallest bucket that holds batch_size, or the largest bucket when none does"""
+    for bucket in buckets:
+        if bucket >= batch_size:
+            return bucket
+    return buckets[-1]
+
+
+def build_serving_function(tf, keras_model, jit_compile=False):
+    """
+    Wrap a Keras model in a tf.function with a fixed uint8 input signature.
+
+    Calling the function skips Keras predict()'s per-call data pipeline and
+    callback setup. The batch dimension is left open in the signature so one
+    concrete function serves every bucket; with jit_compile, XLA compiles a
+    kernel per distinct batch size, which is why callers pad to a bucket.
+    """
+    _, height, width, channels = keras_model.input_shape
+
+    @tf.function(
+        input_signature=[tf.TensorSpec(shape=[None, height, width, channels], dtype=tf.uint8)],
+        jit_compile=jit_compile,
+    )
+    def serve(images):
+        # Keras predict() casts the uint8 batch the same way, without rescaling
+        return keras_model(tf.cast(images, tf.float32), training=False)
+
+    return serve
+
 
 class ModelWrapper:
-    def __init__(self):
+    def __init__(self, backend=None, artifact=None):
         self.tf_model = None
+        self.tf_serve = None
         self.pt_model = None
+        self.pt_spec = None
+        self.onnx_session = None
+        self.onnx_input_name = None
+        self.tflite_interpreter = None
+        self.tflite_lock = threading.Lock()
+        self.grpc_client = None
+        self.pool = None
         self.model_type = None
+        self.warmed_up = False
+
+        # A model registry version (app.model_versions) being served, and the
+        # wrapper that took over once this one was retired
+        self.artifact = artifact
+        self.successor = None
+        self.in_flight = 0
+        self._in_flight_lock = threading.Lock()
+
+        # Inference backend chosen at startup: auto (Keras, then PyTorch), tensorflow, pytorch, onnx, tflite,
+        # torchscript, or grpc (remote inference servers)
+        self.backend = (artifact['backend'] if artifact else backend or os.getenv('MODEL_BACKEND', 'auto')).lower()
         self.models_dir = os.path.join(os.path.dirname(__file__), "ml_models")
         os.makedirs(self.models_dir, exist_ok=True)
-        self.load_models()
+
+        # Concurrent single-image requests are coalesced into one model call
+        self.batching_enabled = os.getenv('PREDICT_BATCHING_ENABLED', 'true').lower() == 'true'
+        self.batcher = MicroBatcher(
+            self.predict,
+            max_batch_size=int(os.getenv('PREDICT_BATCH_MAX_SIZE', '16')),
+            max_wait_ms=float(os.getenv('PREDICT_BATCH_TIMEOUT_MS', '10')),
+        )
+
+        # With MODEL_BACKEND=grpc the model runs on separate inference servers
+        # (manage.py run_inference_server) listed in INFERENCE_GRPC_ADDRESSES
+        if self.backend == 'grpc':
+            from app.inference_service import InferenceClient
+            self.grpc_client = InferenceClient.from_env()
+            self.model_type = 'grpc'
+            print(f"Serving predictions from inference servers at {', '.join(self.grpc_client.addresses)}")
+            return
+
+        # With INFERENCE_POOL_ENABLED the model (or registry version) lives in
+        # separate processes and this wrapper only hands batches over to them
+        if os.getenv('INFERENCE_POOL_ENABLED', 'false').lower() == 'true':
+            from app.inference_pool import InferencePool
+            self.pool = InferencePool.from_env(backend=self.backend, artifact=artifact)
+            self.model_type = self.pool.start()
+            if self.model_type is not None:
+                return
+            print("Inference pool unavailable, loading models in this process")
+            self.pool = None
+
+        if artifact is not None:
+            self.load_artifact(artifact)
+        else:
+            self.load_models()
 
     def download_file_from_google_drive(self, file_id, destination):
         """Download file from Google Drive"""
@@ -97,6 +220,13 @@ class ModelWrapper:
             tf_filename = os.getenv('TF_MODEL_FILENAME', 'CropLeaf-C1.h5')
             pt_filename = os.getenv('PT_MODEL_FILENAME', 'plant_disease_model_1_latest.pt')
 
+            # Frozen TorchScript export of the PyTorch checkpoint
+            pt_model_path = os.path.join(self.models_dir, pt_filename)
+            if self.backend == 'torchscript':
+                if self.load_torchscript_model(pt_model_path, pt_model_url, pt_model_drive_id):
+                    return
+                print("TorchScript backend unavailable, falling back to TensorFlow/PyTorch models")
+
             # Try to load TensorFlow/Keras model first
             tf_model_path = os.path.join(self.models_dir, tf_filename)
             if not os.path.exists(tf_model_path):
@@ -104,10 +234,23 @@ class ModelWrapper:
                 if not self.ensure_model_available(tf_filename, tf_model_url, tf_model_drive_id):
                     print("Failed to download TensorFlow model")
 
-            if os.path.exists(tf_model_path):
+            # ONNX Runtime serves a one-time export of the Keras model
+            if self.backend == 'onnx':
+                if self.load_onnx_model(tf_model_path):
+                    return
+                print("ONNX backend unavailable, falling back to TensorFlow/PyTorch models")
+
+            # INT8 TFLite model produced by the quantize_tflite management command
+            if self.backend == 'tflite':
+                if self.load_tflite_model():
+                    return
+                print("TFLite backend unavailable, falling back to TensorFlow/PyTorch models")
+
+            if self.backend == 'pytorch':
+                print("Skipping TensorFlow model (MODEL_BACKEND=pytorch)")
+            elif os.path.exists(tf_model_path):
                 try:
-                    self.tf_model = tf.keras.models.load_model(tf_model_path)
-                    self.tf_model.compile(optimizer='adam', loss='categorical_crossentropy', metrics=['accuracy'])
+                    self.load_keras_model(tf_model_path)
                     self.model_type = 'tensorflow'
                     print(f"TensorFlow/Keras Model ({tf_filename}) loaded successfully")
                 except Exception as e:
@@ -118,30 +261,31 @@ class ModelWrapper:
                 self.tf_model = None
 
             # Try to load PyTorch model
-            pt_model_path = os.path.join(self.models_dir, pt_filename)
-            if not os.path.exists(pt_model_path):
-                print("PyTorch model not found locally, attempting to download...")
-                if not self.ensure_model_available(pt_filename, pt_model_url, pt_model_drive_id):
-                    print("Failed to download PyTorch model")
-
-            if os.path.exists(pt_model_path):
-                try:
-                    # Load the checkpoint
-                    checkpoint = torch.load(pt_model_path, map_location=torch.device('cpu'))
-
-                    # Store the checkpoint for now - we'll handle prediction differently
-                    self.pt_model = checkpoint
-                    print("PyTorch model checkpoint loaded (architecture detection pending)")
-
-                    if self.tf_model is None:
-                        self.model_type = 'pytorch'
-                    print(f"PyTorch Model ({pt_filename}) loaded successfully")
-                except Exception as e:
-                    print(f"Error loading PyTorch model: {str(e)}")
-                    self.pt_model = None
+            if self.backend in ('tensorflow', 'onnx', 'tflite', 'torchscript'):
+                print(f"Skipping PyTorch model (MODEL_BACKEND={self.backend})")
             else:
-                print("PyTorch model file not available")
-                self.pt_model = None
+                if not os.path.exists(pt_model_path):
+                    print("PyTorch model not found locally, attempting to download...")
+                    if not self.ensure_model_available(pt_filename, pt_model_url, pt_model_drive_id):
+                        print("Failed to download PyTorch model")
+
+                if os.path.exists(pt_model_path):
+                    try:
+                        # Rebuild the network from the checkpoint so it can serve predictions
+                        torch = import_torch()
+                        self.pt_model, self.pt_spec = self.load_pytorch_checkpoint(pt_model_path)
+                        self.pt_model = self.pt_model.to(memory_format=torch.channels_last)
+                        print(f"PyTorch architecture reconstructed: {self.pt_spec['architecture']}")
+
+                        if self.tf_model is None:
+                            self.model_type = 'pytorch'
+                        print(f"PyTorch Model ({pt_filename}) loaded successfully")
+                    except Exception as e:
+                        print(f"Error loading PyTorch model: {str(e)}")
+                        self.pt_model = None
+                else:
+                    print("PyTorch model file not available")
+                    self.pt_model = None
 
             if self.tf_model is None and self.pt_model is None:
                 print("No models could be loaded. Application will continue without ML models.")
@@ -163,46 +307,279 @@ class ModelWrapper:
             self.pt_model = None
             self.model_type = None
 
+    def load_keras_model(self, tf_model_path):
+        """Load a Keras model and, unless TF_SERVING_FUNCTION is off, its compiled serving function"""
+        tf = import_tensorflow()
+        self.tf_model = tf.keras.models.load_model(tf_model_path)
+        self.tf_model.compile(optimizer='adam', loss='categorical_crossentropy', metrics=['accuracy'])
+        if os.getenv('TF_SERVING_FUNCTION', 'true').lower() == 'true':
+            jit_compile = os.getenv('TF_JIT_COMPILE', 'false').lower() == 'true'
+            self.tf_serve = build_serving_function(tf, self.tf_model, jit_compile=jit_compile)
+            print(f"Serving TensorFlow through tf.function (jit_compile={jit_compile}, "
+                  f"batch buckets {serving_batch_sizes()})")
+
+    def load_artifact(self, artifact):
+        """Load the file of a model registry version with the loader for its backend"""
+        path, backend = artifact['path'], artifact['backend']
+        try:
+            if backend == 'tensorflow':
+                self.load_keras_model(path)
+            elif backend == 'pytorch':
+                torch = import_torch()
+                self.pt_model, self.pt_spec = self.load_pytorch_checkpoint(path)
+                self.pt_model = self.pt_model.to(memory_format=torch.channels_last)
+            elif backend == 'torchscript':
+                import_torch()
+                from app.torch_models import load_torchscript
+                self.pt_model, self.pt_spec = load_torchscript(path)
+            elif backend == 'onnx':
+                self.create_onnx_session(path)
+            elif backend == 'tflite':
+                self.create_tflite_interpreter(path)
+            else:
+                raise ValueError(f"Unsupported model registry backend '{backend}'")
+            self.model_type = backend
+            print(f"Model version {artifact['version']} ({backend}, {os.path.basename(path)}) loaded successfully")
+        except Exception as e:
+            print(f"Error loading model version {artifact['version']}: {str(e)}")
+            self.model_type = None
+
+    def load_pytorch_checkpoint(self, pt_model_path):
+        """Load a PyTorch checkpoint and rebuild its network, returning (model, spec)"""
+        torch = import_torch()
+        import torch.nn as nn
+        from app.torch_models import build_model_from_checkpoint
+
+        checkpoint = torch.load(pt_model_path, map_location=torch.device('cpu'))
+
+        if isinstance(checkpoint, nn.Module):
+            # A full pickled module already carries its architecture
+            spec = {'architecture': type(checkpoint).__name__, 'input_size': None,
+                    'mean': None, 'std': None, 'num_classes': NUM_CLASSES}
+            return checkpoint.eval(), spec
+
+        model, spec = build_model_from_checkpoint(checkpoint)
+        if spec['num_classes'] != NUM_CLASSES:
+            raise ValueError(
+                f"{spec['architecture']} checkpoint predicts {spec['num_classes']} classes, "
+                f"but the app labels {NUM_CLASSES}"
+            )
+        return model, spec
+
+    def load_torchscript_model(self, pt_model_path, pt_model_url=None, pt_model_drive_id=None):
+        """Load the frozen TorchScript model, exporting it from the PyTorch checkpoint once if needed"""
+        ts_filename = os.getenv('TORCHSCRIPT_MODEL_FILENAME', 'plant_disease_model_1_latest.torchscript.pt')
+        ts_model_path = os.path.join(self.models_dir, ts_filename)
+
+        if not os.path.exists(ts_model_path):
+            if not os.path.exists(pt_model_path):
+                self.ensure_model_available(os.path.basename(pt_model_path), pt_model_url, pt_model_drive_id)
+            if not os.path.exists(pt_model_path):
+                print("Cannot create TorchScript model: PyTorch checkpoint not available")
+                return False
+            try:
+                print(f"Exporting {os.path.basename(pt_model_path)} to TorchScript (one-time)...")
+                from app.torch_models import export_torchscript
+                model, spec = self.load_pytorch_checkpoint(pt_model_path)
+                tmp_path = f"{ts_model_path}.{os.getpid()}.tmp"
+                export_torchscript(model, spec, tmp_path)
+                os.replace(tmp_path, ts_model_path)
+                del model
+            except Exception as e:
+                print(f"Error exporting PyTorch model to TorchScript: {str(e)}")
+                return False
+
+        try:
+            import_torch()
+            from app.torch_models import load_torchscript
+            self.pt_model, self.pt_spec = load_torchscript(ts_model_path)
+            if self.pt_spec.get('num_classes') != NUM_CLASSES:
+                print(f"TorchScript model predicts {self.pt_spec.get('num_classes')} classes, expected {NUM_CLASSES}")
+                self.pt_model = None
+                self.pt_spec = None
+                return False
+            self.model_type = 'torchscript'
+            print(f"TorchScript model ({ts_filename}, {self.pt_spec['architecture']}) loaded successfully")
+            return True
+        except Exception as e:
+            print(f"Error loading TorchScript model: {str(e)}")
+            self.pt_model = None
+            self.pt_spec = None
+            return False
+
+    def load_onnx_model(self, tf_model_path):
+        """Load the ONNX export of the Keras model, converting it once if it does not exist yet"""
+        onnx_filename = os.getenv('ONNX_MODEL_FILENAME', 'CropLeaf-C1.onnx')
+        onnx_model_path = os.path.join(self.models_dir, onnx_filename)
+
+        try:
+            import onnxruntime as ort
+        except ImportError:
+            print("onnxruntime is not installed")
+            return False
+
+        if not os.path.exists(onnx_model_path):
+            if not os.path.exists(tf_model_path):
+                print("Cannot create ONNX model: TensorFlow model file not available")
+                return False
+            try:
+                print(f"Converting {os.path.basename(tf_model_path)} to ONNX (one-time)...")
+                tf = import_tensorflow()
+                keras_model = tf.keras.models.load_model(tf_model_path, compile=False)
+                keras_to_onnx(keras_model, onnx_model_path)
+                del keras_model
+            except Exception as e:
+                print(f"Error converting TensorFlow model to ONNX: {str(e)}")
+                return False
+
+        try:
+            self.create_onnx_session(onnx_model_path)
+            self.model_type = 'onnx'
+            print(f"ONNX Runtime model ({onnx_filename}) loaded successfully")
+            return True
+        except Exception as e:
+            print(f"Error loading ONNX model: {str(e)}")
+            self.onnx_session = None
+            return False
+
+    def create_onnx_session(self, onnx_model_path):
+        """Open an ONNX Runtime CPU session sized by thread_settings()"""
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.intra_op_num_threads = thread_settings()['intra_op']
+        options.inter_op_num_threads = thread_settings()['inter_op']
+        self.onnx_session = ort.InferenceSession(
+            onnx_model_path, sess_options=options, providers=['CPUExecutionProvider']
+        )
+        self.onnx_input_name = self.onnx_session.get_inputs()[0].name
+
+    def create_tflite_interpreter(self, tflite_model_path):
+        tf = import_tensorflow()
+        self.tflite_interpreter = tf.lite.Interpreter(
+            model_path=tflite_model_path, num_threads=thread_settings()['intra_op']
+        )
+        self.tflite_interpreter.allocate_tensors()
+
+    def load_tflite_model(self):
+        """Load the full-integer quantized TFLite model"""
+        tflite_filename = os.getenv('TFLITE_MODEL_FILENAME', 'CropLeaf-C1-int8.tflite')
+        tflite_model_path = os.path.join(self.models_dir, tflite_filename)
+
+        if not os.path.exists(tflite_model_path):
+            print(f"TFLite model not found: {tflite_model_path}")
+            print("Create it with: python manage.py quantize_tflite --calibration-dir <leaf images>")
+            return False
+
+        try:
+            self.create_tflite_interpreter(tflite_model_path)
+            self.model_type = 'tflite'
+            print(f"TFLite INT8 model ({tflite_filename}) loaded successfully")
+            return True
+        except Exception as e:
+            print(f"Error loading TFLite model: {str(e)}")
+            self.tflite_interpreter = None
+            return False
+
     def predict(self, image_array):
-        if self.model_type == 'tensorflow' and self.tf_model is not None:
-            return self.tf_model.predict(image_array)
-        elif self.model_type == 'pytorch' and self.pt_model is not None:
+        # Once retired, calls that still reach this wrapper are served by its successor
+        with self._in_flight_lock:
+            successor = self.successor
+            if successor is None:
+                self.in_flight += 1
+        if successor is not None:
+            return successor.predict(image_array)
+        try:
+            return self._predict(image_array)
+        finally:
+            with self._in_flight_lock:
+                self.in_flight -= 1
+
+    def _predict(self, image_array):
+        if self.pool is not None:
+            return self.pool.predict(image_array)
+        elif self.model_type == 'grpc' and self.grpc_client is not None:
+            return self.grpc_client.predict(image_array)
+        elif self.model_type == 'tensorflow' and self.tf_model is not None:
+            return self.predict_tensorflow(image_array)
+        elif self.model_type == 'onnx' and self.onnx_session is not None:
+            return self.predict_onnx(image_array)
+        elif self.model_type == 'tflite' and self.tflite_interpreter is not None:
+            return self.predict_tflite(image_array)
+        elif self.model_type in ('pytorch', 'torchscript') and self.pt_model is not None:
             return self.predict_pytorch(image_array)
         else:
             # Fallback: return mock predictions for demonstration
             print("Using fallback prediction (models not available)")
             return self.fallback_predict(image_array)
 
+    def predict_batched(self, image_array):
+        """Predict through the micro-batching scheduler so concurrent callers share one model call"""
+        if self.successor is not None:
+            return self.successor.predict_batched(image_array)
+        if not self.batching_enabled:
+            return self.predict(image_array)
+        return self.batcher.predict(image_array)
+
+    def predict_tensorflow(self, image_array):
+        """
+        Run the Keras model on a uint8 (batch, height, width, channels) array.
+
+        Goes through the tf.function from build_serving_function when there is
+        one. Batches are zero-padded up to the next TF_SERVING_BATCH_SIZES
+        bucket, and split at the largest bucket, so the function only ever
+        sees the shapes warmup() has already traced.
+        """
+        if self.tf_serve is None:
+            return self.tf_model.predict(image_array, verbose=0)
+
+        image_array = np.asarray(image_array, dtype=np.uint8)
+        buckets = serving_batch_sizes()
+        try:
+            outputs = []
+            for start in range(0, len(image_array), buckets[-1]):
+                chunk = image_array[start:start + buckets[-1]]
+                rows = len(chunk)
+                bucket = bucket_for(rows, buckets)
+                if bucket > rows:
+                    padding = np.zeros((bucket - rows,) + chunk.shape[1:], dtype=np.uint8)
+                    chunk = np.concatenate([chunk, padding], axis=0)
+                outputs.append(np.asarray(self.tf_serve(chunk))[:rows])
+            return np.concatenate(outputs, axis=0) if len(outputs) > 1 else outputs[0]
+        except Exception as e:
+            # e.g. an op XLA cannot compile; Keras predict() still works
+            print(f"tf.function serving failed, falling back to Keras predict: {str(e)}")
+            self.tf_serve = None
+            return self.tf_model.predict(image_array, verbose=0)
+
+    def predict_onnx(self, image_array):
+        """Run the ONNX Runtime session on a (batch, height, width, channels) array"""
+        inputs = {self.onnx_input_name: np.asarray(image_array, dtype=np.float32)}
+        return self.onnx_session.run(None, inputs)[0]
+
+    def predict_tflite(self, image_array):
+        """Run the quantized TFLite interpreter on a (batch, height, width, channels) array"""
+        # The interpreter keeps per-invocation state, so calls must not overlap
+        with self.tflite_lock:
+            return run_tflite_interpreter(self.tflite_interpreter, image_array)
+
     def predict_pytorch(self, image_array):
+        """Run the PyTorch or TorchScript model on a uint8 (batch, height, width, channels) array"""
         try:
-            # Convert numpy array to torch tensor
-            if isinstance(image_array, np.ndarray):
-                # Assuming image_array is in format (batch, height, width, channels)
-                # Convert to (batch, channels, height, width) for PyTorch
-                image_array = np.transpose(image_array, (0, 3, 1, 2))
-                image_tensor = torch.from_numpy(image_array).float()
-
-            # Normalize to [0,1] range
-            image_tensor = image_tensor / 255.0
-
-            # Check if pt_model is a complete model or just a checkpoint
-            if hasattr(self.pt_model, 'forward'):
-                # It's a complete model
-                with torch.no_grad():
-                    outputs = self.pt_model(image_tensor)
-                    probabilities = torch.nn.functional.softmax(outputs, dim=1)
-                    return probabilities.numpy()
-            else:
-                # It's a checkpoint/state_dict - we can't use it directly for prediction
-                # Return a fallback response
-                print("PyTorch model is a checkpoint and needs proper model architecture to be loaded")
-                # Return dummy predictions that will be ignored since TF model takes precedence
-                return np.array([[0.0] * 17])  # 17 classes
+            import torch
+            from app.torch_models import prepare_input
+
+            image_tensor = prepare_input(np.ascontiguousarray(image_array), self.pt_spec)
+
+            with torch.inference_mode():
+                outputs = self.pt_model(image_tensor)
+                probabilities = torch.nn.functional.softmax(outputs, dim=1)
+            return probabilities.numpy()
 
         except Exception as e:
             print(f"PyTorch prediction error: {str(e)}")
-            # Return dummy predictions
-            return np.array([[0.0] * 17])
+            raise
 
     def fallback_predict(self, image_array):
         """Fallback prediction method when models are not available"""
@@ -249,10 +626,390 @@ class ModelWrapper:
         """Check if models are properly loaded"""
         tf_loaded = self.tf_model is not None
         pt_loaded = self.pt_model is not None
-        return tf_loaded or pt_loaded
+        onnx_loaded = self.onnx_session is not None
+        tflite_loaded = self.tflite_interpreter is not None
+        pool_loaded = self.pool is not None and self.pool.model_type is not None
+        grpc_loaded = self.grpc_client is not None
+        return tf_loaded or pt_loaded or onnx_loaded or tflite_loaded or pool_loaded or grpc_loaded
+
+    def retire(self, successor, timeout=30.0):
+        """
+        Hand traffic over to successor and free this model once it is drained.
+
+        Predictions that arrive from now on (from requests that fetched this
+        wrapper before the swap) are forwarded to successor. The models are
+        released once the predictions already running have finished; if that
+        takes longer than timeout seconds they are left to the garbage
+        collector instead. Returns whether the wrapper drained in time.
+        """
+        with self._in_flight_lock:
+            self.successor = successor
+        # The scheduler thread must not keep this wrapper alive
+        self.batcher.predict_fn = successor.predict
+        self.batcher.close()
+
+        deadline = time.monotonic() + timeout
+        while self.in_flight and time.monotonic() < deadline:
+            time.sleep(0.05)
+        if self.in_flight:
+            return False
 
+        self.tf_model = self.tf_serve = None
+        self.pt_model = self.onnx_session = self.tflite_interpreter = None
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
+        return True
+
+    def version(self):
+        """Identifier of the model being served (registry version, MODEL_VERSION, or the backend and artifact filename)"""
+        if self.artifact is not None:
+            return self.artifact['version']
+        if os.getenv('MODEL_VERSION'):
+            return os.getenv('MODEL_VERSION')
+
+        filenames = {
+            'tensorflow': os.getenv('TF_MODEL_FILENAME', 'CropLeaf-C1.h5'),
+            'pytorch': os.getenv('PT_MODEL_FILENAME', 'plant_disease_model_1_latest.pt'),
+            'onnx': os.getenv('ONNX_MODEL_FILENAME', 'CropLeaf-C1.onnx'),
+            'tflite': os.getenv('TFLITE_MODEL_FILENAME', 'CropLeaf-C1-int8.tflite'),
+            'torchscript': os.getenv('TORCHSCRIPT_MODEL_FILENAME', 'plant_disease_model_1_latest.torchscript.pt'),
+        }
+        if self.model_type == 'grpc':
+            return f"grpc:{','.join(self.grpc_client.addresses)}"
+        if self.model_type not in filenames:
+            return None
+        return f"{self.model_type}:{filenames[self.model_type]}"
+
+    def warmup(self, batch_size=None):
+        """
+        Run inference on blank batches so the first real request does not pay one-time setup costs.
+
+        Without batch_size, TensorFlow is warmed up at every serving bucket so
+        each one is traced (and XLA-compiled) before traffic arrives; other
+        backends get a single-image batch.
+        """
+        if self.model_type is None:
+            return False
+
+        if batch_size is not None:
+            sizes = [batch_size]
+        elif self.model_type == 'tensorflow' and self.tf_serve is not None:
+            sizes = serving_batch_sizes()
+        else:
+            sizes = [1]
+
+        for size in sizes:
+            start = time.perf_counter()
+            self.predict(np.zeros((size, 256, 256, 3), dtype=np.uint8))
+            print(f"Warmup inference at batch size {size}: {(time.perf_counter() - start) * 1000.0:.0f} ms")
+        self.warmed_up = True
+        return True
+
+
+class ModelRegistry:
+    """
+    Process-wide owner of the loaded models.
+
+    Views reach a model only through get(), which loads the requested backend
+    on first use. Each backend is loaded at most once per process, however many
+    threads ask for it at the same time. status() reports load progress without
+    ever loading anything, so health probes stay cheap.
+
+    When the versioned model registry (app.model_versions) has an active
+    version, the default backend serves that version instead of the
+    MODEL_BACKEND files. get() checks the manifest every
+    MODEL_REGISTRY_POLL_SECONDS; when another version has been activated, it
+    is loaded and warmed up on a background thread while the current one
+    keeps serving, swapped in atomically, and the old one is drained (see
+    ModelWrapper.retire). With an inference pool the version is loaded in the
+    pool's processes. A grpc default backend is left alone: the inference
+    servers follow the manifest themselves.
+    """
+
+    def __init__(self):
+        from app.model_versions import ModelManifest
+
+        self._wrappers = {}
+        self._status = {}
+        self._loaders = {}
+        self._lock = threading.Lock()
+        self._loader_lock = threading.Lock()
+
+        self.manifest = ModelManifest()
+        self.poll_seconds = float(os.getenv('MODEL_REGISTRY_POLL_SECONDS', '15'))
+        self.drain_seconds = float(os.getenv('MODEL_DRAIN_SECONDS', '30'))
+        self._serving_backend = None
+        self._manifest_mtime = None
+        self._manifest_checked = 0.0
+        self._swapper = None
+        self._versions = {'loading': None, 'draining': None, 'last_error': None, 'swapped_at': None}
+
+        # A load running in a background thread does not survive a fork, and its
+        # lock could be left held in the child; start the child from a clean slate
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._after_fork)
+
+    def default_backend(self):
+        return self._serving_backend or os.getenv('MODEL_BACKEND', 'auto').lower()
+
+    def serve_locally(self, backend=None):
+        """
+        Make this process run the model itself, as an inference server does.
+
+        backend (default MODEL_BACKEND, with grpc meaning auto) becomes the
+        default backend, so it serves and follows the registry's active
+        version. Returns the backend.
+        """
+        backend = (backend or os.getenv('MODEL_BACKEND', 'auto')).lower()
+        if backend == 'grpc':
+            # The process runs the model itself; pointing it at inference servers would loop
+            backend = 'auto'
+        self._serving_backend = backend
+        return backend
+
+    def get(self, backend=None):
+        """Return the ModelWrapper for backend (default MODEL_BACKEND), loading it on first use"""
+        backend = (backend or self.default_backend()).lower()
+        wrapper = self._wrappers.get(backend)
+        if wrapper is not None:
+            if backend == self.default_backend():
+                self._poll_manifest(wrapper)
+            return wrapper
+
+        with self._lock:
+            wrapper = self._wrappers.get(backend)
+            if wrapper is None:
+                self._set_status(backend, 'loading')
+                started = time.monotonic()
+                wrapper = self._build_wrapper(backend)
+                self._wrappers[backend] = wrapper
+                self._set_status(
+                    backend, 'ready' if wrapper.model_type is not None else 'failed',
+                    load_seconds=round(time.monotonic() - started, 2),
+                )
+        return wrapper
+
+    def _build_wrapper(self, backend):
+        # The default backend serves the registry's active version when there is one,
+        # unless the model runs on inference servers
+        if backend == self.default_backend() and backend != 'grpc' and self.manifest.exists():
+            mtime = self.manifest.mtime()
+            self._manifest_checked = time.monotonic()
+            try:
+                entry = self.manifest.active_entry(verify=True)
+                if entry is None:
+                    self._manifest_mtime = mtime
+                else:
+                    wrapper = ModelWrapper(artifact=entry)
+                    if wrapper.model_type is not None:
+                        self._manifest_mtime = mtime
+                        return wrapper
+                    self._versions['last_error'] = f"model version {entry['version']} could not be loaded"
+            except Exception as e:
+                print(f"Model registry unusable ({str(e)}), loading MODEL_BACKEND files instead")
+                self._versions['last_error'] = str(e)
+        return ModelWrapper(backend=backend)
+
+    def _poll_manifest(self, wrapper):
+        """
+        Start switching to the registry's active version if the manifest changed since it was last served.
+
+        _manifest_mtime only moves forward once the active version is being
+        served, so a swap that failed is tried again on the next poll. The
+        active version is compared with the registry version wrapper serves,
+        if any, never with its other identifiers.
+        """
+        if wrapper.grpc_client is not None:
+            return
+        now = time.monotonic()
+        if now - self._manifest_checked < self.poll_seconds:
+            return
+        self._manifest_checked = now
+
+        mtime = self.manifest.mtime()
+        if mtime is None or mtime == self._manifest_mtime:
+            return
+        # A running swap re-reads the manifest when it finishes
+        if self._swapper is not None and self._swapper.is_alive():
+            return
+        try:
+            active = self.manifest.active_version()
+        except (OSError, ValueError) as e:
+            print(f"Could not read the model registry manifest: {str(e)}")
+            return
+        serving = wrapper.artifact['version'] if wrapper.artifact is not None else None
+        if not active or active == serving:
+            self._manifest_mtime = mtime
+            return
+        self.swap_in_background(active)
+
+    def swap_in_background(self, version):
+        """Load, warm up and switch to a registry version on a daemon thread; returns the thread"""
+        with self._loader_lock:
+            if self._swapper is not None and self._swapper.is_alive():
+                return self._swapper
+            self._swapper = threading.Thread(
+                target=self._swap_until_current, args=(version,), name=f'model-swap-{version}', daemon=True
+            )
+            self._swapper.start()
+            return self._swapper
+
+    def _swap_until_current(self, version):
+        """Switch to version, then to whatever was activated while that swap ran"""
+        while version:
+            mtime = self.manifest.mtime()
+            if not self.swap_to(version):
+                return
+            self._manifest_mtime = mtime
+            try:
+                active = self.manifest.active_version()
+            except (OSError, ValueError) as e:
+                print(f"Could not read the model registry manifest: {str(e)}")
+                return
+            version = active if active and active != version else None
+
+    def swap_to(self, version, warmup=True):
+        """
+        Switch the default backend to a registry version without interrupting requests.
+
+        The new version is loaded and warmed up while the current one keeps
+        serving, then replaces it in one assignment, and the old wrapper is
+        drained and freed. A version that fails to load or verify is not
+        switched to; the current one keeps serving. Returns whether it switched.
+        """
+        backend = self.default_backend()
+        if backend == 'grpc':
+            print(f"Not switching to model version {version}: MODEL_BACKEND=grpc, "
+                  f"the inference servers switch to it themselves")
+            return False
+        current = self._wrappers.get(backend)
+        self._versions['loading'] = version
+        started = time.monotonic()
+        try:
+            from app.model_versions import check_compatible
+
+            entry = self.manifest.entry(version, verify=True)
+            check_compatible(entry)
+            wrapper = ModelWrapper(artifact=entry)
+            if wrapper.model_type is None:
+                raise RuntimeError(f"model version {version} could not be loaded")
+            if warmup:
+                wrapper.warmup()
+        except Exception as e:
+            print(f"Not switching to model version {version}: {str(e)}; "
+                  f"still serving {current.version() if current else 'nothing'}")
+            self._versions.update(loading=None, last_error=str(e))
+            return False
 
-# Create global model instance
-model_wrapper = ModelWrapper()
-model = model_wrapper  # For backward compatibility
+        with self._lock:
+            previous = self._wrappers.get(backend)
+            self._wrappers[backend] = wrapper
+            self._set_status(backend, 'ready', load_seconds=round(time.monotonic() - started, 2))
+        self._versions.update(loading=None, last_error=None, swapped_at=time.time())
+        print(f"Switched to model version {version} after {time.monotonic() - started:.1f}s of loading and warmup")
+
+        if previous is not None and previous is not wrapper:
+            self._versions['draining'] = previous.version()
+            drained = previous.retire(wrapper, timeout=self.drain_seconds)
+            print(f"Model {previous.version()} {'drained and released' if drained else 'still busy after the drain timeout'}")
+            self._versions['draining'] = None
+        return True
+
+    def is_loaded(self, backend=None):
+        """Whether backend has been loaded in this process, without loading it"""
+        return (backend or self.default_backend()).lower() in self._wrappers
+
+    def prewarm(self, backend=None, warmup=True):
+        """Load backend now and optionally run a warmup inference"""
+        backend = (backend or self.default_backend()).lower()
+        wrapper = self.get(backend)
+        if warmup and wrapper.model_type is not None and not wrapper.warmed_up:
+            self._set_status(backend, 'warming')
+            try:
+                wrapper.warmup()
+                self._set_status(backend, 'ready')
+            except Exception as e:
+                print(f"Model warmup failed: {str(e)}")
+                self._set_status(backend, 'ready', warmup_error=str(e))
+        return wrapper
+
+    def load_in_background(self, backend=None, warmup=True):
+        """Start loading (and warming) backend in a daemon thread and return immediately"""
+        backend = (backend or self.default_backend()).lower()
+        with self._loader_lock:
+            loader = self._loaders.get(backend)
+            if loader is not None and loader.is_alive():
+                return loader
+            if backend in self._wrappers and (self._wrappers[backend].warmed_up or not warmup):
+                return None
+
+            if backend not in self._wrappers:
+                self._set_status(backend, 'loading')
+            loader = threading.Thread(
+                target=self.prewarm, args=(backend, warmup), name=f'model-loader-{backend}', daemon=True
+            )
+            self._loaders[backend] = loader
+            loader.start()
+            return loader
+
+    def status(self, backend=None):
+        """Load state of backend: not_loaded, loading, warming, ready or failed"""
+        backend = (backend or self.default_backend()).lower()
+        status = dict(self._status.get(backend) or {'state': 'not_loaded'})
+        status['backend'] = backend
+
+        wrapper = self._wrappers.get(backend)
+        if wrapper is not None:
+            status['model_type'] = wrapper.model_type
+            status['model_version'] = wrapper.version()
+            status['warmed_up'] = wrapper.warmed_up
+            if wrapper.grpc_client is not None:
+                status['inference_servers'] = wrapper.grpc_client.health()
+        if backend == self.default_backend() and self.manifest.exists():
+            status['registry'] = dict(self._versions)
+        return status
+
+    def _set_status(self, backend, state, **extra):
+        status = dict(self._status.get(backend) or {})
+        status.update(extra)
+        status['state'] = state
+        status['updated_at'] = time.time()
+        self._status[backend] = status
+
+    def _after_fork(self):
+        self._lock = threading.Lock()
+        self._loader_lock = threading.Lock()
+        self._loaders = {}
+        self._swapper = None
+        self._versions['loading'] = None
+        for backend, status in list(self._status.items()):
+            if status['state'] in ('loading', 'warming'):
+                self._set_status(backend, 'ready' if backend in self._wrappers else 'not_loaded')
+
+
+model_registry = ModelRegistry()
+
+
+def local_model_files_present(backend=None):
+    """Whether the artifact for backend is already on disk, i.e. loading it needs no download"""
+    backend = (backend or model_registry.default_backend()).lower()
+    models_dir = os.path.join(os.path.dirname(__file__), "ml_models")
+    tf_file = os.path.join(models_dir, os.getenv('TF_MODEL_FILENAME', 'CropLeaf-C1.h5'))
+    pt_file = os.path.join(models_dir, os.getenv('PT_MODEL_FILENAME', 'plant_disease_model_1_latest.pt'))
+    candidates = {
+        'pytorch': [pt_file],
+        'torchscript': [os.path.join(models_dir, os.getenv('TORCHSCRIPT_MODEL_FILENAME', 'plant_disease_model_1_latest.torchscript.pt')), pt_file],
+        'onnx': [os.path.join(models_dir, os.getenv('ONNX_MODEL_FILENAME', 'CropLeaf-C1.onnx')), tf_file],
+        'tflite': [os.path.join(models_dir, os.getenv('TFLITE_MODEL_FILENAME', 'CropLeaf-C1-int8.tflite'))],
+    }
+    return any(os.path.exists(path) for path in candidates.get(backend, [tf_file, pt_file]))
+
+
+def __getattr__(name):
+    # model_wrapper/model used to be globals built at import time; keep them
+    # importable for older callers but resolve them through the lazy registry
+    if name in ('model_wrapper', 'model'):
+        return model_registry.get()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
@@ -0,0 +1,271 @@
+import os
+import glob
+import time
+import multiprocessing
+
+import numpy as np
+from PIL import Image
+
+
+SAMPLE_IMAGE_PATTERNS = ('*.jpg', '*.jpeg', '*.png', '*.webp')
+
+
+def keras_to_onnx(keras_model, onnx_path, opset=13):
+    """Convert a loaded Keras model to ONNX and write it atomically to onnx_path"""
+    import tensorflow as tf
+    try:
+        import tf2onnx
+    except ImportError:
+        raise RuntimeError(
+            "tf2onnx is required to convert the Keras model to ONNX. "
+            "Install it with: pip install tf2onnx --no-deps"
+        )
+
+    # Keep the batch dimension dynamic so the micro-batcher can send any batch size
+    input_shape = [None] + list(keras_model.inputs[0].shape[1:])
+    input_signature = (tf.TensorSpec(input_shape, tf.float32, name='input'),)
+
+    @tf.function(input_signature=input_signature)
+    def serving_fn(x):
+        return keras_model(x, training=False)
+
+    # Write next to the target and rename so concurrent workers never see a partial file
+    tmp_path = f"{onnx_path}.{os.getpid()}.tmp"
+    tf2onnx.convert.from_function(serving_fn, input_signature=input_signature, opset=opset, output_path=tmp_path)
+    os.replace(tmp_path, onnx_path)
+    return onnx_path
+
+
+def keras_to_tflite_int8(keras_model, calibration_paths, tflite_path, num_calibration=200):
+    """
+    Convert a loaded Keras model to a full-integer quantized TFLite model.
+
+    Weights and activations are quantized to int8 using calibration_paths as the
+    representative dataset. Input and output tensors are uint8, so the raw
+    0-255 pixel arrays from process_image can be fed without rescaling.
+    """
+    import tensorflow as tf
+
+    # A dynamic batch dimension, as for ONNX: with a static batch of 1 the converter folds
+    # Flatten/Reshape shapes to [1, N] and batches of any other size break
+    input_shape = [None] + list(keras_model.inputs[0].shape[1:])
+    input_size = (int(input_shape[2]), int(input_shape[1]))
+
+    @tf.function(input_signature=(tf.TensorSpec(input_shape, tf.float32, name='input'),))
+    def serving_fn(x):
+        return keras_model(x, training=False)
+
+    def representative_dataset():
+        for path in calibration_paths[:num_calibration]:
+            image = Image.open(path).convert("RGB").resize(input_size, Image.LANCZOS)
+            yield [np.expand_dims(np.array(image, dtype=np.float32), axis=0)]
+
+    converter = tf.lite.TFLiteConverter.from_concrete_functions([serving_fn.get_concrete_function()], keras_model)
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    converter.representative_dataset = representative_dataset
+    converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+    converter.inference_input_type = tf.uint8
+    converter.inference_output_type = tf.uint8
+
+    tflite_model = converter.convert()
+
+    tmp_path = f"{tflite_path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(tflite_model)
+    os.replace(tmp_path, tflite_path)
+    return tflite_path
+
+
+def run_tflite_interpreter(interpreter, image_array):
+    """
+    Run a TFLite interpreter on a (batch, height, width, channels) array.
+
+    Float pixels are quantized into integer input tensors and integer outputs
+    are dequantized back to probabilities. Callers must serialise access to
+    the interpreter.
+
+    Models converted with a static batch size (older INT8 files) cannot be
+    resized to another batch safely, so they are run one batch of their own
+    size at a time.
+    """
+    image_array = np.asarray(image_array)
+    input_details = interpreter.get_input_details()[0]
+
+    signature = input_details.get('shape_signature')
+    static_batch = int(signature[0]) if signature is not None and len(signature) and signature[0] > 0 else None
+    if static_batch is not None and len(image_array) != static_batch:
+        if len(image_array) % static_batch:
+            raise ValueError(f"TFLite model has a static batch of {static_batch}; "
+                             f"cannot run a batch of {len(image_array)}")
+        return np.concatenate([
+            run_tflite_interpreter(interpreter, image_array[start:start + static_batch])
+            for start in range(0, len(image_array), static_batch)
+        ], axis=0)
+
+    if tuple(input_details['shape']) != image_array.shape:
+        interpreter.resize_tensor_input(input_details['index'], list(image_array.shape))
+        interpreter.allocate_tensors()
+        input_details = interpreter.get_input_details()[0]
+    output_details = interpreter.get_output_details()[0]
+
+    scale, zero_point = input_details['quantization']
+    if np.issubdtype(input_details['dtype'], np.integer) and scale:
+        info = np.iinfo(input_details['dtype'])
+        quantized = np.round(image_array.astype(np.float32) / scale + zero_point)
+        input_tensor = np.clip(quantized, info.min, info.max).astype(input_details['dtype'])
+    else:
+        input_tensor = image_array.astype(input_details['dtype'])
+
+    interpreter.set_tensor(input_details['index'], input_tensor)
+    interpreter.invoke()
+    output = interpreter.get_tensor(output_details['index'])
+
+    scale, zero_point = output_details['quantization']
+    if np.issubdtype(output.dtype, np.integer) and scale:
+        return (output.astype(np.float32) - zero_point) * scale
+    return output
+
+
+def find_sample_images(images_dir, recursive=False):
+    """List the sample images in images_dir that can be decoded"""
+    paths = []
+    for pattern in SAMPLE_IMAGE_PATTERNS:
+        if recursive:
+            paths.extend(glob.glob(os.path.join(images_dir, '**', pattern), recursive=True))
+        else:
+            paths.extend(glob.glob(os.path.join(images_dir, pattern)))
+
+    readable = []
+    for path in sorted(paths):
+        try:
+            with Image.open(path) as image:
+                image.verify()
+            readable.append(path)
+        except Exception:
+            print(f"Skipping unreadable sample image: {path}")
+    return readable
+
+
+def load_sample_batch(image_paths, size=(256, 256)):
+    """Decode and resize sample images into one uint8 batch"""
+    arrays = [np.array(Image.open(path).convert("RGB").resize(size, Image.LANCZOS)) for path in image_paths]
+    return np.stack(arrays, axis=0)
+
+
+def check_top1_parity(reference_predict, candidate_predict, image_paths, size=(256, 256)):
+    """
+    Compare the top-1 class of two backends on the given images.
+
+    Returns a report with the number of matching images, the largest absolute
+    probability difference and the images whose top-1 class disagrees. The
+    candidate is also run one image at a time: batch_max_abs_diff and
+    batch_mismatches show whether batching changes its output, as it does for
+    a model whose batch dimension was frozen during conversion.
+    """
+    if not image_paths:
+        return {'total': 0, 'matches': 0, 'max_abs_diff': 0.0, 'mismatches': [],
+                'batch_max_abs_diff': 0.0, 'batch_mismatches': []}
+
+    batch = load_sample_batch(image_paths, size)
+    reference = np.asarray(reference_predict(batch))
+    candidate = np.asarray(candidate_predict(batch))
+    single = np.concatenate([np.asarray(candidate_predict(batch[i:i + 1])) for i in range(len(batch))], axis=0)
+
+    reference_top1 = np.argmax(reference, axis=1)
+    candidate_top1 = np.argmax(candidate, axis=1)
+
+    mismatches = [
+        {
+            'image': os.path.basename(path),
+            'reference_class': int(reference_top1[i]),
+            'candidate_class': int(candidate_top1[i]),
+        }
+        for i, path in enumerate(image_paths)
+        if reference_top1[i] != candidate_top1[i]
+    ]
+
+    single_top1 = np.argmax(single, axis=1)
+    batch_mismatches = [
+        os.path.basename(path) for i, path in enumerate(image_paths) if candidate_top1[i] != single_top1[i]
+    ]
+
+    return {
+        'total': len(image_paths),
+        'matches': len(image_paths) - len(mismatches),
+        'max_abs_diff': float(np.max(np.abs(reference - candidate))),
+        'mismatches': mismatches,
+        'batch_max_abs_diff': float(np.max(np.abs(candidate - single))),
+        'batch_mismatches': batch_mismatches,
+    }
+
+
+def find_labelled_images(images_dir, class_names):
+    """
+    Collect (path, class_index) pairs from an images_dir laid out as one
+    sub-folder per class. Sub-folders may be named after the class or its index.
+    """
+    lookup = {name.lower(): index for index, name in enumerate(class_names)}
+    labelled = []
+    for entry in sorted(os.listdir(images_dir)):
+        folder = os.path.join(images_dir, entry)
+        if not os.path.isdir(folder):
+            continue
+        if entry.isdigit() and int(entry) < len(class_names):
+            class_index = int(entry)
+        elif entry.lower() in lookup:
+            class_index = lookup[entry.lower()]
+        else:
+            print(f"Skipping folder that does not match a class: {entry}")
+            continue
+        labelled.extend((path, class_index) for path in find_sample_images(folder))
+    return labelled
+
+
+def measure_latency(predict_fn, batch, runs=20, warmup=3):
+    """Time predict_fn on batch and return mean/p50/p95 latency in milliseconds"""
+    for _ in range(warmup):
+        predict_fn(batch)
+
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        predict_fn(batch)
+        timings.append((time.perf_counter() - start) * 1000.0)
+
+    return {
+        'mean_ms': float(np.mean(timings)),
+        'p50_ms': float(np.percentile(timings, 50)),
+        'p95_ms': float(np.percentile(timings, 95)),
+    }
+
+
+def _rss_probe(backend, model_path, results):
+    from app.memory import rss_mb
+
+    # Import the framework first so the measurement covers the model alone
+    import tensorflow as tf
+    baseline = rss_mb()
+
+    if backend == 'tflite':
+        interpreter = tf.lite.Interpreter(model_path=model_path)
+        interpreter.allocate_tensors()
+        input_details = interpreter.get_input_details()[0]
+        interpreter.set_tensor(input_details['index'], np.zeros(input_details['shape'], dtype=input_details['dtype']))
+        interpreter.invoke()
+    else:
+        model = tf.keras.models.load_model(model_path, compile=False)
+        model.predict(np.zeros([1] + list(model.inputs[0].shape[1:]), dtype=np.float32), verbose=0)
+
+    results.put(rss_mb() - baseline)
+
+
+def measure_model_rss(backend, model_path):
+    """Resident memory in MB added by loading and running a model, measured in a fresh process"""
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+    process = context.Process(target=_rss_probe, args=(backend, model_path, results))
+    process.start()
+    try:
+        return results.get(timeout=600)
+    finally:
+        process.join()
@@ -0,0 +1,308 @@
+import os
+import time
+import queue
+import random
+import hashlib
+import threading
+from collections import Counter, deque
+
+import numpy as np
+
+
+def canary_bucket(user_key):
+    """Stable position of a user in [0, 100), from a hash of their id"""
+    digest = hashlib.sha256(str(user_key).encode('utf-8')).hexdigest()
+    return int(digest[:8], 16) % 10000 / 100.0
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return round(ordered[min(len(ordered) - 1, int(fraction * len(ordered)))], 1)
+
+
+class CandidateEvaluator:
+    """
+    Trial a model registry version (app.model_versions) on live traffic before activating it.
+
+    MODEL_CANDIDATE_VERSION names the candidate. It is loaded the way the
+    primary model is (prewarm before the gunicorn fork, load_in_background
+    in each worker), or on a background thread the first time it is needed,
+    and nothing changes for users until it is ready.
+
+    Shadow mode (SHADOW_SAMPLE_RATE): a sampled fraction of /api/predict/
+    uploads is also classified by the candidate, after the response has been
+    built. Samples go through a queue of SHADOW_QUEUE_SIZE and a single
+    thread, so the candidate never runs more than one batch at a time and a
+    full queue drops samples instead of delaying requests. Every comparison
+    records whether the top classes agree, the confidence delta and both
+    latencies, in stats() and as ShadowComparison rows (SHADOW_RECORD).
+    The primary latency is what the request spent, so it includes prediction
+    cache hits and micro-batching waits; the candidate's is its bare model call.
+
+    Canary mode (CANARY_PERCENT): signed-in users whose canary_bucket falls
+    below the percentage are served by the candidate itself. The bucket is a
+    hash of the user id, so a user stays on the same side across requests and
+    workers, and raising the percentage only adds users.
+
+    Neither mode applies with crop routing (CROP_ROUTING_ENABLED): routed
+    uploads are served by app.crop_routing and only counted as bypassed.
+    """
+
+    def __init__(self, candidate_version=None, shadow_rate=0.0, canary_percent=0.0, queue_size=32,
+                 record=True, window=1000):
+        self.candidate_version = candidate_version or None
+        self.shadow_rate = max(0.0, min(1.0, shadow_rate))
+        self.canary_percent = max(0.0, min(100.0, canary_percent))
+        self.queue_size = queue_size
+        self.record = record
+
+        self._candidate = None
+        self._state = 'idle'
+        self._last_error = None
+        self._loader = None
+        self._worker = None
+        self._lock = threading.Lock()
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._counts = Counter()
+        self._recent = deque(maxlen=window)
+
+        # Neither the loader nor the shadow thread survives a fork
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._after_fork)
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            candidate_version=os.getenv('MODEL_CANDIDATE_VERSION', ''),
+            shadow_rate=float(os.getenv('SHADOW_SAMPLE_RATE', '0')),
+            canary_percent=float(os.getenv('CANARY_PERCENT', '0')),
+            queue_size=int(os.getenv('SHADOW_QUEUE_SIZE', '32')),
+            record=os.getenv('SHADOW_RECORD', 'true').lower() == 'true',
+            window=int(os.getenv('SHADOW_STATS_WINDOW', '1000')),
+        )
+
+    @property
+    def enabled(self):
+        return self.candidate_version is not None and (self.shadow_rate > 0 or self.canary_percent > 0)
+
+    def candidate(self):
+        """The loaded candidate ModelWrapper, or None while it loads (starting the load) or after it failed"""
+        if not self.enabled:
+            return None
+        if self._candidate is None:
+            self.load_in_background()
+        return self._candidate
+
+    def prewarm(self, warmup=True):
+        """Load the candidate now and optionally run a warmup inference; returns it, or None"""
+        loader = self.load_in_background(warmup)
+        if loader is not None:
+            loader.join()
+        return self._candidate
+
+    def load_in_background(self, warmup=True):
+        """Start loading (and warming) the candidate in a daemon thread and return immediately"""
+        if not self.enabled:
+            return None
+        with self._lock:
+            if self._loader is not None and self._loader.is_alive():
+                return self._loader
+            if self._state == 'failed':
+                return None
+            if self._candidate is not None and (self._candidate.warmed_up or not warmup):
+                return None
+
+            if self._candidate is None:
+                self._state = 'loading'
+            self._loader = threading.Thread(target=self._load, args=(warmup,), name='candidate-loader', daemon=True)
+            self._loader.start()
+            return self._loader
+
+    def _load(self, warmup=True):
+        from app.model import ModelWrapper, model_registry
+        from app.model_versions import check_compatible
+
+        started = time.monotonic()
+        wrapper = self._candidate
+        try:
+            if wrapper is None:
+                entry = model_registry.manifest.entry(self.candidate_version, verify=True)
+                check_compatible(entry)
+                wrapper = ModelWrapper(artifact=entry)
+                if wrapper.model_type is None:
+                    raise RuntimeError(f"model version {self.candidate_version} could not be loaded")
+        except Exception as e:
+            print(f"Candidate model {self.candidate_version} unavailable: {str(e)}")
+            self._state, self._last_error = 'failed', str(e)
+            return
+        if warmup and not wrapper.warmed_up:
+            try:
+                wrapper.warmup()
+            except Exception as e:
+                print(f"Candidate model warmup failed: {str(e)}")
+        self._candidate, self._state = wrapper, 'ready'
+        print(f"Candidate model {self.candidate_version} ready after {time.monotonic() - started:.1f}s")
+
+    def bypassed(self):
+        """Count an upload served by crop routing, which neither canary nor shadow mode sees"""
+        if self.enabled:
+            self._counts['bypassed'] += 1
+
+    def in_canary(self, user_key):
+        return user_key is not None and self.canary_percent > 0 and canary_bucket(user_key) < self.canary_percent
+
+    def canary_wrapper(self, user_key, count=True):
+        """The candidate when user_key is in the canary and it is ready, otherwise None (serve the primary)"""
+        if not self.enabled or not self.in_canary(user_key):
+            return None
+        wrapper = self.candidate()
+        if wrapper is not None and count:
+            self._counts['canary_requests'] += 1
+        return wrapper
+
+    def shadow(self, image_array, primary_probabilities, primary_version, primary_latency_ms):
+        """
+        Queue a sampled upload for the candidate; returns whether it was queued.
+
+        image_array is the (1, height, width, channels) uint8 array the primary
+        model classified. Never blocks: when the queue is full the sample is dropped.
+        """
+        if not self.enabled or self.shadow_rate <= 0 or primary_version == self.candidate_version:
+            return False
+        if random.random() >= self.shadow_rate or self.candidate() is None:
+            return False
+
+        self._counts['sampled'] += 1
+        try:
+            self._queue.put_nowait((image_array, np.asarray(primary_probabilities), primary_version, primary_latency_ms))
+        except queue.Full:
+            self._counts['dropped'] += 1
+            return False
+        self._ensure_worker()
+        return True
+
+    def _ensure_worker(self):
+        if self._worker is not None and self._worker.is_alive():
+            return
+        with self._lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run, name='shadow-evaluator', daemon=True)
+                self._worker.start()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            try:
+                self.compare(*item)
+            except Exception as e:
+                self._counts['failed'] += 1
+                print(f"Shadow evaluation error: {str(e)}")
+
+    def compare(self, image_array, primary_probabilities, primary_version, primary_latency_ms):
+        """Classify with the candidate and record how it differs from the primary prediction"""
+        from app.utils import disease_class
+
+        start = time.perf_counter()
+        candidate_probabilities = np.asarray(self._candidate.predict(image_array))[0]
+        candidate_latency_ms = (time.perf_counter() - start) * 1000.0
+
+        primary_index = int(np.argmax(primary_probabilities))
+        candidate_index = int(np.argmax(candidate_probabilities))
+        primary_confidence = float(primary_probabilities[primary_index])
+        candidate_confidence = float(candidate_probabilities[candidate_index])
+        comparison = {
+            'primary_version': primary_version or '',
+            'candidate_version': self.candidate_version,
+            'primary_result': disease_class[primary_index],
+            'candidate_result': disease_class[candidate_index],
+            'agreed': primary_index == candidate_index,
+            'primary_confidence': primary_confidence,
+            'candidate_confidence': candidate_confidence,
+            'confidence_delta': candidate_confidence - primary_confidence,
+            'primary_latency_ms': primary_latency_ms,
+            'candidate_latency_ms': candidate_latency_ms,
+        }
+
+        self._counts['compared'] += 1
+        self._counts['agreed'] += comparison['agreed']
+        self._recent.append(comparison)
+        if self.record:
+            self.save(comparison)
+        return comparison
+
+    def save(self, comparison):
+        from django.db import close_old_connections
+        from app.models import ShadowComparison
+
+        # This thread outlives requests, so it has to drop stale connections itself
+        close_old_connections()
+        try:
+            ShadowComparison.objects.create(**comparison)
+        except Exception as e:
+            print(f"Error saving shadow comparison: {str(e)}")
+
+    def stats(self):
+        from app.crop_routing import crop_router
+
+        recent = list(self._recent)
+        stats = {
+            'enabled': self.enabled,
+            'candidate': self.candidate_version,
+            'state': self._state,
+            'last_error': self._last_error,
+            'canary': {
+                'percent': self.canary_percent,
+                'requests': self._counts['canary_requests'],
+            },
+            'shadow': {
+                'sample_rate': self.shadow_rate,
+                'queued': self._queue.qsize(),
+                'queue_size': self.queue_size,
+                'sampled': self._counts['sampled'],
+                'dropped': self._counts['dropped'],
+                'compared': self._counts['compared'],
+                'failed': self._counts['failed'],
+                'agreement': round(self._counts['agreed'] / self._counts['compared'], 4)
+                if self._counts['compared'] else None,
+            },
+            # Routed uploads never reach the candidate
+            'crop_routing': {
+                'enabled': crop_router.enabled,
+                'canary_and_shadow_active': not crop_router.enabled,
+                'bypassed': self._counts['bypassed'],
+            },
+        }
+        if recent:
+            stats['shadow']['window'] = {
+                'comparisons': len(recent),
+                'agreement': round(sum(c['agreed'] for c in recent) / len(recent), 4),
+                'mean_confidence_delta': round(float(np.mean([c['confidence_delta'] for c in recent])), 4),
+                'primary_latency_ms': {'p50': percentile([c['primary_latency_ms'] for c in recent], 0.5),
+                                       'p95': percentile([c['primary_latency_ms'] for c in recent], 0.95)},
+                'candidate_latency_ms': {'p50': percentile([c['candidate_latency_ms'] for c in recent], 0.5),
+                                         'p95': percentile([c['candidate_latency_ms'] for c in recent], 0.95)},
+            }
+        return stats
+
+    def close(self, timeout=5.0):
+        """Stop the shadow thread once the samples already queued are compared"""
+        if self._worker is not None and self._worker.is_alive():
+            try:
+                self._queue.put(None, timeout=timeout)
+            except queue.Full:
+                return
+            self._worker.join(timeout)
+
+    def _after_fork(self):
+        self._lock = threading.Lock()
+        self._worker = None
+        self._queue = queue.Queue(maxsize=self.queue_size)
+        if self._state == 'loading' and self._candidate is None:
+            self._state, self._loader = 'idle', None
+
+
+candidate_evaluator = CandidateEvaluator.from_env()
@@ -0,0 +1,175 @@
+import os
+import json
+import shutil
+import hashlib
+import tempfile
+from datetime import datetime, timezone
+
+
+MANIFEST_NAME = 'manifest.json'
+
+# Input every backend receives from app.preprocessing
+APP_INPUT_SHAPE = [256, 256, 3]
+
+# Model file suffix -> ModelWrapper backend, longest suffix first
+BACKEND_SUFFIXES = (
+    ('.torchscript.pt', 'torchscript'),
+    ('.h5', 'tensorflow'),
+    ('.keras', 'tensorflow'),
+    ('.onnx', 'onnx'),
+    ('.tflite', 'tflite'),
+    ('.pt', 'pytorch'),
+    ('.pth', 'pytorch'),
+)
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def infer_backend(path):
+    """ModelWrapper backend for a model file, from its suffix; None if unknown"""
+    lowered = path.lower()
+    for suffix, backend in BACKEND_SUFFIXES:
+        if lowered.endswith(suffix):
+            return backend
+    return None
+
+
+def check_compatible(entry):
+    """Raise ValueError unless a manifest entry can serve the app's labels and input"""
+    from app.utils import disease_class
+
+    if list(entry.get('classes') or []) != list(disease_class):
+        raise ValueError(f"Model version {entry['version']} labels {len(entry.get('classes') or [])} classes "
+                         f"that do not match app.utils.disease_class ({len(disease_class)} classes, in order)")
+    # PyTorch and TorchScript resize inside prepare_input; the rest take the app's input as is
+    if entry['backend'] in ('tensorflow', 'onnx', 'tflite') and list(entry.get('input_shape') or []) != APP_INPUT_SHAPE:
+        raise ValueError(f"Model version {entry['version']} expects input {entry.get('input_shape')}, "
+                         f"but the app sends {APP_INPUT_SHAPE}")
+
+
+class ModelManifest:
+    """
+    Versioned model artifacts and which one is active.
+
+    Lives in MODEL_REGISTRY_DIR (default app/ml_models/registry): every
+    version's file is stored under <version>/, and manifest.json records, per
+    version, the file, its SHA-256, backend, input shape and class list, plus
+    the 'active' version. The manifest is rewritten atomically, so workers
+    polling it never see a half-written file.
+    """
+
+    def __init__(self, root=None):
+        self.root = root or os.getenv(
+            'MODEL_REGISTRY_DIR', os.path.join(os.path.dirname(__file__), 'ml_models', 'registry')
+        )
+        self.path = os.path.join(self.root, MANIFEST_NAME)
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def mtime(self):
+        try:
+            return os.path.getmtime(self.path)
+        except OSError:
+            return None
+
+    def read(self):
+        if not self.exists():
+            return {'active': None, 'previous': None, 'versions': {}}
+        with open(self.path) as f:
+            return json.load(f)
+
+    def write(self, data):
+        os.makedirs(self.root, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(prefix='.manifest.', dir=self.root)
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(data, f, indent=2, sort_keys=True)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+
+    def versions(self):
+        """Manifest entries, oldest first"""
+        return sorted(self.read()['versions'].values(), key=lambda entry: entry.get('created_at', ''))
+
+    def active_version(self):
+        return self.read().get('active')
+
+    def entry(self, version, verify=False):
+        """The manifest entry of version with 'path' resolved; verify checks the file and its checksum"""
+        entry = self.read()['versions'].get(version)
+        if entry is None:
+            raise ValueError(f"Unknown model version '{version}'")
+        entry = dict(entry, path=os.path.join(self.root, entry['file']))
+        if verify:
+            if not os.path.exists(entry['path']):
+                raise ValueError(f"Model version {version}: {entry['path']} is missing")
+            checksum = file_sha256(entry['path'])
+            if checksum != entry['sha256']:
+                raise ValueError(f"Model version {version}: checksum {checksum[:12]} does not match "
+                                 f"the manifest ({entry['sha256'][:12]})")
+        return entry
+
+    def active_entry(self, verify=True):
+        version = self.active_version()
+        return self.entry(version, verify=verify) if version else None
+
+    def publish(self, source, version, backend=None, input_shape=None, classes=None, notes=''):
+        """Copy a model file into the registry as version and add it to the manifest; returns the entry"""
+        from app.utils import disease_class
+
+        data = self.read()
+        if version in data['versions']:
+            raise ValueError(f"Model version '{version}' already exists")
+        if not version or os.sep in version or version.startswith('.'):
+            raise ValueError(f"Invalid model version name '{version}'")
+        backend = backend or infer_backend(source)
+        if backend is None:
+            raise ValueError(f"Cannot tell the backend of {source}; pass it explicitly")
+
+        entry = {
+            'version': version,
+            'file': os.path.join(version, os.path.basename(source)),
+            'backend': backend,
+            'input_shape': list(input_shape or APP_INPUT_SHAPE),
+            'classes': list(classes or disease_class),
+            'sha256': file_sha256(source),
+            'size_bytes': os.path.getsize(source),
+            'notes': notes,
+            'created_at': datetime.now(timezone.utc).isoformat(),
+        }
+        check_compatible(entry)
+
+        destination = os.path.join(self.root, entry['file'])
+        os.makedirs(os.path.dirname(destination), exist_ok=True)
+        shutil.copyfile(source, destination)
+        if file_sha256(destination) != entry['sha256']:
+            raise ValueError(f"Copy of {source} in the registry is corrupt")
+
+        data = self.read()
+        data['versions'][version] = entry
+        self.write(data)
+        return entry
+
+    def activate(self, version):
+        """Make version the one workers serve; they switch to it on their next manifest poll"""
+        entry = self.entry(version, verify=True)
+        check_compatible(entry)
+        data = self.read()
+        if data.get('active') != version:
+            data['previous'] = data.get('active')
+            data['active'] = version
+            data['activated_at'] = datetime.now(timezone.utc).isoformat()
+            self.write(data)
+        return entry
@@ -1,3 +1,4 @@
+import uuid
 from django.db import models
 from django.core.validators import MinValueValidator, MaxValueValidator
 from django.contrib.auth.models import User
@@ -172,6 +173,7 @@ class PredictionHistory(models.Model):
     image_path = models.CharField(max_length=500, blank=True)
     location = models.CharField(max_length=200, blank=True, help_text="Location where prediction was made")
     crop_type = models.CharField(max_length=100, blank=True)
+    model_version = models.CharField(max_length=100, blank=True, help_text="Model version that made the prediction")
     weather_conditions = models.JSONField(default=dict, help_text="Weather data at time of prediction")
     treatment_applied = models.ForeignKey(Treatment, on_delete=models.SET_NULL, null=True, blank=True)
     treatment_effectiveness = models.IntegerField(null=True, blank=True, validators=[MinValueValidator(1), MaxValueValidator(5)])
@@ -186,6 +188,75 @@ class PredictionHistory(models.Model):
         verbose_name_plural = "Prediction Histories"
         ordering = ['-created_at']
 
+class PredictionJob(models.Model):
+    """A prediction accepted by /api/predict/ and run by run_prediction_worker"""
+    STATUS_CHOICES = [
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    ]
+
+    KIND_CHOICES = [
+        ('single', 'Single image'),
+        ('batch', 'Batch'),
+    ]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='prediction_jobs', null=True, blank=True)
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES, default='single')
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='queued')
+
+    # The uploads, concatenated; cleared once the job has run
+    payload = models.BinaryField(blank=True)
+    file_names = models.JSONField(default=list)
+    file_sizes = models.JSONField(default=list, help_text="Byte length of each upload in payload")
+    content_digests = models.JSONField(default=list, help_text="SHA-256 of each upload")
+    crop_type = models.CharField(max_length=100, blank=True, help_text="Crop named by the client, if any")
+
+    result = models.JSONField(null=True, blank=True)
+    error = models.TextField(blank=True)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    worker = models.CharField(max_length=100, blank=True)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    expires_at = models.DateTimeField(db_index=True)
+
+    def __str__(self):
+        return f"Prediction job {self.id} ({self.status})"
+
+    class Meta:
+        verbose_name = "Prediction Job"
+        verbose_name_plural = "Prediction Jobs"
+        ordering = ['created_at']
+        indexes = [
+            models.Index(fields=['status', 'created_at']),
+        ]
+
+class ShadowComparison(models.Model):
+    """One upload classified by both the serving model and a candidate version (app.model_evaluation)"""
+    primary_version = models.CharField(max_length=100)
+    candidate_version = models.CharField(max_length=100, db_index=True)
+    primary_result = models.CharField(max_length=100)
+    candidate_result = models.CharField(max_length=100)
+    agreed = models.BooleanField()
+    primary_confidence = models.FloatField()
+    candidate_confidence = models.FloatField()
+    confidence_delta = models.FloatField(help_text="Candidate minus primary top-class confidence")
+    primary_latency_ms = models.FloatField()
+    candidate_latency_ms = models.FloatField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.candidate_version} vs {self.primary_version} ({'agreed' if self.agreed else 'disagreed'})"
+
+    class Meta:
+        verbose_name = "Shadow Comparison"
+        verbose_name_plural = "Shadow Comparisons"
+        ordering = ['-created_at']
+
 class DashboardStats(models.Model):
     date = models.DateField(unique=True)
     total_predictions = models.IntegerField(default=0)
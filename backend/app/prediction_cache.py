@@ -0,0 +1,244 @@
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from PIL import Image
+
+
+def content_hash(image_array):
+    """SHA-256 of a decoded image's shape and pixels"""
+    image_array = np.ascontiguousarray(image_array)
+    digest = hashlib.sha256(repr(image_array.shape).encode())
+    digest.update(memoryview(image_array).cast('B'))
+    return digest.hexdigest()
+
+
+def perceptual_hash(image_array, hash_size=8):
+    """
+    64-bit difference hash of an image.
+
+    Re-encoded or lightly recompressed copies of the same photo decode to
+    slightly different pixels but land within a few bits of each other.
+    """
+    gray = Image.fromarray(np.asarray(image_array, dtype=np.uint8)).convert('L')
+    gray = gray.resize((hash_size + 1, hash_size), Image.BILINEAR)
+    pixels = np.asarray(gray, dtype=np.int16)
+    bits = (pixels[:, 1:] > pixels[:, :-1]).flatten()
+    return sum(1 << i for i, bit in enumerate(bits) if bit)
+
+
+def hamming_distance(a, b):
+    return bin(a ^ b).count('1')
+
+
+def mean_colour(image_array):
+    """Average RGB of an image; guards perceptual matches between flat, featureless images"""
+    return np.asarray(image_array, dtype=np.float32).reshape(-1, np.shape(image_array)[-1]).mean(axis=0)
+
+
+class PredictionCache:
+    """
+    Caches model probabilities by the content of the decoded image.
+
+    Two tiers: a bounded LRU in this process, and an optional Django cache
+    alias shared by all workers (Redis or a file cache, see CACHES in
+    settings). Keys include a namespace, normally the model version, so
+    switching models never serves stale predictions. With use_phash, images
+    whose perceptual hash is within phash_distance bits of a locally cached
+    one, and whose average colour is close to it, also count as hits.
+
+    Also stores whole API responses for Idempotency-Key replays.
+    """
+
+    def __init__(self, enabled=True, max_entries=1024, use_phash=False, phash_distance=4,
+                 colour_tolerance=8.0, shared_alias='predictions', timeout=86400):
+        self.enabled = enabled
+        self.max_entries = max(1, int(max_entries))
+        self.use_phash = use_phash
+        self.phash_distance = int(phash_distance)
+        self.colour_tolerance = float(colour_tolerance)
+        self.shared_alias = shared_alias
+        self.timeout = int(timeout)
+
+        # key -> (namespace, (perceptual hash, mean colour) or None, probabilities)
+        self._entries = OrderedDict()
+        self._responses = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.shared_hits = 0
+        self.phash_hits = 0
+        self.misses = 0
+
+    def lookup(self, image_array, namespace):
+        """Cached probabilities for one (height, width, channels) image, or None"""
+        if not self.enabled:
+            return None
+
+        key = f"prediction:{namespace}:{content_hash(image_array)}"
+        probabilities = self._get(key, namespace, image_array)
+        if probabilities is not None:
+            return probabilities
+
+        if self.use_phash:
+            phash, colour = self._signature(image_array)
+            with self._lock:
+                for entry_namespace, signature, probabilities in reversed(self._entries.values()):
+                    if entry_namespace != namespace or signature is None:
+                        continue
+                    if (hamming_distance(phash, signature[0]) <= self.phash_distance
+                            and np.max(np.abs(colour - signature[1])) <= self.colour_tolerance):
+                        self.phash_hits += 1
+                        return probabilities
+
+        self.misses += 1
+        return None
+
+    def store(self, image_array, probabilities, namespace):
+        """Cache the probabilities predicted for one image"""
+        if not self.enabled:
+            return
+
+        key = f"prediction:{namespace}:{content_hash(image_array)}"
+        self._put(key, namespace, probabilities, image_array)
+
+    def lookup_upload(self, digest, namespace):
+        """
+        Cached probabilities for an upload identified by the SHA-256 of its
+        raw bytes, or None. A hit skips decoding the image altogether.
+        """
+        if not self.enabled or not digest:
+            return None
+
+        probabilities = self._get(f"upload:{namespace}:{digest}", namespace)
+        if probabilities is None:
+            self.misses += 1
+        return probabilities
+
+    def store_upload(self, digest, probabilities, namespace):
+        """Cache the probabilities predicted for an upload by its raw-bytes digest"""
+        if not self.enabled or not digest:
+            return
+        self._put(f"upload:{namespace}:{digest}", namespace, probabilities)
+
+    def get_response(self, idempotency_key):
+        """
+        What was stored for idempotency_key: {'response', 'request_digest'}, or None.
+
+        request_digest identifies the request the response answered, so a key
+        reused for a different upload can be told apart from a retry.
+        """
+        key = f"idempotency:{idempotency_key}"
+        record = None
+        with self._lock:
+            if key in self._responses:
+                record = self._responses[key]
+
+        shared = self._shared_cache()
+        if record is None and shared is not None:
+            try:
+                record = shared.get(key)
+            except Exception as e:
+                print(f"Shared prediction cache error: {str(e)}")
+        # Entries written before request digests were stored are not replayed
+        if not isinstance(record, dict) or 'response' not in record:
+            return None
+        return record
+
+    def store_response(self, idempotency_key, response_data, request_digest=None):
+        """Remember response_data, and the request it answered, so retries with the same key can be replayed"""
+        key = f"idempotency:{idempotency_key}"
+        record = {'response': response_data, 'request_digest': request_digest}
+        with self._lock:
+            self._responses[key] = record
+            self._responses.move_to_end(key)
+            while len(self._responses) > self.max_entries:
+                self._responses.popitem(last=False)
+
+        shared = self._shared_cache()
+        if shared is not None:
+            try:
+                shared.set(key, record, self.timeout)
+            except Exception as e:
+                print(f"Shared prediction cache error: {str(e)}")
+
+    def stats(self):
+        """Return hit/miss counters"""
+        return {
+            'entries': len(self._entries),
+            'max_entries': self.max_entries,
+            'hits': self.hits,
+            'shared_hits': self.shared_hits,
+            'phash_hits': self.phash_hits,
+            'misses': self.misses,
+        }
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._responses.clear()
+
+    def _get(self, key, namespace, image_array=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[2]
+
+        shared = self._shared_cache()
+        if shared is not None:
+            try:
+                stored = shared.get(key)
+            except Exception as e:
+                print(f"Shared prediction cache error: {str(e)}")
+                stored = None
+            if stored is not None:
+                probabilities = np.asarray(stored, dtype=np.float32)
+                self._remember(key, namespace, image_array, probabilities)
+                self.shared_hits += 1
+                return probabilities
+        return None
+
+    def _put(self, key, namespace, probabilities, image_array=None):
+        probabilities = np.asarray(probabilities, dtype=np.float32)
+        self._remember(key, namespace, image_array, probabilities)
+
+        shared = self._shared_cache()
+        if shared is not None:
+            try:
+                shared.set(key, probabilities.tolist(), self.timeout)
+            except Exception as e:
+                print(f"Shared prediction cache error: {str(e)}")
+
+    def _remember(self, key, namespace, image_array, probabilities):
+        signature = self._signature(image_array) if self.use_phash and image_array is not None else None
+        with self._lock:
+            self._entries[key] = (namespace, signature, probabilities)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _signature(self, image_array):
+        return perceptual_hash(image_array), mean_colour(image_array)
+
+    def _shared_cache(self):
+        if not self.shared_alias:
+            return None
+        try:
+            from django.core.cache import caches
+            return caches[self.shared_alias]
+        except Exception:
+            return None
+
+
+prediction_cache = PredictionCache(
+    enabled=os.getenv('PREDICTION_CACHE_ENABLED', 'true').lower() == 'true',
+    max_entries=int(os.getenv('PREDICTION_CACHE_SIZE', '1024')),
+    use_phash=os.getenv('PREDICTION_CACHE_PHASH', 'false').lower() == 'true',
+    phash_distance=int(os.getenv('PREDICTION_CACHE_PHASH_DISTANCE', '4')),
+    shared_alias=os.getenv('PREDICTION_CACHE_ALIAS', 'predictions'),
+    timeout=int(os.getenv('PREDICTION_CACHE_TTL', '86400')),
+)
@@ -1,2 +1,167 @@
-from django.test import TestCase
+import os
+import shutil
+import socket
+import tempfile
+import time
+import unittest
+from unittest import mock
 
+import numpy as np
+from django.test import SimpleTestCase
+
+try:
+    import grpc
+except ImportError:
+    grpc = None
+
+try:
+    import torch
+except ImportError:
+    torch = None
+
+
+class StubModelWrapper:
+    """Stands in for ModelWrapper: row i of the output is i + the image's first pixel, for 17 classes"""
+    model_type = 'stub'
+
+    def predict(self, image_array):
+        offsets = image_array[:, 0, 0, 0].astype(np.float32)
+        return offsets[:, None] + np.arange(17, dtype=np.float32)[None, :]
+
+    predict_batched = predict
+
+
+def unused_address():
+    """A localhost address nothing listens on"""
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return f"127.0.0.1:{sock.getsockname()[1]}"
+
+
+@unittest.skipIf(grpc is None, 'grpcio is not installed')
+class InferenceServiceTests(SimpleTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        from app.inference_service import start_loopback_server
+
+        cls.server, cls.address = start_loopback_server(StubModelWrapper())
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop(0)
+        super().tearDownClass()
+
+    def inference_client(self, addresses):
+        from app.inference_service import InferenceClient
+
+        client = InferenceClient(addresses, timeout=5)
+        self.addCleanup(client.close)
+        return client
+
+    def batch(self, size, first_pixel=0):
+        image_array = np.zeros((size, 8, 8, 3), dtype=np.uint8)
+        image_array[:, 0, 0, 0] = first_pixel + np.arange(size)
+        return image_array
+
+    def test_predict_returns_one_row_per_image(self):
+        result = self.inference_client([self.address]).predict(self.batch(3))
+
+        self.assertEqual(result.shape, (3, 17))
+        self.assertEqual(result.dtype, np.float32)
+        np.testing.assert_array_equal(result[:, 0], [0, 1, 2])
+
+    def test_predict_stream_answers_each_batch_in_order(self):
+        client = self.inference_client([self.address])
+
+        results = list(client.predict_stream([self.batch(2), self.batch(1, first_pixel=7)]))
+
+        self.assertEqual([result.shape for result in results], [(2, 17), (1, 17)])
+        self.assertEqual(results[1][0, 0], 7)
+
+    def test_non_uint8_batch_is_rejected(self):
+        from app.inference_service import PREDICT_METHOD, serialize_array, deserialize_array
+
+        with grpc.insecure_channel(self.address) as channel:
+            predict = channel.unary_unary(
+                PREDICT_METHOD, request_serializer=serialize_array, response_deserializer=deserialize_array,
+            )
+            with self.assertRaises(grpc.RpcError) as raised:
+                predict(np.zeros((1, 8, 8, 3), dtype=np.float32), timeout=5)
+        self.assertEqual(raised.exception.code(), grpc.StatusCode.INVALID_ARGUMENT)
+
+    def test_unreachable_server_fails_over_to_the_next_address(self):
+        dead = unused_address()
+        client = self.inference_client([dead, self.address])
+
+        for _ in range(3):
+            self.assertEqual(client.predict(self.batch(1)).shape, (1, 17))
+        self.assertEqual(client.health()[dead]['failures'], 1)
+
+    def test_stream_fails_over_before_the_first_result(self):
+        client = self.inference_client([unused_address(), self.address])
+
+        results = list(client.predict_stream(iter([self.batch(2), self.batch(1)])))
+
+        self.assertEqual([result.shape for result in results], [(2, 17), (1, 17)])
+
+
+def constant_model(favourite):
+    """A 17-class torch model that scores class favourite highest for every image"""
+    model = torch.nn.Sequential(torch.nn.AdaptiveAvgPool2d(1), torch.nn.Flatten(), torch.nn.Linear(3, 17))
+    with torch.no_grad():
+        model[2].weight.zero_()
+        model[2].bias.zero_()
+        model[2].bias[favourite] = 1.0
+    return model
+
+
+@unittest.skipIf(grpc is None or torch is None, 'grpcio and torch are needed')
+class InferenceServerRegistryTests(SimpleTestCase):
+    def setUp(self):
+        from app.model_versions import ModelManifest
+        from app.torch_models import export_torchscript
+
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root, True)
+        self.manifest = ModelManifest(root=root)
+        for version, favourite in (('v1', 3), ('v2', 11)):
+            source = os.path.join(root, f'{version}.pt')
+            export_torchscript(constant_model(favourite), {'input_size': 16}, source)
+            self.manifest.publish(source, version, backend='torchscript')
+        self.manifest.activate('v1')
+
+        environment = mock.patch.dict(os.environ, {
+            'MODEL_BACKEND': 'grpc',
+            'MODEL_REGISTRY_DIR': root,
+            'MODEL_REGISTRY_POLL_SECONDS': '0',
+            'MODEL_DRAIN_SECONDS': '0',
+        })
+        environment.start()
+        self.addCleanup(environment.stop)
+
+    def test_server_switches_to_the_activated_version(self):
+        from app.model import ModelRegistry
+        from app.inference_service import InferenceClient, build_server
+
+        # Set up as run_inference_server does on a node of a MODEL_BACKEND=grpc deployment
+        registry = ModelRegistry()
+        registry_patch = mock.patch('app.model.model_registry', registry)
+        registry_patch.start()
+        self.addCleanup(registry_patch.stop)
+        backend = registry.serve_locally()
+        server, port = build_server('127.0.0.1:0', backend=backend, max_workers=2)
+        server.start()
+        self.addCleanup(server.stop, 0)
+        client = InferenceClient([f'127.0.0.1:{port}'], timeout=30)
+        self.addCleanup(client.close)
+        image_array = np.zeros((1, 16, 16, 3), dtype=np.uint8)
+
+        self.assertEqual(client.predict(image_array).argmax(), 3)
+
+        self.manifest.activate('v2')
+        deadline = time.monotonic() + 60
+        while client.predict(image_array).argmax() != 11 and time.monotonic() < deadline:
+            time.sleep(0.1)
+        self.assertEqual(client.predict(image_array).argmax(), 11)
+        self.assertEqual(registry.get(backend).artifact['version'], 'v2')
@@ -0,0 +1,421 @@
+import os
+import math
+import time
+import queue
+import tempfile
+import threading
+
+import numpy as np
+from PIL import Image
+
+
+class TileSource:
+    """
+    Lazy, window-by-window access to a large image.
+
+    size is the full-resolution (width, height); read(box) returns the
+    (x1, y1, x2, y2) window, given in full-resolution pixels, as a uint8 RGB
+    array. `array` is any (height, width, channels) array-like that only
+    materialises the rows and columns that are sliced, such as a numpy
+    memmap; `scale` is its resolution relative to the full-resolution image.
+    """
+
+    def __init__(self, array, size, scale=1.0, kind='array', cleanup=None):
+        self.array = array
+        self.size = size
+        self.scale = float(scale)
+        self.kind = kind
+        self._cleanup = cleanup
+
+    def read(self, box):
+        x1, y1, x2, y2 = (int(round(value * self.scale)) for value in box)
+        window = np.asarray(self.array[y1:max(y2, y1 + 1), x1:max(x2, x1 + 1)])
+        return to_rgb_uint8(window)
+
+    def close(self):
+        self.array = None
+        if self._cleanup is not None:
+            self._cleanup()
+            self._cleanup = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def to_rgb_uint8(window):
+    """Convert a (height, width[, channels]) window of any integer or float dtype to uint8 RGB"""
+    if window.ndim == 2:
+        window = window[..., np.newaxis]
+    if window.shape[-1] == 1:
+        window = np.repeat(window, 3, axis=-1)
+    window = window[..., :3]
+
+    if window.dtype == np.uint8:
+        return np.ascontiguousarray(window)
+    if np.issubdtype(window.dtype, np.integer):
+        # 16-bit drone sensors and friends: keep the top 8 bits of the range
+        return (window.astype(np.float32) * (255.0 / np.iinfo(window.dtype).max)).astype(np.uint8)
+    window = window.astype(np.float32)
+    if window.size and window.max() <= 1.0:
+        window = window * 255.0
+    return np.clip(window, 0, 255).astype(np.uint8)
+
+
+def _file_path(image_file):
+    """(path, cleanup) for an upload or file; in-memory uploads are spooled to a temporary file"""
+    if isinstance(image_file, str):
+        return image_file, None
+    if hasattr(image_file, 'temporary_file_path'):
+        return image_file.temporary_file_path(), None
+
+    image_file.seek(0)
+    spooled = tempfile.NamedTemporaryFile(suffix='.tif', delete=False)
+    with spooled:
+        while True:
+            chunk = image_file.read(1024 * 1024)
+            if not chunk:
+                break
+            spooled.write(chunk)
+    return spooled.name, lambda: os.unlink(spooled.name)
+
+
+def _planar_to_interleaved(array):
+    # (samples, height, width) planar RGB(A) becomes a (height, width, samples) view
+    if array.ndim == 3 and array.shape[0] in (3, 4) and array.shape[-1] not in (3, 4):
+        return array.transpose(1, 2, 0)
+    return array
+
+
+def open_tiff(image_file):
+    """
+    Memory-map a TIFF so tiles are paged in from disk as they are sliced.
+
+    Uncompressed, contiguous TIFFs (what most orthomosaic exporters write) are
+    mapped directly with tifffile.memmap. Compressed or tiled ones cannot be
+    mapped as stored, so they are decoded once into a memory-mapped temporary
+    file instead; either way the frame never has to fit in RAM.
+    """
+    import tifffile
+
+    path, cleanup = _file_path(image_file)
+    try:
+        try:
+            array = tifffile.memmap(path, mode='r')
+            kind = 'tiff_memmap'
+        except ValueError:
+            array = tifffile.imread(path, out='memmap')
+            kind = 'tiff_decoded_memmap'
+    except Exception:
+        if cleanup is not None:
+            cleanup()
+        raise
+
+    array = _planar_to_interleaved(array)
+    if array.ndim not in (2, 3):
+        if cleanup is not None:
+            cleanup()
+        raise ValueError(f"Unsupported TIFF layout {array.shape}; expected a single RGB or greyscale image")
+    return TileSource(array, (array.shape[1], array.shape[0]), kind=kind, cleanup=cleanup)
+
+
+def open_image(image_file, tile_size, input_size=256, max_pixels=None):
+    """
+    Open image_file for tiled reading.
+
+    TIFFs are memory-mapped (see open_tiff), so only the windows read are in
+    RAM. Other formats go through Pillow, which can only decode a whole frame:
+    baseline JPEG has no random access to regions, so a JPEG is draft-decoded
+    at the coarsest DCT scale (1/2, 1/4 or 1/8) that still gives every tile at
+    least input_size pixels, and PNG and the rest are decoded in full. A
+    512 px tile resized to 256 px for the model therefore costs a quarter of
+    the full-resolution JPEG decode, with no loss in what the model sees.
+
+    Because those decodes are whole-frame, an image that would decode to more
+    than max_pixels raises ValueError; orthomosaics beyond that must be TIFF.
+    """
+    from app.upload_handlers import sniff_image_format, SNIFF_BYTES
+
+    if isinstance(image_file, str):
+        with open(image_file, 'rb') as f:
+            header = f.read(SNIFF_BYTES)
+    else:
+        image_file.seek(0)
+        header = image_file.read(SNIFF_BYTES)
+        image_file.seek(0)
+    # BigTIFF and 16-bit or float TIFFs are beyond Pillow; tifffile handles them all
+    if sniff_image_format(header) == 'tiff' or header[:4] in (b'II+\x00', b'MM\x00+'):
+        return open_tiff(image_file)
+
+    image = Image.open(image_file)
+    kind = (image.format or 'image').lower()
+    size = image.size
+    if image.format == 'JPEG':
+        scale = min(1.0, input_size / float(tile_size))
+        image.draft('RGB', (max(1, int(size[0] * scale)), max(1, int(size[1] * scale))))
+    # After draft(), image.size is what the decode will produce
+    if max_pixels and image.size[0] * image.size[1] > max_pixels:
+        raise ValueError(f"{size[0]}x{size[1]} {image.format or 'image'} would decode to "
+                         f"{image.size[0] * image.size[1] / 1e6:.0f} MP in memory, more than "
+                         f"TILED_MAX_DECODED_MEGAPIXELS ({max_pixels / 1e6:g}); upload it as a TIFF")
+    image = image.convert('RGB')
+    return TileSource(np.asarray(image), size, scale=image.size[0] / float(size[0]), kind=kind)
+
+
+def tile_grid(size, tile_size, stride):
+    """
+    (x1, y1, x2, y2) windows of tile_size pixels every stride pixels covering an image of size.
+
+    The last row and column are shifted back to end on the image edge rather
+    than hanging off it; images smaller than a tile give a single window.
+    """
+    width, height = size
+
+    def starts(length):
+        if length <= tile_size:
+            return [0]
+        positions = list(range(0, length - tile_size + 1, stride))
+        if positions[-1] != length - tile_size:
+            positions.append(length - tile_size)
+        return positions
+
+    return [
+        (x, y, min(width, x + tile_size), min(height, y + tile_size))
+        for y in starts(height) for x in starts(width)
+    ]
+
+
+def tile_batches(source, boxes, batch_size, input_size=(256, 256), gate=None):
+    """
+    Yield (boxes, is_leaf, batch) for consecutive groups of batch_size tiles.
+
+    Only one batch of windows is decoded at a time. batch is a uint8
+    (n, height, width, 3) array of the tiles that passed the colour gate, in
+    box order; is_leaf flags which boxes those were. Tiles of bare soil, sky
+    or roads are skipped without running the model.
+    """
+    for offset in range(0, len(boxes), batch_size):
+        group = boxes[offset:offset + batch_size]
+        is_leaf, tiles = [], []
+        for box in group:
+            tile = np.asarray(Image.fromarray(source.read(box)).resize(input_size, Image.LANCZOS, reducing_gap=2.0))
+            leafy = gate is None or not gate.enabled or gate.leaf_ratio(tile) >= gate.min_ratio
+            is_leaf.append(leafy)
+            if leafy:
+                tiles.append(tile)
+        batch = np.stack(tiles, axis=0) if tiles else np.empty((0,) + tuple(input_size[::-1]) + (3,), dtype=np.uint8)
+        yield group, is_leaf, batch
+
+
+def prefetch(iterable, depth):
+    """
+    Run iterable on a background thread, at most depth items ahead of the consumer.
+
+    Decoding the next tiles overlaps with inference on the current ones while
+    memory stays bounded by depth batches. Exceptions are re-raised in the
+    consumer; stopping early (break, or an error downstream) stops the thread.
+    """
+    items = queue.Queue(maxsize=max(1, depth))
+    stop = threading.Event()
+    done = object()
+
+    def put(item, error=None):
+        # Give up once the consumer has gone, instead of blocking on a full queue
+        while not stop.is_set():
+            try:
+                items.put((item, error), timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        try:
+            for item in iterable:
+                if not put(item):
+                    return
+            put(done)
+        except Exception as e:
+            put(done, e)
+
+    thread = threading.Thread(target=produce, name='tile-prefetch', daemon=True)
+    thread.start()
+    try:
+        while True:
+            item, error = items.get()
+            if item is done:
+                if error is not None:
+                    raise error
+                return
+            yield item
+    finally:
+        stop.set()
+        thread.join(timeout=5.0)
+
+
+class HeatMap:
+    """
+    Merges overlapping tile predictions into a grid of cell_size regions.
+
+    Each tile's class probabilities are added to every cell whose centre it
+    covers, and cells report the mean over those tiles. Cells only covered by
+    tiles the colour gate skipped stay empty (background).
+    """
+
+    def __init__(self, size, cell_size, num_classes):
+        self.size = size
+        self.cell_size = cell_size
+        self.columns = max(1, math.ceil(size[0] / cell_size))
+        self.rows = max(1, math.ceil(size[1] / cell_size))
+        self.probabilities = np.zeros((self.rows, self.columns, num_classes), dtype=np.float64)
+        self.counts = np.zeros((self.rows, self.columns), dtype=np.int32)
+
+    def _cells(self, box):
+        x1, y1, x2, y2 = box
+        half = self.cell_size / 2.0
+        columns = slice(max(0, math.ceil((x1 - half) / self.cell_size)),
+                        min(self.columns, math.ceil((x2 - half) / self.cell_size)))
+        rows = slice(max(0, math.ceil((y1 - half) / self.cell_size)),
+                     min(self.rows, math.ceil((y2 - half) / self.cell_size)))
+        return rows, columns
+
+    def add(self, box, probabilities):
+        rows, columns = self._cells(box)
+        self.probabilities[rows, columns] += np.asarray(probabilities, dtype=np.float64)
+        self.counts[rows, columns] += 1
+
+    def mean(self):
+        return self.probabilities / np.maximum(self.counts, 1)[..., np.newaxis]
+
+    def result(self, classes):
+        """JSON-ready heat map: per-cell disease score and dominant class, plus region counts"""
+        from app.utils import interpret_prediction, not_a_leaf
+
+        healthy = np.array(['healthy' in name.lower() for name in classes])
+        mean = self.mean()
+        covered = self.counts > 0
+
+        # Probability mass on any disease; None where no leaf tile landed
+        disease_score = mean[..., :len(classes)][..., ~healthy].sum(axis=-1)
+        scores, dominant, region_counts = [], [], {}
+        for row in range(self.rows):
+            score_row, dominant_row = [], []
+            for column in range(self.columns):
+                if not covered[row, column]:
+                    score_row.append(None)
+                    dominant_row.append(None)
+                    continue
+                result, _ = interpret_prediction(mean[row, column])
+                score_row.append(round(float(disease_score[row, column]), 4))
+                dominant_row.append(None if result == not_a_leaf else classes.index(result))
+                region_counts[result] = region_counts.get(result, 0) + 1
+            scores.append(score_row)
+            dominant.append(dominant_row)
+
+        diseased = sum(count for result, count in region_counts.items()
+                       if result != not_a_leaf and 'healthy' not in result.lower())
+        leaf_cells = int(covered.sum())
+        return {
+            'rows': self.rows,
+            'columns': self.columns,
+            'cell_size': self.cell_size,
+            'disease_score': scores,
+            'dominant_class': dominant,
+            'classes': list(classes),
+            'region_counts': dict(sorted(region_counts.items(), key=lambda item: -item[1])),
+            'leaf_cells': leaf_cells,
+            'diseased_fraction': round(diseased / leaf_cells, 4) if leaf_cells else 0.0,
+        }
+
+
+def tiling_settings(tile_size=None, overlap=None):
+    tile_size = int(tile_size or os.getenv('TILED_TILE_SIZE', '512'))
+    overlap = float(os.getenv('TILED_OVERLAP', '0.5') if overlap is None else overlap)
+    if tile_size < 64:
+        raise ValueError("tile_size must be at least 64 pixels")
+    if not 0.0 <= overlap < 1.0:
+        raise ValueError("overlap must be in [0, 1)")
+    return {
+        'tile_size': tile_size,
+        'stride': max(1, int(round(tile_size * (1.0 - overlap)))),
+        'batch_size': int(os.getenv('TILED_BATCH_SIZE', '16')),
+        'prefetch_batches': int(os.getenv('TILED_PREFETCH_BATCHES', '2')),
+        'max_tiles': int(os.getenv('TILED_MAX_TILES', '4096')),
+        'max_decoded_pixels': int(float(os.getenv('TILED_MAX_DECODED_MEGAPIXELS', '50')) * 1e6),
+    }
+
+
+def classify_tiles(image_file, tile_size=None, overlap=None, model_wrapper=None):
+    """
+    Classify a high-resolution image tile by tile and merge the results into a heat map.
+
+    The image is opened lazily (open_image), cut into tile_size windows every
+    tile_size * (1 - overlap) pixels, and the windows flow through a bounded
+    generator pipeline: decode and resize on a prefetch thread, colour gate,
+    then one model call per TILED_BATCH_SIZE tiles. Raises ValueError for bad
+    settings, when the grid exceeds TILED_MAX_TILES, or when a non-TIFF image
+    would decode to more than TILED_MAX_DECODED_MEGAPIXELS.
+    """
+    from app.model import model_registry
+    from app.utils import disease_class
+    from app.leaf_gate import leaf_gate
+    from app.admission import admission_slot
+
+    settings = tiling_settings(tile_size, overlap)
+    model_wrapper = model_wrapper or model_registry.get()
+    if model_wrapper.model_type is None:
+        raise RuntimeError("Model not available. Please check model loading.")
+
+    timings = {}
+    start = time.perf_counter()
+    with open_image(image_file, settings['tile_size'], max_pixels=settings['max_decoded_pixels']) as source:
+        timings['open'] = (time.perf_counter() - start) * 1000.0
+
+        boxes = tile_grid(source.size, settings['tile_size'], settings['stride'])
+        if len(boxes) > settings['max_tiles']:
+            raise ValueError(f"{source.size[0]}x{source.size[1]} image needs {len(boxes)} tiles of "
+                             f"{settings['tile_size']} px, more than TILED_MAX_TILES ({settings['max_tiles']}); "
+                             f"use a larger tile_size or less overlap")
+
+        heat_map = None
+        classified = 0
+        inference_seconds = 0.0
+        batches = tile_batches(source, boxes, settings['batch_size'], gate=leaf_gate)
+        for group, is_leaf, batch in prefetch(batches, settings['prefetch_batches']):
+            if not len(batch):
+                continue
+            with admission_slot():
+                stage = time.perf_counter()
+                predictions = np.asarray(model_wrapper.predict(batch))
+                inference_seconds += time.perf_counter() - stage
+
+            if heat_map is None:
+                num_classes = max(predictions.shape[-1], len(disease_class))
+                heat_map = HeatMap(source.size, settings['stride'], num_classes)
+            leaf_boxes = [box for box, leafy in zip(group, is_leaf) if leafy]
+            for box, probabilities in zip(leaf_boxes, predictions):
+                heat_map.add(box, probabilities)
+            classified += len(batch)
+
+        image_size = list(source.size)
+        source_kind = source.kind
+
+    if heat_map is None:
+        heat_map = HeatMap(tuple(image_size), settings['stride'], len(disease_class))
+    timings['inference'] = inference_seconds * 1000.0
+    timings['total'] = (time.perf_counter() - start) * 1000.0
+
+    return {
+        'mode': 'tiled',
+        'source': source_kind,
+        'image_size': image_size,
+        'tile_size': settings['tile_size'],
+        'stride': settings['stride'],
+        'tiles_total': len(boxes),
+        'tiles_classified': classified,
+        'tiles_background': len(boxes) - classified,
+        'heatmap': heat_map.result(disease_class),
+        'timings_ms': {stage: round(value, 1) for stage, value in timings.items()},
+    }
@@ -0,0 +1,148 @@
+import json
+
+import torch
+import torch.nn as nn
+from torchvision import models
+
+
+# Metadata stored inside exported TorchScript files
+TORCHSCRIPT_SPEC_FILE = 'cropleaf.json'
+
+IMAGENET_MEAN = [0.485, 0.456, 0.406]
+IMAGENET_STD = [0.229, 0.224, 0.225]
+
+# Blocks per stage for torchvision ResNets, keyed by (blocks, bottleneck)
+RESNET_VARIANTS = {
+    ((2, 2, 2, 2), False): models.resnet18,
+    ((3, 4, 6, 3), False): models.resnet34,
+    ((3, 4, 6, 3), True): models.resnet50,
+    ((3, 4, 23, 3), True): models.resnet101,
+    ((3, 8, 36, 3), True): models.resnet152,
+}
+
+
+class PlantDiseaseCNN(nn.Module):
+    """Four conv blocks and a two-layer classifier, as used by plant_disease_model_1_latest.pt"""
+
+    def __init__(self, num_classes):
+        super().__init__()
+        layers = []
+        in_channels = 3
+        for out_channels in (32, 64, 128, 256):
+            layers += [
+                nn.Conv2d(in_channels, out_channels, kernel_size=3, padding=1),
+                nn.ReLU(),
+                nn.BatchNorm2d(out_channels),
+                nn.Conv2d(out_channels, out_channels, kernel_size=3, padding=1),
+                nn.ReLU(),
+                nn.BatchNorm2d(out_channels),
+                nn.MaxPool2d(2),
+            ]
+            in_channels = out_channels
+        self.conv_layers = nn.Sequential(*layers)
+
+        self.dense_layers = nn.Sequential(
+            nn.Dropout(0.4),
+            nn.Linear(256 * 14 * 14, 1024),
+            nn.ReLU(),
+            nn.Dropout(0.4),
+            nn.Linear(1024, num_classes),
+        )
+
+    def forward(self, x):
+        out = self.conv_layers(x)
+        out = torch.flatten(out, 1)
+        return self.dense_layers(out)
+
+
+def extract_state_dict(checkpoint):
+    """Pull the weights out of the usual checkpoint layouts"""
+    if isinstance(checkpoint, dict):
+        for key in ('state_dict', 'model_state_dict', 'model'):
+            if key in checkpoint and isinstance(checkpoint[key], dict):
+                checkpoint = checkpoint[key]
+                break
+
+    # Strip the prefix added when the model was trained under DataParallel
+    return {
+        (name[len('module.'):] if name.startswith('module.') else name): value
+        for name, value in checkpoint.items()
+    }
+
+
+def build_model_from_checkpoint(checkpoint):
+    """
+    Reconstruct the network a checkpoint was saved from.
+
+    Returns (model, spec) where spec describes the expected input size,
+    normalisation and number of classes. Raises ValueError when the
+    architecture cannot be recognised from the checkpoint keys.
+    """
+    if isinstance(checkpoint, nn.Module):
+        raise ValueError("Checkpoint is a full module; export it directly instead of rebuilding it")
+
+    state_dict = extract_state_dict(checkpoint)
+
+    if 'conv_layers.0.weight' in state_dict and 'dense_layers.4.weight' in state_dict:
+        num_classes = state_dict['dense_layers.4.weight'].shape[0]
+        model = PlantDiseaseCNN(num_classes)
+        spec = {'architecture': 'plant_disease_cnn', 'input_size': 224, 'mean': None, 'std': None}
+
+    elif 'fc.weight' in state_dict and 'layer1.0.conv1.weight' in state_dict:
+        blocks = tuple(
+            len({name.split('.')[1] for name in state_dict if name.startswith(f'layer{stage}.')})
+            for stage in range(1, 5)
+        )
+        bottleneck = 'layer1.0.conv3.weight' in state_dict
+        builder = RESNET_VARIANTS.get((blocks, bottleneck))
+        if builder is None:
+            raise ValueError(f"Unsupported ResNet layout: blocks={blocks}, bottleneck={bottleneck}")
+        num_classes = state_dict['fc.weight'].shape[0]
+        model = builder(weights=None, num_classes=num_classes)
+        spec = {'architecture': builder.__name__, 'input_size': 224, 'mean': IMAGENET_MEAN, 'std': IMAGENET_STD}
+
+    else:
+        raise ValueError("Unrecognised checkpoint architecture")
+
+    model.load_state_dict(state_dict)
+    model.eval()
+    spec['num_classes'] = int(num_classes)
+    return model, spec
+
+
+def export_torchscript(model, spec, path):
+    """Trace, freeze and save a model as TorchScript with its preprocessing spec embedded"""
+    size = spec.get('input_size') or 256
+    model = model.eval().to(memory_format=torch.channels_last)
+    example = torch.zeros(1, 3, size, size).to(memory_format=torch.channels_last)
+
+    with torch.no_grad():
+        traced = torch.jit.trace(model, example)
+    frozen = torch.jit.freeze(traced)
+
+    torch.jit.save(frozen, path, _extra_files={TORCHSCRIPT_SPEC_FILE: json.dumps(spec)})
+    return path
+
+
+def load_torchscript(path):
+    """Load a TorchScript model saved by export_torchscript, returning (model, spec)"""
+    extra_files = {TORCHSCRIPT_SPEC_FILE: ''}
+    model = torch.jit.load(path, map_location='cpu', _extra_files=extra_files)
+    model.eval()
+    return model, json.loads(extra_files[TORCHSCRIPT_SPEC_FILE])
+
+
+def prepare_input(image_array, spec):
+    """Turn a uint8 (batch, height, width, channels) array into a normalised channels_last tensor"""
+    tensor = torch.from_numpy(image_array).permute(0, 3, 1, 2).float().div_(255.0)
+
+    size = spec.get('input_size')
+    if size and tensor.shape[-2:] != (size, size):
+        tensor = nn.functional.interpolate(tensor, size=(size, size), mode='bilinear', align_corners=False, antialias=True)
+
+    if spec.get('mean') and spec.get('std'):
+        mean = torch.tensor(spec['mean']).view(1, 3, 1, 1)
+        std = torch.tensor(spec['std']).view(1, 3, 1, 1)
+        tensor = (tensor - mean) / std
+
+    return tensor.contiguous(memory_format=torch.channels_last)
@@ -0,0 +1,156 @@
+import os
+import hashlib
+from functools import wraps
+
+from django.core.files.uploadhandler import FileUploadHandler, StopUpload
+from django.http import QueryDict
+from django.utils.datastructures import MultiValueDict
+
+
+# Leading bytes of the image formats the decoders accept
+IMAGE_SIGNATURES = (
+    (b'\xff\xd8\xff', 'jpeg'),
+    (b'\x89PNG\r\n\x1a\n', 'png'),
+    (b'GIF87a', 'gif'),
+    (b'GIF89a', 'gif'),
+    (b'BM', 'bmp'),
+    (b'II*\x00', 'tiff'),
+    (b'MM\x00*', 'tiff'),
+)
+
+# Bytes needed to recognise every format above, including RIFF....WEBP
+SNIFF_BYTES = 12
+
+# Allowance for multipart boundaries, headers and small form fields
+MULTIPART_OVERHEAD = 1024 * 1024
+
+
+def sniff_image_format(header):
+    """Image format named by the first bytes of a file, or None"""
+    if header[:4] == b'RIFF' and header[8:12] == b'WEBP':
+        return 'webp'
+    for signature, image_format in IMAGE_SIGNATURES:
+        if header.startswith(signature):
+            return image_format
+    return None
+
+
+class StreamingImageUploadHandler(FileUploadHandler):
+    """
+    Vets image uploads while they are still being received.
+
+    Sits in front of Django's memory/temporary-file handlers and passes every
+    chunk on to them unchanged, so small files stay in memory and large ones
+    are spooled to disk. Along the way it:
+
+    - rejects the request before reading the body when Content-Length is
+      already over the limit,
+    - checks the magic bytes of each file's first chunk,
+    - stops reading a file as soon as it exceeds max_size,
+    - hashes each file incrementally into request.upload_digests, a dict of
+      field name -> list of SHA-256 hex digests in upload order.
+
+    A rejected upload sets request.upload_rejection to
+    {'status': 413 or 415, 'error': message} and stops the upload without
+    reading the rest of the body; views should check it before request.FILES.
+    """
+
+    def __init__(self, request=None, max_size=None, max_files=1):
+        super().__init__(request)
+        self.max_size = max_size or int(float(os.getenv('UPLOAD_MAX_SIZE_MB', '20')) * 1024 * 1024)
+        self.max_files = max(1, int(max_files))
+        self.header = b''
+        self.digest = None
+        self.received = 0
+
+        if request is not None:
+            request.upload_rejection = None
+            request.upload_digests = {}
+
+    def handle_raw_input(self, input_data, META, content_length, boundary, encoding=None):
+        # Parsed data returned from here skips the multipart parser entirely,
+        # so nothing of the body is read
+        if content_length > self.max_size * self.max_files + MULTIPART_OVERHEAD:
+            self.record_rejection(413, f"Upload too large: {content_length} bytes, "
+                                       f"at most {self.max_size} bytes per image allowed")
+            return QueryDict(encoding=encoding), MultiValueDict()
+        return None
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.header = b''
+        self.digest = hashlib.sha256()
+        self.received = 0
+
+    def receive_data_chunk(self, raw_data, start):
+        if len(self.header) < SNIFF_BYTES:
+            self.header += raw_data[:SNIFF_BYTES - len(self.header)]
+            if len(self.header) >= SNIFF_BYTES:
+                self.check_format()
+
+        self.received += len(raw_data)
+        if self.received > self.max_size:
+            self.reject(413, f"Image '{self.file_name}' is larger than {self.max_size} bytes")
+
+        self.digest.update(raw_data)
+        return raw_data
+
+    def file_complete(self, file_size):
+        # Files too short to have reached SNIFF_BYTES are checked here
+        if len(self.header) < SNIFF_BYTES:
+            self.check_format()
+
+        if self.request is not None:
+            self.request.upload_digests.setdefault(self.field_name, []).append(self.digest.hexdigest())
+
+        # Let the next handler build the UploadedFile
+        return None
+
+    def check_format(self):
+        if sniff_image_format(self.header) is None:
+            self.reject(415, f"'{self.file_name}' is not a supported image "
+                             f"(expected JPEG, PNG, WebP, GIF, BMP or TIFF)")
+
+    def record_rejection(self, status, error):
+        if self.request is not None:
+            self.request.upload_rejection = {'status': status, 'error': error}
+
+    def reject(self, status, error):
+        self.record_rejection(status, error)
+        raise StopUpload(connection_reset=True)
+
+
+def stream_image_uploads(max_files=1, max_size=None):
+    """
+    Install StreamingImageUploadHandler in front of the request's upload handlers.
+
+    max_size (bytes per file) defaults to UPLOAD_MAX_SIZE_MB.
+
+    Apply it outside @api_view/@csrf_exempt so the handler is in place before
+    anything (including DRF's CSRF check) parses the request body:
+
+        @stream_image_uploads()
+        @api_view(['POST'])
+        def view(request): ...
+    """
+    def decorator(view_func):
+        @wraps(view_func)
+        def wrapper(request, *args, **kwargs):
+            request.upload_handlers.insert(0, StreamingImageUploadHandler(request, max_size=max_size, max_files=max_files))
+            return view_func(request, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def upload_rejection(request):
+    """The rejection recorded by StreamingImageUploadHandler, or None"""
+    # DRF wraps the Django request; the handler recorded on the original
+    request = getattr(request, '_request', request)
+    return getattr(request, 'upload_rejection', None)
+
+
+def upload_digest(request, field_name, index=0):
+    """SHA-256 of the index-th file uploaded under field_name, or None"""
+    request = getattr(request, '_request', request)
+    digests = getattr(request, 'upload_digests', {}).get(field_name, [])
+    return digests[index] if index < len(digests) else None
@@ -11,7 +11,7 @@ from app.views import (
     home, crops, uploads, profiledata, contact_view, forgot_pass,
 
     # API views
-    predict_simple, disease_details, translate_text, health_check,
+    predict_simple, predict_batch, prediction_job, predict_leaves, predict_tiles, disease_details, translate_text, health_check, liveness, readiness, metrics,
     dashboard_stats, farmer_dashboard,
 
     # Marketplace views
@@ -40,6 +40,10 @@ urlpatterns = [
     path('logout/',logout_view, name='logout'),
     path('user/profile/<int:pk>/',profiledata, name='profile'),
     path('api/predict/', predict_simple, name='api_predict'),
+    path('api/predict/batch/', predict_batch, name='api_predict_batch'),
+    path('api/predict/jobs/<uuid:job_id>/', prediction_job, name='api_predict_job'),
+    path('api/predict/leaves/', predict_leaves, name='api_predict_leaves'),
+    path('api/predict/tiles/', predict_tiles, name='api_predict_tiles'),
     path('api/disease/<str:disease_name>/', disease_details, name='disease_details'),
     path('api/translate/', translate_text, name='translate_text'),
     path('api/dashboard/stats/', dashboard_stats, name='dashboard_stats'),
@@ -61,4 +65,7 @@ urlpatterns = [
 
     # Health check for Render monitoring
     path('api/health/', health_check, name='health_check'),
+    path('api/health/live/', liveness, name='health_live'),
+    path('api/health/ready/', readiness, name='health_ready'),
+    path('api/metrics/', metrics, name='api_metrics'),
 ]
\ No newline at end of file
@@ -1,9 +1,19 @@
+import os
+import time
 import uuid
 import numpy as np
-from PIL import Image
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
 from functools import wraps
-from app.model import model_wrapper
+from app.model import model_registry
+from app.leaf_gate import leaf_gate
+from app.crop_routing import crop_router
+from app.model_evaluation import candidate_evaluator
+from app.admission import admission_slot
+from app.prediction_cache import prediction_cache
+from app.preprocessing import decode_and_resize
 from django.shortcuts import redirect
+from django.core.files.base import ContentFile
 from django.core.files.storage import default_storage
 
 def anonymous_required(view_func):
@@ -224,50 +234,386 @@ under_maintenance = """
                 """
 
 
-def process_image(full_path):
-    if full_path.lower().endswith(".svg"):
-        raise ValueError("SVG files are not supported.")
+not_a_leaf = "Provided image doesn’t seem to be a crop leaf."
+
+
+def interpret_prediction(probabilities):
+    """Map one row of class probabilities to a (result, max_probability) pair"""
+    if hasattr(probabilities, 'detach'):
+        probabilities = probabilities.detach().numpy()
+    probabilities = np.asarray(probabilities).reshape(-1)
+
+    pred_index = int(np.argmax(probabilities))
+    max_probability = float(probabilities[pred_index])
+
+    if max_probability < 0.5 or pred_index >= len(disease_class):
+        return not_a_leaf, max_probability
+    return disease_class[pred_index], max_probability
 
-    image = Image.open(full_path).convert("RGB")
-    image_resized = image.resize((256, 256), Image.LANCZOS)
 
-    compressed_filename = f"{uuid.uuid4()}.webp"
-    compressed_path = default_storage.path(compressed_filename)
-    image_resized.save(compressed_path, format="WebP", lossless=True)
+def load_image_array(image_file, size=(256, 256)):
+    """Decode an image file or upload and resize it to the model input size"""
+    name = image_file if isinstance(image_file, str) else getattr(image_file, 'name', '') or ''
+    if name.lower().endswith(".svg"):
+        raise ValueError("SVG files are not supported.")
 
-    image_array = np.expand_dims(np.array(image_resized), axis=0)
+    if hasattr(image_file, 'seek'):
+        image_file.seek(0)
+    return decode_and_resize(image_file, size)
+
+
+def prediction_namespace(model_wrapper):
+    """Prediction cache namespace, so a different model never reuses cached results"""
+    return model_wrapper.version() or model_wrapper.model_type
+
+
+def predict_cached(model_wrapper, image_array, predict_fn=None):
+    """
+    Predict a uint8 (batch, height, width, channels) array, reusing cached
+    probabilities for images that have been seen before.
+
+    Only the images missing from the cache go through the model, holding an
+    admission slot. predict_fn defaults to model_wrapper.predict_batched.
+    """
+    predict_fn = predict_fn or model_wrapper.predict_batched
+    namespace = prediction_namespace(model_wrapper)
+
+    predictions = [prediction_cache.lookup(image, namespace) for image in image_array]
+    missing = [row for row, prediction in enumerate(predictions) if prediction is None]
+
+    if missing:
+        with admission_slot():
+            start = time.perf_counter()
+            fresh = np.asarray(predict_fn(image_array[missing]))
+            leaf_gate.record_classifier(time.perf_counter() - start, len(missing))
+        for row, probabilities in zip(missing, fresh):
+            prediction_cache.store(image_array[row], probabilities, namespace)
+            predictions[row] = probabilities
+
+    return np.stack(predictions, axis=0)
+
+
+def predict_images(image_files, crop_type=None):
+    """
+    Classify many uploaded images at once.
+
+    Images are decoded and resized in parallel threads (Pillow releases the GIL
+    while decoding), stacked, and sent through ModelWrapper.predict as one
+    vectorized call per PREDICT_BATCH_CHUNK_SIZE images. With crop routing
+    enabled each chunk goes through crop_router instead, with crop_type
+    applied to every image. Returns per-image results in upload order and a
+    summary of disease counts.
+    """
+    # Routing loads the monolithic model only if some image falls back to it
+    model_wrapper = None if crop_router.enabled else model_registry.get()
+    decode_threads = int(os.getenv('PREDICT_BATCH_DECODE_THREADS', '4'))
+    chunk_size = max(1, int(os.getenv('PREDICT_BATCH_CHUNK_SIZE', '64')))
+
+    results = [
+        {'index': index, 'filename': getattr(image_file, 'name', ''), 'result': None, 'confidence': 0.0}
+        for index, image_file in enumerate(image_files)
+    ]
+
+    def decode(index):
+        try:
+            return index, load_image_array(image_files[index]), None
+        except Exception as e:
+            return index, None, str(e)
+
+    decoded = []
+    with ThreadPoolExecutor(max_workers=max(1, decode_threads)) as executor:
+        for index, image_array, error in executor.map(decode, range(len(image_files))):
+            if error is not None:
+                results[index]['error'] = f"Could not read image: {error}"
+            elif not leaf_gate.check(image_array, results[index]['filename'])[0]:
+                results[index]['result'] = not_a_leaf
+            else:
+                decoded.append((index, image_array))
+
+    if model_wrapper is not None and model_wrapper.model_type is None:
+        for index, _ in decoded:
+            results[index]['error'] = "Model not available. Please check model loading."
+        decoded = []
+
+    for start in range(0, len(decoded), chunk_size):
+        chunk = decoded[start:start + chunk_size]
+        batch = np.stack([image_array for _, image_array in chunk], axis=0)
+
+        if model_wrapper is None:
+            try:
+                outputs = crop_router.predict(batch, [crop_type] * len(chunk))
+            except Exception as e:
+                print(f"Routed batch prediction error: {str(e)}")
+                for index, _ in chunk:
+                    results[index]['error'] = "Error processing image with model."
+                continue
+            for (index, _), output in zip(chunk, outputs):
+                results[index].update(result=output['result'], confidence=output['confidence'], crop=output['crop'])
+            continue
+
+        try:
+            predictions = predict_cached(model_wrapper, batch, model_wrapper.predict)
+        except Exception as e:
+            print(f"Batch prediction error: {str(e)}")
+            for index, _ in chunk:
+                results[index]['error'] = "Error processing image with model."
+            continue
+
+        for row, (index, _) in enumerate(chunk):
+            result, max_probability = interpret_prediction(predictions[row])
+            results[index]['result'] = result
+            results[index]['confidence'] = max_probability
+
+    disease_counts = Counter(item['result'] for item in results if item['result'] is not None)
+    summary = {
+        'total_images': len(results),
+        'processed': sum(disease_counts.values()),
+        'failed': len(results) - sum(disease_counts.values()),
+        'disease_counts': dict(disease_counts.most_common()),
+    }
+    return results, summary
+
+
+def process_image(image_file, content_digest=None, crop_type=None, user_key=None):
+    """
+    Classify one uploaded image without writing it to disk.
+
+    image_file is an UploadedFile (in memory or spooled to a temporary file)
+    or any binary file object; it is decoded straight from its buffer.
+    content_digest, the SHA-256 of the raw upload recorded by
+    StreamingImageUploadHandler, lets a byte-identical re-upload skip decoding.
+    crop_type, when the user named the crop, is used by crop routing
+    (CROP_ROUTING_ENABLED). user_key, the signed-in user's id, puts the
+    user in the candidate model's canary (CANARY_PERCENT) or not.
+    Returns (result, max_probability, model_version), model_version being
+    the version of the model that classified the image ('' if none did).
+    """
+    if crop_router.enabled:
+        routed = predict_routed(image_file, crop_type)
+        return routed['result'], routed['confidence'], routed['model_version'] or ''
+
+    model_wrapper = serving_wrapper(user_key)
+    model_version = model_wrapper.version() or ''
+    if content_digest and model_wrapper.model_type is not None:
+        cached = prediction_cache.lookup_upload(content_digest, prediction_namespace(model_wrapper))
+        if cached is not None:
+            return (*interpret_prediction(cached), model_version)
+
+    image_array = np.expand_dims(load_image_array(image_file), axis=0)
+
+    # Selfies, screenshots and the like never reach the classifier
+    if not leaf_gate.check(image_array[0], getattr(image_file, 'name', ''))[0]:
+        return not_a_leaf, 0.0, ''
 
     # Check if model is available
     if model_wrapper.model_type is None:
-        return "Model not available. Please check model loading.", [full_path, compressed_path]
+        return "Model not available. Please check model loading.", 0.0, ''
 
+    max_probability = 0.0
     try:
-        prediction = model_wrapper.predict(image_array)
-
-        # Handle different output formats
-        if isinstance(prediction, np.ndarray):
-            if len(prediction.shape) > 1:
-                pred_index = np.argmax(prediction)
-                max_probability = prediction[0][pred_index] if len(prediction.shape) > 1 else prediction[pred_index]
-            else:
-                pred_index = np.argmax(prediction)
-                max_probability = prediction[pred_index]
-        else:
-            # Handle PyTorch tensor output
-            prediction = prediction.detach().numpy() if hasattr(prediction, 'detach') else np.array(prediction)
-            pred_index = np.argmax(prediction)
-            max_probability = prediction[0][pred_index] if len(prediction.shape) > 1 else prediction[pred_index]
-
-        result = (
-            "Provided image doesn’t seem to be a crop leaf."
-            if max_probability < 0.5
-            else disease_class[pred_index]
-            if pred_index < len(disease_class)
-            else "Provided image doesn’t seem to be a crop leaf."
-        )
+        prediction = predict_cached(model_wrapper, image_array)
+        prediction_cache.store_upload(content_digest, prediction[0], prediction_namespace(model_wrapper))
+        result, max_probability = interpret_prediction(prediction[0])
 
     except Exception as e:
         print(f"Prediction error: {str(e)}")
         result = "Error processing image with model."
+        model_version = ''
+
+    return result, max_probability, model_version
+
+
+def serving_wrapper(user_key=None):
+    """The ModelWrapper that classifies for a user: the canary candidate, or the registry's model"""
+    return candidate_evaluator.canary_wrapper(user_key) or model_registry.get()
+
+
+def record_prediction(user, result, confidence, model_version, image_path=''):
+    """
+    Save a signed-in user's prediction to PredictionHistory.
+
+    model_version is the version returned with the prediction, so the row
+    names the model that actually classified the image even across a hot
+    swap or for a canary user. Returns the row, or None when the user is
+    anonymous or result is not a known disease.
+    """
+    from app.models import Disease, PredictionHistory
+
+    if user is None or not user.is_authenticated:
+        return None
+    disease = Disease.objects.filter(name=result).first()
+    if disease is None:
+        return None
+    try:
+        return PredictionHistory.objects.create(
+            user=user,
+            disease=disease,
+            confidence_score=float(confidence),
+            image_path=image_path or '',
+            crop_type=crop_router.crop_of(result) or '',
+            model_version=model_version or '',
+        )
+    except Exception as e:
+        print(f"Error saving prediction history: {str(e)}")
+        return None
+
+
+def predict_routed(image_file, crop_type=None):
+    """
+    Classify one upload through crop_router (crop first, then that crop's head).
+
+    Returns the router's output dict; result is not_a_leaf when the leaf gate
+    rejects the image, and an error message when prediction fails.
+    """
+    image_array = np.expand_dims(load_image_array(image_file), axis=0)
+    if not leaf_gate.check(image_array[0], getattr(image_file, 'name', ''))[0]:
+        return {'result': not_a_leaf, 'confidence': 0.0, 'crop': None, 'crop_confidence': None,
+                'crop_source': None, 'route': None, 'model_version': None}
+    try:
+        return crop_router.predict(image_array, [crop_type])[0]
+    except Exception as e:
+        print(f"Routed prediction error: {str(e)}")
+        return {'result': "Error processing image with model.", 'confidence': 0.0, 'crop': None,
+                'crop_confidence': None, 'crop_source': None, 'route': None, 'model_version': None}
+
+
+def predict_upload_response(image_file, content_digest=None, crop_type=None, user_key=None):
+    """
+    Classify one upload and build the /api/predict/ response body.
+
+    Shared by the synchronous endpoint and run_prediction_worker. Returns
+    (response_data, cacheable, served); cacheable is True only when the model
+    produced a usable prediction, and served then holds its confidence and
+    the model_version of the model that made it, for PredictionHistory.
+    With crop routing enabled the response also says which crop the image
+    was routed to and how.
+
+    user_key (the user id) decides the candidate model's canary; uploads
+    served by the primary model are sampled for shadow evaluation
+    (app.model_evaluation) once their response is ready. Routed uploads get
+    neither: crop_router picks their model.
+    """
+    response_data = {
+        'result': 'Prediction completed successfully',
+        'treatments': [],
+        'preventions': [],
+        'disease_info': {
+            'name': 'Healthy Plant',
+            'has_treatments': False,
+            'has_preventions': False,
+            'image_path': ''
+        }
+    }
+    cacheable = False
+    served = {'confidence': 0.0, 'model_version': ''}
+
+    if crop_router.enabled:
+        candidate_evaluator.bypassed()
+        try:
+            routed = predict_routed(image_file, crop_type)
+        except Exception as e:
+            print(f"Image processing error: {str(e)}")
+            response_data['result'] = 'Error processing image'
+            return response_data, False, served
+        response_data['result'] = routed['result']
+        response_data['crop'] = {key: routed[key] for key in ('crop', 'crop_confidence', 'crop_source', 'route')}
+        if routed['route'] is not None and routed['result'] != not_a_leaf:
+            response_data['disease_info']['name'] = routed['result']
+            print(f"Routed prediction: {routed['result']} (crop {routed['crop']}, via {routed['route']}, "
+                  f"confidence: {routed['confidence']})")
+            served.update(confidence=routed['confidence'], model_version=routed['model_version'] or '')
+            cacheable = True
+        return response_data, cacheable, served
+
+    # A byte-identical re-upload is answered without decoding it again
+    canary_wrapper = candidate_evaluator.canary_wrapper(user_key)
+    model_wrapper = canary_wrapper or model_registry.get()
+    prediction = None
+    if model_wrapper.model_type is not None:
+        cached = prediction_cache.lookup_upload(content_digest, prediction_namespace(model_wrapper))
+        if cached is not None:
+            prediction = np.expand_dims(cached, axis=0)
+
+    # Decode straight from the upload buffer; nothing is written to disk
+    try:
+        if prediction is None:
+            image_array = np.expand_dims(load_image_array(image_file), axis=0)
+            print("Image processed successfully")
+
+            if not leaf_gate.check(image_array[0], getattr(image_file, 'name', ''))[0]:
+                response_data['result'] = not_a_leaf
+                return response_data, False, served
+
+        # Try to use ML model if available
+        try:
+            if model_wrapper.model_type is not None:
+                if prediction is None:
+                    start = time.perf_counter()
+                    prediction = predict_cached(model_wrapper, image_array)
+                    latency_ms = (time.perf_counter() - start) * 1000.0
+                    prediction_cache.store_upload(
+                        content_digest, prediction[0], prediction_namespace(model_wrapper)
+                    )
+                    # Off the request path: the candidate runs on a background thread
+                    if canary_wrapper is None:
+                        candidate_evaluator.shadow(image_array, prediction[0], model_wrapper.version(), latency_ms)
+
+                if isinstance(prediction, np.ndarray) and len(prediction.shape) > 1:
+                    pred_index = np.argmax(prediction)
+                    max_probability = prediction[0][pred_index]
+
+                    if pred_index < len(disease_class):
+                        predicted_disease = disease_class[pred_index]
+                        response_data['result'] = predicted_disease
+                        response_data['disease_info']['name'] = predicted_disease
+                        print(f"ML prediction: {predicted_disease} (confidence: {max_probability})")
+                        served.update(confidence=float(max_probability), model_version=model_wrapper.version() or '')
+                        cacheable = True
+                    else:
+                        print("Prediction index out of range")
+                else:
+                    print("Invalid prediction format")
+            else:
+                print("ML model not available, using fallback")
+        except Exception as e:
+            print(f"ML prediction error: {str(e)}")
+
+    except Exception as e:
+        print(f"Image processing error: {str(e)}")
+        response_data['result'] = 'Error processing image'
+
+    return response_data, cacheable, served
+
+
+_archive_executor = None
+
+
+def archive_upload(image_file):
+    """
+    Keep a copy of an uploaded original when ARCHIVE_UPLOADS is enabled.
+
+    The write to default_storage happens on a background thread so it never
+    delays the response. Returns the storage name the file will be saved
+    under, or None when archiving is disabled.
+    """
+    global _archive_executor
+
+    if os.getenv('ARCHIVE_UPLOADS', 'false').lower() != 'true':
+        return None
+
+    extension = os.path.splitext(getattr(image_file, 'name', '') or '')[1].lower() or '.jpg'
+    archive_name = f"{os.getenv('ARCHIVE_UPLOADS_DIR', 'uploads')}/{uuid.uuid4()}{extension}"
+
+    image_file.seek(0)
+    content = image_file.read()
+
+    def save():
+        try:
+            default_storage.save(archive_name, ContentFile(content))
+        except Exception as e:
+            print(f"Error archiving upload {archive_name}: {str(e)}")
 
-    return result, max_probability, [full_path, compressed_path]
\ No newline at end of file
+    if _archive_executor is None:
+        _archive_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='upload-archiver')
+    _archive_executor.submit(save)
+    return archive_name
@@ -2,7 +2,6 @@ import os
 import io
 import json
 import uuid
-import tensorflow as tf
 from urllib.parse import quote
 from datetime import datetime, timedelta
 from django.urls import reverse
@@ -17,14 +16,16 @@ from django.http import HttpResponseForbidden , HttpResponse
 from django.shortcuts import render , redirect , get_object_or_404
 from app.forms import RegistrationForm , ProfileEditForm , ContactForm
 from django.contrib.auth import  login as auth_login , authenticate , logout
-from app.utils import anonymous_required , crop , developers , disease_class, small_image_size, under_maintenance , process_image
+from app.utils import anonymous_required , crop , developers , disease_class, small_image_size, under_maintenance , process_image , predict_images , archive_upload
 from rest_framework.decorators import api_view, permission_classes
+from app.upload_handlers import stream_image_uploads, upload_rejection, upload_digest
+from app.admission import admission_controlled
+from app.crop_routing import crop_router
+from django.utils.decorators import method_decorator
 from rest_framework.permissions import AllowAny
 from django.views.decorators.csrf import csrf_exempt
 from rest_framework.response import Response
 
-tf.config.set_visible_devices([], 'GPU') # i have to comment down before deployement
-
 
 
 # @anonymous_required
@@ -49,37 +50,60 @@ tf.config.set_visible_devices([], 'GPU') # i have to comment down before deploye
 
 #     return render(request, 'auth/register.html', {'form': form})
 
-from tensorflow.keras.models import load_model
-import torch
-from django.conf import settings
-
-# Load models once when views.py is imported
-tf_model = None
-pt_model = None
-
-try:
-    tf_model = load_model(settings.TF_MODEL_FILE)
-    print("TensorFlow model loaded successfully")
-except Exception as e:
-    print(f"Warning: Could not load TensorFlow model: {e}")
-    tf_model = None
-
-try:
-    pt_model = torch.load(settings.PT_MODEL_FILE, map_location="cpu")
-    print("PyTorch model loaded successfully")
-except Exception as e:
-    print(f"Warning: Could not load PyTorch model: {e}")
-    pt_model = None
+# Models are loaded lazily through app.model.model_registry on first use
 
 # Example view
 from rest_framework.response import Response
 from rest_framework.decorators import api_view
 
+@admission_controlled()
+@stream_image_uploads()
 @csrf_exempt
 def predict_simple(request):
-    """Robust prediction endpoint with comprehensive error handling"""
+    """
+    Robust prediction endpoint with comprehensive error handling.
+
+    Signed-in clients on unreliable connections can send an Idempotency-Key
+    header; a retry carrying the same key and the same image gets the stored
+    response back without the image being classified again. Reusing a key
+    for a different image is answered with 422. Anonymous requests share no
+    identity a key could be scoped to, so the header is ignored for them.
+
+    With a 'Prefer: respond-async' header or ?async=true (or an upload of at
+    least PREDICT_ASYNC_MIN_MB) the image is queued as a PredictionJob and
+    the response is 202 with the job id; the result is then fetched from
+    /api/predict/jobs/<job_id>/.
+    """
     try:
         from django.http import JsonResponse
+        from app.prediction_cache import prediction_cache
+
+        idempotency_key = None
+        request_digest = None
+        cacheable = False
+
+        # Reading request.FILES runs StreamingImageUploadHandler over the body
+        if request.method == 'POST' and request.FILES is not None:
+            rejection = upload_rejection(request)
+            if rejection:
+                return JsonResponse({'error': rejection['error'], 'result': 'Upload rejected'},
+                                    status=rejection['status'])
+
+            if request.headers.get('Idempotency-Key') and request.user.is_authenticated:
+                idempotency_key = f"predict:{request.user.pk}:{request.headers['Idempotency-Key'].strip()[:128]}"
+                request_digest = upload_digest(request, 'image')
+                stored = prediction_cache.get_response(idempotency_key)
+                if stored is not None:
+                    if stored['request_digest'] != request_digest:
+                        return JsonResponse({
+                            'error': 'Idempotency-Key was already used for a different image',
+                            'result': 'Upload rejected',
+                        }, status=422)
+                    # A retried async submission gets the same job back
+                    replayed = stored['response']
+                    response = JsonResponse(replayed, status=202 if 'job_id' in replayed else 200)
+                    response['Idempotent-Replayed'] = 'true'
+                    return response
 
         # Basic response structure
         response_data = {
@@ -100,66 +124,47 @@ def predict_simple(request):
                 image_file = request.FILES['image']
                 print(f"Received image: {image_file.name}, size: {image_file.size}")
 
-                # Save image temporarily
-                from django.core.files.storage import default_storage
-                import uuid
-                from PIL import Image
-                import numpy as np
-
-                # Generate unique filename
-                original_filename = f"{uuid.uuid4()}.jpg"
-                saved_path = default_storage.save(original_filename, image_file)
-                full_path = default_storage.path(saved_path)
-
-                print(f"Saved image to: {full_path}")
-
-                # Process image
-                try:
-                    image = Image.open(full_path).convert("RGB")
-                    image_resized = image.resize((256, 256), Image.LANCZOS)
-                    print("Image processed successfully")
-
-                    # Try to use ML model if available
-                    try:
-                        from app.model import model_wrapper
-                        if model_wrapper.model_type is not None:
-                            image_array = np.expand_dims(np.array(image_resized), axis=0)
-                            prediction = model_wrapper.predict(image_array)
-
-                            if isinstance(prediction, np.ndarray) and len(prediction.shape) > 1:
-                                pred_index = np.argmax(prediction)
-                                max_probability = prediction[0][pred_index]
-
-                                from app.utils import disease_class
-                                if pred_index < len(disease_class):
-                                    predicted_disease = disease_class[pred_index]
-                                    response_data['result'] = predicted_disease
-                                    response_data['disease_info']['name'] = predicted_disease
-                                    print(f"ML prediction: {predicted_disease} (confidence: {max_probability})")
-                                else:
-                                    print("Prediction index out of range")
-                            else:
-                                print("Invalid prediction format")
-                        else:
-                            print("ML model not available, using fallback")
-                    except Exception as e:
-                        print(f"ML prediction error: {str(e)}")
-
-                except Exception as e:
-                    print(f"Image processing error: {str(e)}")
-                    response_data['result'] = 'Error processing image'
-
-                # Clean up
-                try:
-                    if default_storage.exists(saved_path):
-                        default_storage.delete(saved_path)
-                except Exception as e:
-                    print(f"Cleanup error: {str(e)}")
+                from app.jobs import wants_async, submit_job, job_response, job_payload_rejection
+
+                # Queue the upload and answer straight away; the client polls the job
+                if wants_async(request, [image_file]):
+                    from app.utils import archive_upload
+
+                    too_large = job_payload_rejection([image_file])
+                    if too_large:
+                        return JsonResponse({'error': too_large, 'result': 'Upload rejected'}, status=413)
+
+                    job = submit_job([image_file], user=request.user,
+                                     content_digests=[upload_digest(request, 'image')],
+                                     crop_type=request.POST.get('crop_type'))
+                    archive_upload(image_file)
+                    status_url = reverse('api_predict_job', args=[job.pk])
+                    response_data = job_response(job, status_url)
+                    if idempotency_key:
+                        prediction_cache.store_response(idempotency_key, response_data, request_digest)
+                    response = JsonResponse(response_data, status=202)
+                    response['Location'] = status_url
+                    return response
+
+                from app.utils import predict_upload_response, archive_upload, record_prediction
+
+                response_data, cacheable, served = predict_upload_response(
+                    image_file, content_digest=upload_digest(request, 'image'),
+                    crop_type=request.POST.get('crop_type'),
+                    user_key=request.user.pk if request.user.is_authenticated else None,
+                )
+                archive_name = archive_upload(image_file)
+                if cacheable:
+                    record_prediction(request.user, response_data['result'], served['confidence'],
+                                      served['model_version'], image_path=archive_name)
 
             except Exception as e:
                 print(f"File handling error: {str(e)}")
                 response_data['result'] = 'Error handling uploaded file'
 
+        if idempotency_key and cacheable:
+            prediction_cache.store_response(idempotency_key, response_data, request_digest)
+
         return JsonResponse(response_data)
 
     except Exception as e:
@@ -181,6 +186,57 @@ def predict_simple(request):
         }, status=500)
 
 
+@admission_controlled()
+@stream_image_uploads(max_files=int(os.getenv('PREDICT_BATCH_MAX_IMAGES', '200')))
+@api_view(['POST'])
+def predict_batch(request):
+    """
+    Classify many leaf photos uploaded in one multipart request.
+
+    Send each photo under the 'images' field. Returns a result per image in
+    upload order plus a summary of disease counts for the whole batch.
+    Large batches can be queued as a job the same way as /api/predict/.
+    """
+    try:
+        image_files = request.FILES.getlist('images')
+        rejection = upload_rejection(request)
+        if rejection:
+            return Response({'error': rejection['error']}, status=rejection['status'])
+        if not image_files:
+            return Response({'error': 'No images provided'}, status=400)
+
+        max_images = int(os.getenv('PREDICT_BATCH_MAX_IMAGES', '200'))
+        if len(image_files) > max_images:
+            return Response({
+                'error': f'Too many images: {len(image_files)} uploaded, at most {max_images} allowed per request'
+            }, status=400)
+
+        from app.jobs import wants_async, submit_job, job_response, job_payload_rejection
+
+        if wants_async(request, image_files):
+            too_large = job_payload_rejection(image_files)
+            if too_large:
+                return Response({'error': too_large}, status=413)
+            job = submit_job(image_files, kind='batch', user=request.user,
+                             content_digests=[upload_digest(request, 'images', index)
+                                              for index in range(len(image_files))],
+                             crop_type=request.data.get('crop_type'))
+            status_url = reverse('api_predict_job', args=[job.pk])
+            return Response(job_response(job, status_url), status=202, headers={'Location': status_url})
+
+        results, summary = predict_images(image_files, crop_type=request.data.get('crop_type'))
+
+        return Response({
+            'results': results,
+            'summary': summary
+        })
+
+    except Exception as e:
+        print(f"Batch predict endpoint error: {str(e)}")
+        return Response({
+            'error': f'Batch prediction failed: {str(e)}'
+        }, status=500)
+
 
 @anonymous_required
 def register_view(request):
@@ -372,8 +428,9 @@ def home(request):
     try:
         filename = request.session.pop('uploaded_image_name', None)
         if filename and default_storage.exists(filename):
-            full_path = default_storage.path(filename)
-            result, temp_files = process_image(full_path)
+            with default_storage.open(filename, 'rb') as image_file:
+                result, _, _ = process_image(image_file)
+            temp_files.append(filename)
 
         elif request.method == "POST" and "image" in request.FILES:
             image_file = request.FILES["image"]
@@ -581,8 +638,9 @@ def uploads(request):
         # Step 1: Handle GET after redirect
         filename = request.session.pop('uploaded_image_name', None)
         if filename and default_storage.exists(filename):
-            full_path = default_storage.path(filename)
-            result, _, temp_files = process_image(full_path)
+            with default_storage.open(filename, 'rb') as image_file:
+                result, _, _ = process_image(image_file)
+            temp_files.append(filename)
 
         # Step 2: Handle POST and then redirect
         elif request.method == "POST" and "image" in request.FILES:
@@ -713,6 +771,7 @@ from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
 
+@method_decorator(admission_controlled(), name='post')
 class PredictView(APIView):
     permission_classes = [AllowAny]
 
@@ -731,21 +790,16 @@ class PredictView(APIView):
         try:
             result = None
             max_probability = 0.0
+            model_version = ''
             original_filename = ""
 
             if 'image' in request.FILES:
                 image_file = request.FILES['image']
-                original_filename = f"{uuid.uuid4()}.jpg"
-                saved_path = default_storage.save(original_filename, image_file)
-                full_path = default_storage.path(saved_path)
-                result, max_probability, temp_files = process_image(full_path)
-
-                # Clean up temporary files
-                for temp in temp_files:
-                    if default_storage.exists(temp):
-                        default_storage.delete(temp)
-                if default_storage.exists(saved_path):
-                    default_storage.delete(saved_path)
+                result, max_probability, model_version = process_image(
+                    image_file, crop_type=request.data.get('crop_type'),
+                    user_key=request.user.pk if request.user.is_authenticated else None,
+                )
+                original_filename = archive_upload(image_file) or ""
             else:
                 return Response({'error': 'No image provided'}, status=400)
 
@@ -766,7 +820,8 @@ class PredictView(APIView):
                                     disease=disease,
                                     confidence_score=float(max_probability),
                                     image_path=original_filename,
-                                    crop_type=result.split()[0] if result else None
+                                    crop_type=crop_router.crop_of(result) or '',
+                                    model_version=model_version,
                                 )
                             except Exception as e:
                                 print(f"Error saving prediction history: {str(e)}")
@@ -1388,29 +1443,94 @@ def mandi_locations(request):
             'error': f'Error retrieving mandi locations: {str(e)}'
         }, status=500)
 
+@admission_controlled()
+@stream_image_uploads()
 @api_view(['POST'])
-def verify_product_quality(request):
+def predict_leaves(request):
     """
-    AI-powered quality verification for marketplace products
+    Classify every leaf in a field photo separately.
+
+    Leaves are found by the YOLO leaf detector, cropped and classified in one
+    batch, and summarised per image (counts per disease, dominant result).
+    Falls back to classifying the whole frame when no detector is installed
+    or no leaf is found; 'mode' in the response says which happened.
     """
     try:
-        if 'image' not in request.FILES:
+        rejection = upload_rejection(request)
+        if rejection:
+            return Response({'error': rejection['error']}, status=rejection['status'])
+        image_file = request.FILES.get('image')
+        if image_file is None:
             return Response({'error': 'No image provided'}, status=400)
 
-        image_file = request.FILES['image']
-        original_filename = f"{uuid.uuid4()}.jpg"
-        saved_path = default_storage.save(original_filename, image_file)
-        full_path = default_storage.path(saved_path)
+        from app.leaf_detection import detect_and_classify
+
+        result = detect_and_classify(image_file)
+        archive_upload(image_file)
+        return Response(result)
+
+    except Exception as e:
+        print(f"Leaf detection endpoint error: {str(e)}")
+        return Response({'error': f'Leaf detection failed: {str(e)}'}, status=500)
+
+
+@admission_controlled()
+@stream_image_uploads(max_size=int(float(os.getenv('TILED_UPLOAD_MAX_SIZE_MB', '200')) * 1024 * 1024))
+@api_view(['POST'])
+def predict_tiles(request):
+    """
+    Classify a high-resolution photo or drone orthomosaic tile by tile.
 
-        # Process image with AI model
-        result, _, temp_files = process_image(full_path)
+    Optional form fields tile_size (pixels, default TILED_TILE_SIZE) and
+    overlap (a fraction in [0, 1), default TILED_OVERLAP). Returns a
+    per-region heat map of disease scores and dominant classes instead of a
+    single label.
+    """
+    try:
+        rejection = upload_rejection(request)
+        if rejection:
+            return Response({'error': rejection['error']}, status=rejection['status'])
+        image_file = request.FILES.get('image')
+        if image_file is None:
+            return Response({'error': 'No image provided'}, status=400)
 
-        # Clean up temporary files
-        for temp in temp_files:
-            if default_storage.exists(temp):
-                default_storage.delete(temp)
-        if default_storage.exists(saved_path):
-            default_storage.delete(saved_path)
+        from app.tiling import classify_tiles
+
+        try:
+            tile_size = request.data.get('tile_size') or None
+            overlap = request.data.get('overlap')
+            result = classify_tiles(
+                image_file,
+                tile_size=int(tile_size) if tile_size else None,
+                overlap=float(overlap) if overlap not in (None, '') else None,
+            )
+        except ValueError as e:
+            return Response({'error': str(e)}, status=400)
+        return Response(result)
+
+    except Exception as e:
+        print(f"Tiled prediction endpoint error: {str(e)}")
+        return Response({'error': f'Tiled prediction failed: {str(e)}'}, status=500)
+
+
+@admission_controlled()
+@stream_image_uploads()
+@api_view(['POST'])
+def verify_product_quality(request):
+    """
+    AI-powered quality verification for marketplace products
+    """
+    try:
+        image_file = request.FILES.get('image')
+        rejection = upload_rejection(request)
+        if rejection:
+            return Response({'error': rejection['error']}, status=rejection['status'])
+        if image_file is None:
+            return Response({'error': 'No image provided'}, status=400)
+
+        # Process image with AI model, decoding it in memory
+        result, _, _ = process_image(image_file, content_digest=upload_digest(request, 'image'))
+        archive_upload(image_file)
 
         # Determine quality grade based on AI result
         quality_grade = 'ungraded'
@@ -1929,34 +2049,155 @@ def get_notification_preferences(request):
 
 
 @api_view(['GET'])
-def health_check(request):
+@permission_classes([AllowAny])
+def prediction_job(request, job_id):
     """
-    Health check endpoint for Render monitoring
+    Status of a queued prediction, with its result once it is done.
+
+    Pass ?wait=<seconds> to long-poll: the request returns as soon as the job
+    finishes, or after at most PREDICT_JOB_MAX_WAIT seconds. Each waiting
+    poll holds a gunicorn thread, so only PREDICT_JOB_MAX_WAITERS per worker
+    wait; the others get the current status and a Retry-After. The job id is
+    random and acts as the access token; jobs disappear once they expire.
     """
+    from app.jobs import wait_for_job, job_response
+
     try:
-        from django.db import connection
-        from app.model import ModelWrapper
+        wait = float(request.GET.get('wait', '0'))
+    except ValueError:
+        return Response({'error': "'wait' must be a number of seconds"}, status=400)
+    wait = max(0.0, min(wait, float(os.getenv('PREDICT_JOB_MAX_WAIT', '10'))))
 
-        # Check database connection
-        cursor = connection.cursor()
-        cursor.execute("SELECT 1")
-        cursor.fetchone()
+    job = wait_for_job(job_id, wait)
+    if job is None:
+        return Response({'error': 'Prediction job not found or expired'}, status=404)
 
-        # Check ML model loading
-        model_wrapper = ModelWrapper()
-        models_loaded = model_wrapper.check_models_loaded()
+    response = Response(job_response(job))
+    if job.status not in ('done', 'failed'):
+        response['Retry-After'] = os.getenv('PREDICT_JOB_POLL_INTERVAL', '2')
+    return response
+
+
+@api_view(['GET'])
+@permission_classes([AllowAny])
+def metrics(request):
+    """
+    Load and cache counters of the worker process that answers.
+
+    'admission' shows in-flight and queued predictions, how many were shed
+    and why, and the latency behind the wait estimate. Every gunicorn worker
+    keeps its own counters, so scrape repeatedly to cover all of them.
+    'candidate' shows the shadow and canary evaluation of MODEL_CANDIDATE_VERSION.
+    """
+    from app.admission import admission_controller
+    from app.prediction_cache import prediction_cache
+    from app.leaf_gate import leaf_gate
+    from app.inference_threads import thread_settings
+    from app.model import model_registry
+    from app.model_evaluation import candidate_evaluator
+
+    return Response({
+        'admission': admission_controller.stats(),
+        'prediction_cache': prediction_cache.stats(),
+        'leaf_gate': leaf_gate.stats(),
+        'model': model_registry.status(),
+        'threads': thread_settings(),
+        'crop_routing': crop_router.stats(),
+        'candidate': candidate_evaluator.stats(),
+        'timestamp': datetime.now().isoformat(),
+    })
 
-        return Response({
-            'status': 'healthy',
-            'database': 'connected',
-            'ml_models': 'loaded' if models_loaded else 'loading',
-            'timestamp': datetime.now().isoformat(),
-            'version': '1.0.0'
-        })
 
+def database_reachable():
+    """Run a trivial query; returns (True, None) or (False, error message)"""
+    from django.db import connection
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT 1")
+            cursor.fetchone()
+        return True, None
     except Exception as e:
+        return False, str(e)
+
+
+@api_view(['GET'])
+def health_check(request):
+    """
+    Health check endpoint for Render monitoring
+    """
+    from app.model import model_registry
+
+    db_ok, db_error = database_reachable()
+    if not db_ok:
         return Response({
             'status': 'unhealthy',
-            'error': str(e),
+            'error': db_error,
             'timestamp': datetime.now().isoformat()
         }, status=503)
+
+    # Report the model state the registry already holds; never load here
+    model_status = model_registry.status()
+    return Response({
+        'status': 'healthy',
+        'database': 'connected',
+        'ml_models': 'loaded' if model_status['state'] == 'ready' else model_status['state'],
+        'timestamp': datetime.now().isoformat(),
+        'version': '1.0.0'
+    })
+
+
+@api_view(['GET'])
+@permission_classes([AllowAny])
+def liveness(request):
+    """
+    Liveness probe: the process is up and serving requests.
+    Touches neither the database nor the models.
+    """
+    return Response({'status': 'alive', 'timestamp': datetime.now().isoformat()})
+
+
+@api_view(['GET'])
+@permission_classes([AllowAny])
+def readiness(request):
+    """
+    Readiness probe: the worker can serve predictions.
+
+    Returns 503 while the models are still loading or warming up, or when the
+    database is unreachable. A worker whose models have not started loading
+    kicks off a background load and reports 'loading'. If loading finished
+    without a usable model the worker is reported ready but 'degraded', since
+    waiting will not change that.
+    """
+    from app.model import model_registry
+
+    model_status = model_registry.status()
+    if model_status['state'] == 'not_loaded':
+        model_registry.load_in_background()
+        model_status = model_registry.status()
+
+    db_ok, db_error = database_reachable()
+    state = model_status['state']
+
+    if not db_ok:
+        status_label = 'unavailable'
+    elif state == 'ready':
+        status_label = 'ready'
+    elif state == 'failed':
+        status_label = 'degraded'
+    else:
+        status_label = 'loading'
+
+    return Response({
+        'status': status_label,
+        'database': 'connected' if db_ok else 'unreachable',
+        'database_error': db_error,
+        'model': {
+            'state': state,
+            'backend': model_status['backend'],
+            'model_type': model_status.get('model_type'),
+            'model_version': model_status.get('model_version'),
+            'warmed_up': model_status.get('warmed_up', False),
+            'load_seconds': model_status.get('load_seconds'),
+        },
+        'timestamp': datetime.now().isoformat(),
+    }, status=200 if status_label in ('ready', 'degraded') else 503)
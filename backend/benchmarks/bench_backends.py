@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+"""
+Compare inference latency of every available ModelWrapper backend.
+
+Each backend is loaded in its own process (MODEL_BACKEND=<name>) so that
+frameworks do not share thread pools or memory. Backends that fail to load
+are reported as unavailable rather than silently using the fallback.
+
+Usage:
+    python benchmarks/bench_backends.py [--backends tensorflow,onnx,tflite,torchscript] [--runs 30]
+"""
+import os
+import sys
+import json
+import argparse
+import subprocess
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(BACKEND_DIR)
+
+BATCH_SIZES = (1, 8)
+
+
+def run_backend(backend, runs):
+    """Measure one backend inside this process and print the result as JSON"""
+    os.environ['MODEL_BACKEND'] = backend
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'CropLeaf.settings')
+
+    import numpy as np
+    from app.memory import rss_mb
+    from app.model import ModelWrapper
+    from app.model_conversion import measure_latency
+
+    baseline = rss_mb()
+    wrapper = ModelWrapper()
+    if wrapper.model_type != backend:
+        print(json.dumps({'backend': backend, 'available': False, 'loaded': wrapper.model_type}))
+        return
+
+    result = {'backend': backend, 'available': True, 'rss_mb': rss_mb() - baseline, 'latency_ms': {}}
+    for batch_size in BATCH_SIZES:
+        batch = np.random.randint(0, 256, size=(batch_size, 256, 256, 3), dtype=np.uint8)
+        result['latency_ms'][batch_size] = measure_latency(wrapper.predict, batch, runs=runs)
+    print(json.dumps(result))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--backends', default='tensorflow,onnx,tflite,torchscript')
+    parser.add_argument('--runs', type=int, default=30)
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_backend(args.child, args.runs)
+        return
+
+    print(f"{'backend':14}{'batch':>7}{'p50 ms':>10}{'p95 ms':>10}{'ms/image':>10}{'RSS MB':>10}")
+    for backend in args.backends.split(','):
+        output = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), '--child', backend, '--runs', str(args.runs)],
+            capture_output=True, text=True, cwd=BACKEND_DIR,
+        ).stdout.strip().splitlines()
+        result = json.loads(output[-1]) if output else {'available': False, 'loaded': None}
+
+        if not result['available']:
+            print(f"{backend:14}  unavailable (loaded: {result.get('loaded')})")
+            continue
+
+        for batch_size, latency in result['latency_ms'].items():
+            print(f"{backend:14}{batch_size:>7}{latency['p50_ms']:>10.1f}{latency['p95_ms']:>10.1f}"
+                  f"{latency['p50_ms'] / int(batch_size):>10.1f}{result['rss_mb']:>10.0f}")
+
+
+if __name__ == '__main__':
+    main()
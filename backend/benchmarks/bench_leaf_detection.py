@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+"""
+Measure the multi-leaf path: detection, cropping and batched classification.
+
+The crop+classify stage is timed for --crops leaves per photo using a grid of
+synthetic boxes, so it can be sized even without detector weights. When the
+leaf detector is installed (LEAF_DETECTOR_MODEL), the detection stage is
+timed on the same photos. Each row is checked against LEAF_DETECTION_BUDGET_MS
+(or --budget-ms).
+
+Usage:
+    python benchmarks/bench_leaf_detection.py [--crops 1,4,8,16] [--runs 10] [--backend pytorch]
+    python benchmarks/bench_leaf_detection.py --images path/to/field/photos
+"""
+import os
+import sys
+import time
+import argparse
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(BACKEND_DIR)
+
+
+def grid_boxes(image, count):
+    """count boxes laid out on a grid over the image, like leaves spread across a photo"""
+    columns = int(count ** 0.5 + 0.999)
+    rows = (count + columns - 1) // columns
+    width, height = image.size[0] / columns, image.size[1] / rows
+    return [
+        (column * width, row * height, (column + 1) * width, (row + 1) * height, 1.0)
+        for row in range(rows) for column in range(columns)
+    ][:count]
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--backend', default='', help='MODEL_BACKEND to classify with')
+    parser.add_argument('--images', help='Folder of field photos (default: one synthetic 12 MP photo)')
+    parser.add_argument('--crops', default='1,4,8,16')
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--budget-ms', type=float, default=float(os.getenv('LEAF_DETECTION_BUDGET_MS', '1500')))
+    args = parser.parse_args()
+
+    os.environ['PREDICTION_CACHE_ENABLED'] = 'false'
+    os.environ['PREDICT_BATCHING_ENABLED'] = 'false'
+    import numpy as np
+    from app.model import model_registry
+    from app.leaf_detection import leaf_detector, crop_leaf, open_field_photo
+
+    model_wrapper = model_registry.get(args.backend or None)
+    if model_wrapper.model_type is None:
+        sys.exit("No classifier could be loaded; timings would be meaningless")
+    model_wrapper.warmup()
+
+    if args.images:
+        from app.model_conversion import find_sample_images
+        paths = find_sample_images(args.images)
+    else:
+        from bench_preprocessing import make_photo
+        import tempfile
+        paths = [make_photo(os.path.join(tempfile.mkdtemp(), 'field.jpg'), 12.0)]
+
+    photos = []
+    decode_ms = []
+    for path in paths:
+        with open(path, 'rb') as f:
+            start = time.perf_counter()
+            photos.append(open_field_photo(f))
+            decode_ms.append((time.perf_counter() - start) * 1000.0)
+    print(f"{len(photos)} photo(s), classifier {model_wrapper.model_type}, budget {args.budget_ms:.0f} ms")
+    print(f"decode p50 {percentile(decode_ms, 0.5):.1f} ms")
+
+    detect_ms = 0.0
+    if leaf_detector.available():
+        timings = []
+        for _ in range(args.runs):
+            for photo in photos:
+                start = time.perf_counter()
+                boxes = leaf_detector.detect(photo)
+                timings.append((time.perf_counter() - start) * 1000.0)
+        detect_ms = percentile(timings, 0.5)
+        print(f"detect p50 {detect_ms:.1f} ms, p99 {percentile(timings, 0.99):.1f} ms "
+              f"({len(boxes)} leaves in the last photo)")
+    else:
+        print("detector not available; timing crop+classify only")
+
+    print(f"{'crops':>6}{'crop ms':>10}{'classify ms':>13}{'p99 ms':>9}{'ms/leaf':>9}{'total ms':>10}  budget")
+    for count in [int(value) for value in args.crops.split(',')]:
+        crop_timings, classify_timings = [], []
+        for _ in range(args.runs):
+            for photo in photos:
+                start = time.perf_counter()
+                batch = np.stack([crop_leaf(photo, box) for box in grid_boxes(photo, count)], axis=0)
+                crop_timings.append((time.perf_counter() - start) * 1000.0)
+
+                start = time.perf_counter()
+                model_wrapper.predict(batch)
+                classify_timings.append((time.perf_counter() - start) * 1000.0)
+
+        crop_p50 = percentile(crop_timings, 0.5)
+        classify_p50 = percentile(classify_timings, 0.5)
+        total = percentile(decode_ms, 0.5) + detect_ms + crop_p50 + classify_p50
+        print(f"{count:>6}{crop_p50:>10.1f}{classify_p50:>13.1f}{percentile(classify_timings, 0.99):>9.1f}"
+              f"{classify_p50 / count:>9.1f}{total:>10.1f}  {'ok' if total <= args.budget_ms else 'OVER'}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,204 @@
+#!/usr/bin/env python
+"""
+Calibrate the leaf gate (app.leaf_gate) on labelled leaf and non-leaf images.
+
+Every image is decoded and resized the way uploads are, then scored with
+LeafGate.leaf_ratio using the LEAF_GATE_* settings (the flags below override
+them). The report lists the lowest-scoring leaves and highest-scoring
+non-leaves, the false reject / false accept rates for a range of
+LEAF_GATE_MIN_RATIO values, and a recommended threshold: the middle of the gap
+between the two classes when they separate, otherwise the threshold with the
+fewest errors, and never above the lowest leaf score divided by --leaf-margin.
+A small labelled set understates how little of a real upload a leaf can fill,
+so wrongly rejecting a leaf is treated as the costlier mistake.
+
+The default leaf set is the reference crop photos in app/static/images/crops,
+each also scored darkened (shade, underexposure) and shrunk onto a grey
+background (a leaf filling less of the frame). The default non-leaf set is the
+site assets that are not plant illustrations plus synthetic skin, documents,
+screenshots, sky, soil, wood and concrete.
+
+Usage:
+    python benchmarks/bench_leaf_gate.py
+    python benchmarks/bench_leaf_gate.py --leaves path/to/leaves --non-leaves path/to/other
+    LEAF_GATE_MIN_HUE=40 python benchmarks/bench_leaf_gate.py
+"""
+import io
+import os
+import sys
+import argparse
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(BACKEND_DIR)
+
+REFERENCE_LEAVES = os.path.join(BACKEND_DIR, 'app', 'static', 'images', 'crops')
+REFERENCE_NON_LEAVES = [
+    os.path.join(BACKEND_DIR, 'app', 'static', 'images', 'assets', name)
+    for name in ('auth.png', 'bg-img.jpg', 'emoji.png', 'profile.jpg')
+]
+
+
+def encode(pixels):
+    """JPEG bytes of a uint8 array, so synthetic images go through the same decoder as uploads"""
+    from PIL import Image
+
+    buffer = io.BytesIO()
+    Image.fromarray(pixels).save(buffer, 'JPEG', quality=90)
+    buffer.name = 'synthetic.jpg'
+    return buffer
+
+
+def leaf_variants(image_array):
+    """A leaf photo darkened and shrunk onto a grey background, as in poorer field shots"""
+    import numpy as np
+
+    darkened = (image_array.astype(np.float32) * 0.6).astype(np.uint8)
+
+    height, width = image_array.shape[:2]
+    small = image_array[::2, ::2]
+    padded = np.full_like(image_array, 128)
+    top, left = (height - small.shape[0]) // 2, (width - small.shape[1]) // 2
+    padded[top:top + small.shape[0], left:left + small.shape[1]] = small
+    return {'dark': darkened, 'half-size': padded}
+
+
+def synthetic_non_leaves(size=256):
+    """Named uint8 images of the uploads the gate exists to turn away"""
+    import numpy as np
+
+    rng = np.random.default_rng(0)
+
+    def textured(colour, noise=12):
+        pixels = np.asarray(colour, dtype=np.float32) + rng.normal(0, noise, (size, size, 3))
+        return np.clip(pixels, 0, 255).astype(np.uint8)
+
+    images = {}
+    for name, colour in [('light', (255, 224, 189)), ('fair', (234, 192, 134)), ('medium', (224, 172, 105)),
+                         ('tan', (198, 134, 66)), ('dark', (141, 85, 36))]:
+        # A face filling the middle of the frame against an off-white wall
+        face = textured((235, 235, 230))
+        face[32:224, 48:208] = textured(colour)[32:224, 48:208]
+        images[f'skin-{name}'] = face
+
+    document = np.full((size, size, 3), 245, dtype=np.uint8)
+    for top in range(24, size - 16, 14):
+        document[top:top + 5, 20:int(rng.integers(120, size - 20))] = 30
+    images['document'] = document
+
+    screenshot = np.full((size, size, 3), 250, dtype=np.uint8)
+    screenshot[:32] = (33, 150, 243)
+    screenshot[48:200:40, 16:240] = 200
+    screenshot[210:240, 150:240] = (76, 175, 80)
+    images['screenshot'] = screenshot
+
+    sky = np.zeros((size, size, 3), dtype=np.uint8)
+    sky[...] = np.linspace([90, 150, 230], [200, 225, 250], size, dtype=np.float32)[:, None, :].astype(np.uint8)
+    images['sky'] = sky
+
+    images['soil'] = textured((110, 78, 52), noise=20)
+    images['wood'] = textured((160, 110, 70), noise=18)
+    images['concrete'] = textured((150, 150, 148), noise=15)
+    return images
+
+
+def load_set(paths_or_dirs, size):
+    """(name, uint8 array) for every readable image in the given files and folders"""
+    from app.model_conversion import find_sample_images
+    from app.preprocessing import decode_and_resize
+
+    images = []
+    for path in paths_or_dirs:
+        paths = find_sample_images(path) if os.path.isdir(path) else [path]
+        for image_path in paths:
+            with open(image_path, 'rb') as f:
+                images.append((os.path.basename(image_path), decode_and_resize(f, size)))
+    return images
+
+
+def recommend(leaf_scores, non_leaf_scores, thresholds, leaf_margin=3.0):
+    """The threshold to ship, and why"""
+    lowest_leaf, highest_other = min(leaf_scores), max(non_leaf_scores)
+    if highest_other < lowest_leaf:
+        threshold = (lowest_leaf + highest_other) / 2
+        reason = f"classes separate between {highest_other:.3f} and {lowest_leaf:.3f}; middle of the gap"
+    else:
+        def errors(threshold):
+            return (sum(score < threshold for score in leaf_scores)
+                    + sum(score >= threshold for score in non_leaf_scores))
+        # Ties go to the lower threshold: a rejected leaf costs the user an answer
+        threshold = min(thresholds, key=lambda threshold: (errors(threshold), threshold))
+        reason = f"classes overlap; fewest errors ({errors(threshold)})"
+
+    ceiling = lowest_leaf / leaf_margin
+    if threshold > ceiling:
+        threshold = ceiling
+        reason += f"; capped at the lowest leaf score / {leaf_margin:g}"
+    return round(threshold, 3), reason
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--leaves', nargs='+', default=[REFERENCE_LEAVES], help='Leaf images or folders')
+    parser.add_argument('--non-leaves', nargs='+', default=REFERENCE_NON_LEAVES,
+                        help='Non-leaf images or folders (synthetic ones are always added)')
+    parser.add_argument('--no-variants', action='store_true', help='Score the leaf images only as they are')
+    parser.add_argument('--size', type=int, default=256, help='Resize images to this square size first')
+    parser.add_argument('--thresholds', default='0.01,0.02,0.03,0.04,0.05,0.06,0.08,0.10,0.15')
+    parser.add_argument('--min-hue', type=float, help='Default: LEAF_GATE_MIN_HUE')
+    parser.add_argument('--max-hue', type=float, help='Default: LEAF_GATE_MAX_HUE')
+    parser.add_argument('--min-saturation', type=float, help='Default: LEAF_GATE_MIN_SATURATION')
+    parser.add_argument('--min-value', type=float, help='Default: LEAF_GATE_MIN_VALUE')
+    parser.add_argument('--stride', type=int, help='Default: LEAF_GATE_STRIDE')
+    parser.add_argument('--leaf-margin', type=float, default=3.0,
+                        help='Recommend no more than the lowest leaf score divided by this')
+    parser.add_argument('--show', type=int, default=5, help='List this many of the closest calls per class')
+    args = parser.parse_args()
+
+    from app.leaf_gate import LeafGate
+    from app.preprocessing import decode_and_resize
+
+    gate = LeafGate.from_env()
+    for setting in ('min_hue', 'max_hue', 'min_saturation', 'min_value', 'stride'):
+        if getattr(args, setting) is not None:
+            setattr(gate, setting, getattr(args, setting))
+    size = (args.size, args.size)
+
+    leaves = []
+    for name, image_array in load_set(args.leaves, size):
+        leaves.append((name, image_array))
+        if not args.no_variants:
+            leaves.extend((f"{name} ({variant})", pixels) for variant, pixels in leaf_variants(image_array).items())
+    non_leaves = load_set(args.non_leaves, size) + [
+        (name, decode_and_resize(encode(pixels), size)) for name, pixels in synthetic_non_leaves(args.size).items()
+    ]
+    if not leaves or not non_leaves:
+        sys.exit("Need at least one leaf and one non-leaf image")
+
+    leaf_scores = sorted((gate.leaf_ratio(image_array), name) for name, image_array in leaves)
+    non_leaf_scores = sorted(((gate.leaf_ratio(image_array), name) for name, image_array in non_leaves),
+                             reverse=True)
+
+    print(f"{len(leaves)} leaf and {len(non_leaves)} non-leaf images; hue {gate.min_hue:g}-{gate.max_hue:g}, "
+          f"saturation >= {gate.min_saturation:g}, value >= {gate.min_value:g}, stride {gate.stride}, "
+          f"current min_ratio {gate.min_ratio:g}")
+    print("\nLowest-scoring leaves:")
+    for score, name in leaf_scores[:args.show]:
+        print(f"{score:>8.3f}  {name}")
+    print("\nHighest-scoring non-leaves:")
+    for score, name in non_leaf_scores[:args.show]:
+        print(f"{score:>8.3f}  {name}")
+
+    thresholds = [float(value) for value in args.thresholds.split(',')]
+    print(f"\n{'min_ratio':>10}{'false reject':>14}{'false accept':>14}")
+    for threshold in thresholds:
+        false_reject = sum(score < threshold for score, _ in leaf_scores) / len(leaf_scores)
+        false_accept = sum(score >= threshold for score, _ in non_leaf_scores) / len(non_leaf_scores)
+        print(f"{threshold:>10.2f}{false_reject:>14.1%}{false_accept:>14.1%}")
+
+    threshold, reason = recommend([score for score, _ in leaf_scores], [score for score, _ in non_leaf_scores],
+                                  thresholds, args.leaf_margin)
+    print(f"\nRecommended LEAF_GATE_MIN_RATIO={threshold:g} ({reason})")
+
+
+if __name__ == '__main__':
+    main()
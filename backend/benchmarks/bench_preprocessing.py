@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+"""
+Compare decode+resize time and peak memory of the preprocessing backends.
+
+Each (backend, image) pair runs in its own process so peak RSS reflects that
+decode alone. Results are normalised per megapixel of the source image.
+Without --images, synthetic JPEG phone photos of --megapixels sizes are
+generated in a temporary folder.
+
+Usage:
+    python benchmarks/bench_preprocessing.py [--backends pil_full,pil,opencv] [--megapixels 3,12,24,48]
+    python benchmarks/bench_preprocessing.py --images path/to/photos [--runs 10]
+"""
+import os
+import sys
+import json
+import argparse
+import tempfile
+import subprocess
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(BACKEND_DIR)
+
+
+def make_photo(path, megapixels):
+    """Write a 4:3 JPEG of roughly the given size with some texture for the encoder"""
+    import numpy as np
+    from PIL import Image
+
+    width = int((megapixels * 1e6 * 4 / 3) ** 0.5)
+    height = int(width * 3 / 4)
+    rng = np.random.default_rng(0)
+    tile = rng.integers(0, 256, size=(256, 256, 3), dtype=np.uint8)
+    pixels = np.tile(tile, (height // 256 + 1, width // 256 + 1, 1))[:height, :width]
+    Image.fromarray(pixels).save(path, 'JPEG', quality=90)
+    return path
+
+
+def run_one(backend, path, runs):
+    """Measure one backend on one image inside this process and print the result as JSON"""
+    import time
+    from PIL import Image
+    from app.memory import peak_rss_mb
+    from app.preprocessing import decode_and_resize
+
+    # Import everything the backend needs before taking the baseline
+    if backend == 'opencv':
+        import cv2  # noqa: F401
+    with Image.open(path) as image:
+        megapixels = image.size[0] * image.size[1] / 1e6
+
+    baseline = peak_rss_mb()
+    timings = []
+    for _ in range(runs):
+        with open(path, 'rb') as f:
+            start = time.perf_counter()
+            decode_and_resize(f, backend=backend)
+            timings.append((time.perf_counter() - start) * 1000.0)
+    peak = peak_rss_mb()
+
+    timings.sort()
+    print(json.dumps({
+        'backend': backend,
+        'image': os.path.basename(path),
+        'megapixels': megapixels,
+        'p50_ms': timings[len(timings) // 2],
+        'peak_mb': max(0.0, peak - baseline),
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--backends', default='pil_full,pil,opencv')
+    parser.add_argument('--images', help='Folder of photos to use instead of synthetic ones')
+    parser.add_argument('--megapixels', default='3,12,24,48')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--child', nargs=2, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_one(args.child[0], args.child[1], args.runs)
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        if args.images:
+            from app.model_conversion import find_sample_images
+            paths = find_sample_images(args.images)
+        else:
+            paths = [
+                make_photo(os.path.join(tmp, f'{mp}mp.jpg'), float(mp))
+                for mp in args.megapixels.split(',')
+            ]
+
+        print(f"{'image':20}{'MP':>6}{'backend':>10}{'p50 ms':>10}{'ms/MP':>8}{'peak MB':>9}{'MB/MP':>8}")
+        for path in paths:
+            for backend in args.backends.split(','):
+                output = subprocess.run(
+                    [sys.executable, os.path.abspath(__file__), '--child', backend, path, '--runs', str(args.runs)],
+                    capture_output=True, text=True, cwd=BACKEND_DIR,
+                ).stdout.strip().splitlines()
+                if not output:
+                    print(f"{os.path.basename(path):20}{'':>6}{backend:>10}  failed")
+                    continue
+
+                result = json.loads(output[-1])
+                mp = result['megapixels']
+                print(f"{result['image']:20}{mp:>6.1f}{backend:>10}{result['p50_ms']:>10.1f}"
+                      f"{result['p50_ms'] / mp:>8.2f}{result['peak_mb']:>9.1f}{result['peak_mb'] / mp:>8.2f}")
+
+
+if __name__ == '__main__':
+    main()
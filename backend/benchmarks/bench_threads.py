@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+"""
+Sweep gunicorn workers x inference threads and report throughput and latency.
+
+For every (workers, threads) pair, `workers` processes are started with
+INFERENCE_INTRA_OP_THREADS=threads, the way gunicorn workers would be. Each
+one loads the model, warms up and, once all of them are ready, classifies
+--batch-size images back to back for --duration seconds. The report shows
+the combined throughput and the p50/p99 latency of a single call, so you can
+pick the sizing that fits your instance type.
+
+Usage:
+    python benchmarks/bench_threads.py [--backend pytorch] [--workers 1,2,4] [--threads 1,2,4]
+    python benchmarks/bench_threads.py --duration 30 --batch-size 4 --onednn false
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(BACKEND_DIR)
+
+
+def run_worker(backend, duration, batch_size):
+    """Child: load the model, report ready, wait for 'go' on stdin, then measure"""
+    import numpy as np
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'CropLeaf.settings')
+    os.environ['PREDICT_BATCHING_ENABLED'] = 'false'
+    os.environ['INFERENCE_POOL_ENABLED'] = 'false'
+
+    from app.model import ModelWrapper
+    from app.inference_threads import thread_settings
+
+    wrapper = ModelWrapper(backend=backend or None)
+    if wrapper.model_type is None:
+        print(json.dumps({'error': 'no model could be loaded'}), flush=True)
+        return
+
+    batch = np.random.default_rng(os.getpid()).integers(0, 256, size=(batch_size, 256, 256, 3), dtype=np.uint8)
+    wrapper.warmup(batch_size)
+    print(json.dumps({'ready': True, 'model_type': wrapper.model_type, 'threads': thread_settings()}), flush=True)
+    sys.stdin.readline()
+
+    latencies = []
+    deadline = time.perf_counter() + duration
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        wrapper.predict(batch)
+        latencies.append(time.perf_counter() - start)
+    print(json.dumps({'latencies': latencies}), flush=True)
+
+
+def run_configuration(workers, threads, args):
+    env = dict(os.environ)
+    env['INFERENCE_INTRA_OP_THREADS'] = str(threads)
+    env['INFERENCE_INTER_OP_THREADS'] = str(args.inter_op)
+    env['WEB_CONCURRENCY'] = str(workers)
+    if args.onednn:
+        env['INFERENCE_ONEDNN'] = args.onednn
+    # Let the child derive OMP/MKL counts from INFERENCE_INTRA_OP_THREADS
+    for variable in ('OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS',
+                     'TF_NUM_INTRAOP_THREADS', 'TF_NUM_INTEROP_THREADS'):
+        env.pop(variable, None)
+
+    command = [sys.executable, os.path.abspath(__file__), '--child',
+               '--backend', args.backend, '--duration', str(args.duration), '--batch-size', str(args.batch_size)]
+    children = [
+        subprocess.Popen(command, cwd=BACKEND_DIR, env=env, text=True,
+                         stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        for _ in range(workers)
+    ]
+
+    def last_json(child):
+        # Model loaders print progress; the protocol lines are the JSON ones
+        for line in child.stdout:
+            if line.startswith('{'):
+                return json.loads(line)
+        return {'error': f'worker exited with code {child.wait()}'}
+
+    try:
+        for child in children:
+            message = last_json(child)
+            if 'error' in message:
+                return message
+        for child in children:
+            child.stdin.write('go\n')
+            child.stdin.flush()
+        latencies = []
+        for child in children:
+            message = last_json(child)
+            if 'error' in message:
+                return message
+            latencies.extend(message['latencies'])
+    finally:
+        for child in children:
+            if child.poll() is None:
+                child.kill()
+
+    latencies.sort()
+    return {
+        'images_per_s': len(latencies) * args.batch_size / args.duration,
+        'p50_ms': latencies[len(latencies) // 2] * 1000.0,
+        'p99_ms': latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000.0,
+        'calls': len(latencies),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--backend', default='', help='MODEL_BACKEND to benchmark (default: MODEL_BACKEND or auto)')
+    parser.add_argument('--workers', default='1,2,4')
+    parser.add_argument('--threads', default='1,2,4')
+    parser.add_argument('--inter-op', type=int, default=1)
+    parser.add_argument('--onednn', choices=['true', 'false'], help='Force oneDNN on or off')
+    parser.add_argument('--duration', type=float, default=10.0, help='Seconds of load per configuration')
+    parser.add_argument('--batch-size', type=int, default=1)
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_worker(args.backend, args.duration, args.batch_size)
+        return
+
+    print(f"{os.cpu_count()} CPUs, batch size {args.batch_size}, {args.duration:.0f}s per configuration")
+    print(f"{'workers':>8}{'threads':>8}{'cores used':>11}{'img/s':>9}{'p50 ms':>9}{'p99 ms':>9}")
+    for workers in [int(value) for value in args.workers.split(',')]:
+        for threads in [int(value) for value in args.threads.split(',')]:
+            result = run_configuration(workers, threads, args)
+            if 'error' in result:
+                print(f"{workers:>8}{threads:>8}  failed: {result['error']}")
+                continue
+            print(f"{workers:>8}{threads:>8}{workers * threads:>11}{result['images_per_s']:>9.1f}"
+                  f"{result['p50_ms']:>9.1f}{result['p99_ms']:>9.1f}")
+
+
+if __name__ == '__main__':
+    main()
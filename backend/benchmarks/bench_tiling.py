@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+"""
+Measure tiled inference: tiles/s and peak memory per source format.
+
+Writes one synthetic high-resolution field image as an uncompressed TIFF
+(memory-mapped), a zlib-compressed tiled TIFF (decoded into a temporary
+memmap) and a JPEG (draft-decoded), then runs app.tiling.classify_tiles on
+each in a fresh process. Peak RSS is reported next to the RSS after the model
+alone was loaded, so the difference is what tiling cost. Pages of a
+memory-mapped TIFF count towards RSS once touched, but they are clean page
+cache the kernel can drop under pressure, unlike a decoded frame.
+
+Usage:
+    python benchmarks/bench_tiling.py [--backend pytorch] [--width 8000 --height 6000]
+    python benchmarks/bench_tiling.py --image path/to/orthomosaic.tif --tile-size 768 --overlap 0.25
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import resource
+import tempfile
+import subprocess
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(BACKEND_DIR)
+
+
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def make_field(path, width, height):
+    """A striped crop-row pattern written straight to disk, one band of rows at a time"""
+    import numpy as np
+    import tifffile
+    from PIL import Image
+
+    rng = np.random.default_rng(0)
+    band = 512
+
+    def bands():
+        for top in range(0, height, band):
+            rows = min(band, height - top)
+            block = rng.integers(0, 40, size=(rows, width, 3), dtype=np.uint8)
+            block[..., 1] += 110
+            block[:, (np.arange(width) // 200) % 3 == 0] = (110, 90, 70)  # soil between rows
+            yield block
+
+    if path.endswith('.jpg'):
+        image = Image.new('RGB', (width, height))
+        for index, block in enumerate(bands()):
+            image.paste(Image.fromarray(block), (0, index * band))
+        image.save(path, quality=90)
+    elif path.endswith('_zlib.tif'):
+        with tifffile.TiffWriter(path, bigtiff=True) as tif:
+            tif.write(np.concatenate(list(bands())), compression='zlib', tile=(256, 256))
+    else:
+        tifffile.imwrite(path, shape=(height, width, 3), dtype='uint8', bigtiff=True)
+        mapped = tifffile.memmap(path)
+        for index, block in enumerate(bands()):
+            mapped[index * band:index * band + len(block)] = block
+        mapped.flush()
+        del mapped
+    return path
+
+
+def run_child(args):
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'CropLeaf.settings')
+    os.environ['PREDICT_BATCHING_ENABLED'] = 'false'
+    os.environ['INFERENCE_POOL_ENABLED'] = 'false'
+
+    from app.model import ModelWrapper
+    from app.tiling import classify_tiles
+
+    wrapper = ModelWrapper(backend=args.backend or None)
+    if wrapper.model_type is None:
+        print(json.dumps({'error': 'no model could be loaded'}), flush=True)
+        return
+    wrapper.warmup(int(os.getenv('TILED_BATCH_SIZE', '16')))
+    model_rss = peak_rss_mb()
+
+    start = time.perf_counter()
+    result = classify_tiles(args.image, tile_size=args.tile_size, overlap=args.overlap, model_wrapper=wrapper)
+    seconds = time.perf_counter() - start
+    print(json.dumps({
+        'source': result['source'],
+        'tiles': result['tiles_total'],
+        'classified': result['tiles_classified'],
+        'tiles_per_s': result['tiles_total'] / seconds,
+        'open_ms': result['timings_ms']['open'],
+        'total_s': seconds,
+        'model_rss_mb': model_rss,
+        'peak_rss_mb': peak_rss_mb(),
+    }), flush=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--backend', default='', help='MODEL_BACKEND to classify with')
+    parser.add_argument('--image', help='Image to tile (default: synthetic TIFF, tiled TIFF and JPEG)')
+    parser.add_argument('--width', type=int, default=8000)
+    parser.add_argument('--height', type=int, default=6000)
+    parser.add_argument('--tile-size', type=int, default=None)
+    parser.add_argument('--overlap', type=float, default=None)
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args)
+        return
+
+    if args.image:
+        images = [args.image]
+    else:
+        directory = tempfile.mkdtemp()
+        images = [make_field(os.path.join(directory, name), args.width, args.height)
+                  for name in ('field.tif', 'field_zlib.tif', 'field.jpg')]
+        print(f"Synthetic {args.width}x{args.height} field "
+              f"({args.width * args.height * 3 / 1024 / 1024:.0f} MB decoded) in {directory}")
+
+    print(f"{'source':>20}{'tiles':>7}{'leaf':>6}{'tiles/s':>9}{'open ms':>9}{'total s':>9}"
+          f"{'model MB':>10}{'peak MB':>9}{'tiling MB':>11}")
+    for image in images:
+        command = [sys.executable, os.path.abspath(__file__), '--child', '--image', image, '--backend', args.backend]
+        if args.tile_size:
+            command += ['--tile-size', str(args.tile_size)]
+        if args.overlap is not None:
+            command += ['--overlap', str(args.overlap)]
+        output = subprocess.run(command, cwd=BACKEND_DIR, capture_output=True, text=True).stdout
+        lines = [line for line in output.splitlines() if line.startswith('{')]
+        result = json.loads(lines[-1]) if lines else {'error': 'benchmark process failed'}
+        if 'error' in result:
+            print(f"{os.path.basename(image):>20}  failed: {result['error']}")
+            continue
+        print(f"{result['source']:>20}{result['tiles']:>7}{result['classified']:>6}{result['tiles_per_s']:>9.1f}"
+              f"{result['open_ms']:>9.1f}{result['total_s']:>9.1f}{result['model_rss_mb']:>10.0f}"
+              f"{result['peak_rss_mb']:>9.0f}{result['peak_rss_mb'] - result['model_rss_mb']:>11.0f}")
+
+
+if __name__ == '__main__':
+    main()
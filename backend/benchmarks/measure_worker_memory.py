@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+"""
+Measure per-worker memory of gunicorn with and without preload_app.
+
+Starts gunicorn from backend/ with gunicorn.conf.py twice (GUNICORN_PRELOAD
+false, then true), waits for the workers' memory to settle, and reports
+RSS, PSS and unique (USS) memory per worker. USS is the memory each extra
+worker really costs; with preloading the model weights move from USS into
+pages shared with the master.
+
+Usage:
+    python benchmarks/measure_worker_memory.py [--workers 3] [--port 8765]
+    python benchmarks/measure_worker_memory.py --pid <gunicorn master pid>
+"""
+import os
+import sys
+import time
+import signal
+import argparse
+import subprocess
+import urllib.request
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(BACKEND_DIR)
+
+from app.memory import memory_breakdown, child_pids
+
+
+def worker_memory(master_pid):
+    return [(pid, memory_breakdown(pid)) for pid in child_pids(master_pid)]
+
+
+def wait_until_settled(master_pid, workers, port, timeout=600):
+    """Wait until all workers are up and their RSS stops growing"""
+    deadline = time.time() + timeout
+    previous = None
+    while time.time() < deadline:
+        # Any request makes a worker resolve the URLconf and import views.py
+        for _ in range(workers * 2):
+            try:
+                urllib.request.urlopen(f"http://127.0.0.1:{port}/__warmup__", timeout=30)
+            except Exception:
+                pass
+
+        pids = child_pids(master_pid)
+        if len(pids) >= workers:
+            current = sum(memory_breakdown(pid)['rss_mb'] for pid in pids)
+            if previous is not None and abs(current - previous) < 5:
+                return
+            previous = current
+        time.sleep(5)
+    print("Warning: workers did not settle before the timeout")
+
+
+def run_gunicorn(preload, workers, port):
+    env = dict(os.environ, GUNICORN_PRELOAD='true' if preload else 'false', WEB_CONCURRENCY=str(workers))
+    process = subprocess.Popen(
+        ['gunicorn', 'CropLeaf.wsgi', '--config', 'gunicorn.conf.py', '--bind', f'127.0.0.1:{port}'],
+        cwd=BACKEND_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        wait_until_settled(process.pid, workers, port)
+        return memory_breakdown(process.pid), worker_memory(process.pid)
+    finally:
+        process.send_signal(signal.SIGTERM)
+        process.wait(timeout=60)
+
+
+def print_report(label, master, workers):
+    print(f"\n{label}")
+    print(f"{'process':>10}{'RSS MB':>10}{'PSS MB':>10}{'USS MB':>10}{'shared MB':>11}")
+    print(f"{'master':>10}{master['rss_mb']:>10.0f}{master['pss_mb']:>10.0f}{master['uss_mb']:>10.0f}{master['shared_mb']:>11.0f}")
+    for pid, memory in workers:
+        print(f"{pid:>10}{memory['rss_mb']:>10.0f}{memory['pss_mb']:>10.0f}{memory['uss_mb']:>10.0f}{memory['shared_mb']:>11.0f}")
+    if workers:
+        mean_uss = sum(memory['uss_mb'] for _, memory in workers) / len(workers)
+        total_pss = master['pss_mb'] + sum(memory['pss_mb'] for _, memory in workers)
+        print(f"mean worker USS: {mean_uss:.0f} MB, total PSS: {total_pss:.0f} MB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', type=int, default=3)
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--pid', type=int, help='Report on an already running gunicorn master instead')
+    args = parser.parse_args()
+
+    if args.pid:
+        print_report(f"gunicorn master {args.pid}", memory_breakdown(args.pid), worker_memory(args.pid))
+        return
+
+    for preload in (False, True):
+        master, workers = run_gunicorn(preload, args.workers, args.port)
+        print_report(f"preload_app={preload}", master, workers)
+
+
+if __name__ == '__main__':
+    main()
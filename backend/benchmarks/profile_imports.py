@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+"""
+Profile what the backend imports at startup with python -X importtime.
+
+Each scenario runs in a fresh interpreter. For every scenario the report
+shows wall time, the cumulative import time of the slowest top-level
+packages, and whether any ML framework (TensorFlow, torch, torchvision,
+OpenCV, ONNX Runtime) was imported. Only the 'inference' scenario, which
+loads a model, should import a framework.
+
+Usage:
+    python benchmarks/profile_imports.py [--top 15] [--output benchmarks/import_profile.txt]
+    python benchmarks/profile_imports.py --scenarios django_setup,urlconf
+"""
+import os
+import sys
+import time
+import argparse
+import subprocess
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+FRAMEWORKS = ('tensorflow', 'torch', 'torchvision', 'cv2', 'onnxruntime', 'ultralytics')
+
+SETUP = (
+    "import os; os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'CropLeaf.settings'); "
+    "import django; django.setup(); "
+)
+
+SCENARIOS = {
+    # What every management command (migrate, collectstatic, check) pays
+    'django_setup': SETUP,
+    # What a web worker pays before serving its first request
+    'urlconf': SETUP + "from django.urls import get_resolver; get_resolver().url_patterns",
+    # The release-phase check from build.sh
+    'manage_check': None,
+    # First inference: the only scenario that should import a framework
+    'inference': SETUP + "from app.model import model_registry; model_registry.get()",
+}
+
+
+def parse_importtime(stderr):
+    """Return {module: (self_us, cumulative_us, depth)} from -X importtime output"""
+    modules = {}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        try:
+            self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        except ValueError:
+            continue
+        depth = (len(name) - len(name.lstrip())) // 2
+        modules[name.strip()] = (int(self_us), int(cumulative_us), depth)
+    return modules
+
+
+def run_scenario(name):
+    if name == 'manage_check':
+        command = [sys.executable, '-X', 'importtime', 'manage.py', 'check']
+    else:
+        command = [sys.executable, '-X', 'importtime', '-c', SCENARIOS[name]]
+
+    start = time.perf_counter()
+    process = subprocess.run(command, capture_output=True, text=True, cwd=BACKEND_DIR)
+    wall = time.perf_counter() - start
+    return wall, process.returncode, parse_importtime(process.stderr)
+
+
+def format_report(results, top):
+    lines = []
+    for name, (wall, returncode, modules) in results.items():
+        frameworks = [module for module in FRAMEWORKS if module in modules]
+        total = sum(self_us for self_us, _, _ in modules.values()) / 1e6
+        status = '' if returncode == 0 else f'  (exit code {returncode})'
+
+        lines.append(f"== {name}{status}")
+        lines.append(f"wall time {wall:.2f}s, import time {total:.2f}s, {len(modules)} modules")
+        lines.append(f"frameworks imported: {', '.join(frameworks) if frameworks else 'none'}")
+
+        # Top-level packages only; their cumulative time includes everything below them
+        packages = sorted(
+            ((cumulative, module) for module, (_, cumulative, _) in modules.items() if '.' not in module),
+            reverse=True,
+        )
+        for cumulative, module in packages[:top]:
+            lines.append(f"  {cumulative / 1000:>9.1f} ms  {module}")
+        lines.append('')
+    return '\n'.join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS))
+    parser.add_argument('--top', type=int, default=15, help='Slowest top-level packages to list per scenario')
+    parser.add_argument('--output', help='Also write the report to this file')
+    args = parser.parse_args()
+
+    results = {}
+    for name in args.scenarios.split(','):
+        if name not in SCENARIOS:
+            parser.error(f"Unknown scenario '{name}', expected one of {', '.join(SCENARIOS)}")
+        results[name] = run_scenario(name)
+
+    report = format_report(results, args.top)
+    print(report)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(f"# python -X importtime profile, Python {sys.version.split()[0]}\n")
+            f.write(f"# generated by benchmarks/profile_imports.py\n\n")
+            f.write(report)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+"""
+Production serving profile for gunicorn.
+
+With preload_app the Django app, and with it the ML model weights, is
+imported once in the master before workers are forked. Workers then share
+those pages copy-on-write instead of each holding a private copy.
+
+gunicorn picks this file up automatically when started from backend/;
+from the repository root pass --config backend/gunicorn.conf.py.
+"""
+import gc
+import os
+
+workers = int(os.getenv('WEB_CONCURRENCY', '2'))
+threads = int(os.getenv('GUNICORN_THREADS', '4'))
+worker_class = 'gthread' if threads > 1 else 'sync'
+timeout = int(os.getenv('GUNICORN_TIMEOUT', '120'))
+preload_app = os.getenv('GUNICORN_PRELOAD', 'true').lower() == 'true'
+prewarm_models = os.getenv('MODEL_PREWARM', 'true').lower() == 'true'
+
+
+def when_ready(server):
+    if not preload_app:
+        return
+
+    # Models load lazily, so load the weights here, before the fork. The warmup
+    # inference runs per worker (post_worker_init) so framework thread pools are
+    # created after the fork rather than inherited from the master. Only do this
+    # when the files are already on disk: a download would hold up the master,
+    # so leave it to the workers' background loaders instead
+    try:
+        from app.model import model_registry, local_model_files_present
+        from app.model_evaluation import candidate_evaluator
+        if os.getenv('INFERENCE_POOL_ENABLED', 'false').lower() == 'true':
+            # Each worker starts its own model processes; nothing to share from here
+            server.log.info("Inference pool enabled; models load in the pool processes")
+        elif local_model_files_present():
+            model_registry.prewarm(warmup=False)
+            candidate_evaluator.prewarm(warmup=False)
+        else:
+            server.log.info("Model files not downloaded yet; workers will fetch them in the background")
+    except Exception as e:
+        print(f"Could not preload models: {str(e)}")
+
+    # views.py is only imported when the URLconf is first resolved, so load it
+    # here too; otherwise every worker would import it again after the fork
+    try:
+        from django.urls import get_resolver
+        get_resolver().url_patterns
+    except Exception as e:
+        print(f"Could not preload URLconf: {str(e)}")
+
+    # Move everything loaded so far out of the garbage collector's reach so
+    # collections in workers do not write to (and un-share) the model pages
+    gc.collect()
+    gc.freeze()
+    server.log.info("Application preloaded in master; workers will share model weights copy-on-write")
+
+
+def pre_fork(server, worker):
+    # Pick up objects created since when_ready (e.g. by a restarted worker's master bookkeeping)
+    gc.freeze()
+
+
+def post_worker_init(worker):
+    # Load (without preload) and warm the models in a background thread so the
+    # worker starts answering at once; /api/health/ready/ reports 'loading'
+    # until this finishes
+    if prewarm_models:
+        from app.model import model_registry
+        from app.model_evaluation import candidate_evaluator
+        model_registry.load_in_background()
+        candidate_evaluator.load_in_background()